@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books_api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,10 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'books_api.replicas.ReadReplicaMiddleware',
+    'books_api.group_commit.GroupCommitMiddleware',
+    'books_api.middleware.AtomicWritesMiddleware',
+    'books_api.sqlite.MaintenanceMiddleware',
 ]
 
 ROOT_URLCONF = 'books.urls'
@@ -78,7 +84,7 @@ WSGI_APPLICATION = 'books.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('BOOKS_API_DATABASE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -123,3 +129,162 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Books API
+# Page size used by the list endpoints when the client does not send ?limit=,
+# and the hard cap applied to ?limit= itself.
+
+BOOKS_API_PAGE_SIZE = 100
+BOOKS_API_MAX_PAGE_SIZE = 1000
+
+# Rows fetched per round trip by the NDJSON export mode of the list endpoints.
+
+BOOKS_API_STREAM_CHUNK_SIZE = 2000
+
+# Bulk creation: POSTing a JSON array to a list endpoint creates all items in
+# one transaction. Arrays longer than BOOKS_API_MAX_BULK_SIZE are rejected;
+# rows are inserted BOOKS_API_BULK_BATCH_SIZE at a time.
+
+BOOKS_API_MAX_BULK_SIZE = 10000
+BOOKS_API_BULK_BATCH_SIZE = 500
+
+# Response cache for the GET endpoints (see books_api/response_cache.py).
+# The default file based backend is shared by all the gunicorn workers of the
+# container, which is what makes invalidation visible to all of them. Set
+# BOOKS_API_REDIS_URL to use Redis instead.
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('BOOKS_API_CACHE_DIR', '/tmp/books_api_cache'),
+    }
+}
+
+if os.environ.get('BOOKS_API_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['BOOKS_API_REDIS_URL'],
+    }
+
+BOOKS_API_CACHE_ENABLED = True
+BOOKS_API_CACHE_ALIAS = 'default'
+BOOKS_API_CACHE_TIMEOUT = 300
+
+# SQLite tuning (see books_api/sqlite.py). `production` enables WAL, mmap and
+# a busy timeout on every connection, keeps connections open between requests
+# and starts write transactions with BEGIN IMMEDIATE; `default` leaves SQLite
+# as it comes. Single pragmas can be overridden in BOOKS_API_SQLITE_PRAGMAS.
+# Every worker checkpoints the WAL and runs PRAGMA optimize at most once per
+# BOOKS_API_SQLITE_MAINTENANCE_INTERVAL seconds (0 disables it).
+# runserver and the tests get `default`; the Docker image sets
+# BOOKS_API_SQLITE_PROFILE=production.
+
+BOOKS_API_SQLITE_PROFILE = os.environ.get('BOOKS_API_SQLITE_PROFILE', 'default')
+BOOKS_API_SQLITE_PRAGMAS = {}
+BOOKS_API_SQLITE_MAINTENANCE_INTERVAL = 300
+
+if BOOKS_API_SQLITE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    })
+
+# Async mode: the list and detail endpoints are served by the async views in
+# books_api/async_views.py, and start-server.sh runs Gunicorn with Uvicorn
+# workers on books.asgi instead of sync workers on books.wsgi.
+
+BOOKS_API_ASYNC = os.environ.get('BOOKS_API_ASYNC', '') in ('1', 'true')
+
+if BOOKS_API_ASYNC:
+    # Under ASGI every request runs its sync code (and so its database
+    # queries) in a thread of its own; a persistent connection would outlive
+    # that thread and leak.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Signed bearer tokens (see books_api/tokens.py), issued by POST /api/token
+# and valid for BOOKS_API_TOKEN_MAX_AGE seconds. Each worker caches whether a
+# user is active and its token generation for BOOKS_API_TOKEN_CACHE_TTL
+# seconds, which is also how long a revoked token may still be accepted.
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+        'books_api.tokens.SignedTokenAuthentication',
+    ],
+}
+
+BOOKS_API_TOKEN_MAX_AGE = 24 * 3600
+BOOKS_API_TOKEN_CACHE_TTL = 30
+
+# Request metrics (see books_api/metrics.py), served at /metrics in the
+# Prometheus text format. Each worker writes its figures to
+# BOOKS_API_METRICS_DIR at most once per BOOKS_API_METRICS_FLUSH_INTERVAL
+# seconds, which bounds how old the figures /metrics adds up can be.
+
+BOOKS_API_METRICS_ENABLED = True
+BOOKS_API_METRICS_DIR = os.environ.get('BOOKS_API_METRICS_DIR', '/tmp/books_api_metrics')
+BOOKS_API_METRICS_FLUSH_INTERVAL = 1
+
+# Precompressed catalog snapshots (see books_api/snapshots.py), downloaded
+# from /api/snapshot. `build_snapshot --watch` rebuilds them
+# BOOKS_API_SNAPSHOT_DEBOUNCE seconds after the last write, and at most
+# BOOKS_API_SNAPSHOT_MAX_DELAY seconds after the first one. With
+# BOOKS_API_SNAPSHOT_ACCEL_PREFIX set (the internal nginx location of
+# BOOKS_API_SNAPSHOT_DIR), nginx sends the files instead of Django.
+
+BOOKS_API_SNAPSHOT_ENABLED = True
+BOOKS_API_SNAPSHOT_DIR = os.environ.get('BOOKS_API_SNAPSHOT_DIR', '/tmp/books_api_snapshots')
+BOOKS_API_SNAPSHOT_ACCEL_PREFIX = os.environ.get('BOOKS_API_SNAPSHOT_ACCEL_PREFIX', '')
+BOOKS_API_SNAPSHOT_DEBOUNCE = 10
+BOOKS_API_SNAPSHOT_MAX_DELAY = 300
+BOOKS_API_SNAPSHOT_KEEP = 2
+
+# Batch requests: POST /api/batch runs up to BOOKS_API_BATCH_MAX_OPERATIONS
+# API requests in one transaction (see books_api/batch.py).
+
+BOOKS_API_BATCH_MAX_OPERATIONS = 50
+
+# Changes feed (see books_api/changes.py): every write is logged, and
+# /api/changes?since=<seq> returns what changed since. `prune_changes`
+# compacts the log and deletes the changes older than
+# BOOKS_API_CHANGES_RETENTION_DAYS; clients further behind must resync.
+
+BOOKS_API_CHANGES_RETENTION_DAYS = 30
+
+# Read replicas (see books_api/replicas.py). With BOOKS_API_READ_REPLICA=1,
+# GET requests read the catalog from the databases in
+# BOOKS_API_READ_DATABASES, copies of the primary that `sync_replica --watch`
+# refreshes every BOOKS_API_REPLICA_SYNC_INTERVAL seconds. A replica last
+# synced more than BOOKS_API_REPLICA_MAX_LAG seconds ago is not read, which
+# bounds how stale reads can be, and clients read their own writes from the
+# primary until a replica has them. A response read from a replica goes into
+# the response cache only if the replica was copied after the last write it
+# depends on; until the next copy, such reads miss the cache.
+
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('BOOKS_API_REPLICA_PATH', BASE_DIR / 'db.replica.sqlite3'),
+}
+DATABASE_ROUTERS = ['books_api.replicas.ReadReplicaRouter']
+
+BOOKS_API_READ_DATABASES = ['replica'] if os.environ.get('BOOKS_API_READ_REPLICA', '') in ('1', 'true') else []
+BOOKS_API_REPLICA_STATE_DIR = os.environ.get('BOOKS_API_REPLICA_STATE_DIR', '/tmp/books_api_replicas')
+BOOKS_API_REPLICA_SYNC_INTERVAL = 2
+BOOKS_API_REPLICA_MAX_LAG = 10
+
+# Group commit (see books_api/group_commit.py): with
+# BOOKS_API_GROUP_COMMIT=1, workers hand write requests to the `run_writer`
+# process over BOOKS_API_GROUP_COMMIT_SOCKET, which runs the requests that
+# arrive together, up to BOOKS_API_GROUP_COMMIT_MAX_BATCH, in one
+# transaction. Workers wait up to BOOKS_API_GROUP_COMMIT_TIMEOUT seconds for
+# the answer. The socket only accepts its owner; keep it in a directory
+# private to the user the workers run as.
+
+BOOKS_API_GROUP_COMMIT = os.environ.get('BOOKS_API_GROUP_COMMIT', '') in ('1', 'true')
+BOOKS_API_GROUP_COMMIT_SOCKET = os.environ.get('BOOKS_API_GROUP_COMMIT_SOCKET', '/run/books_api/writer.sock')
+BOOKS_API_GROUP_COMMIT_MAX_BATCH = 64
+BOOKS_API_GROUP_COMMIT_TIMEOUT = 30
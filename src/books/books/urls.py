@@ -17,9 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from books_api import urls as books_urls
+from books_api.views import MetricsApiView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('books/', include(books_urls)),
+    path('metrics', MetricsApiView.as_view(), name='metrics'),
 ]
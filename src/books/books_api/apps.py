@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BooksApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books_api'
+
+    def ready(self):
+        from . import metrics, signals, sqlite  # noqa: F401
@@ -0,0 +1,408 @@
+"""
+Async implementations of the list and detail endpoints, used instead of the
+ones in views.py when BOOKS_API_ASYNC is on and the app is served over ASGI
+(see books_api/urls.py and start-server.sh).
+
+DRF views cannot be async, so these are plain Django views that reuse the
+same mixins, serializers, pagination and response cache, read with the
+async ORM and render with DRF's JSONRenderer, which keeps their output
+byte for byte identical to the sync views. Validation and writes go through
+the regular serializers and model signals, which are synchronous and run
+in the request's thread.
+
+The endpoints not listed here (nested lists, links, search, stats) keep
+their sync view; Django runs it in a thread under ASGI.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from rest_framework import serializers, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import AuthenticationFailed, MethodNotAllowed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from . import metrics
+from .bulk import BulkCreateMixin
+from .conditional import ConditionalMixin
+from .expansion import BookExpandMixin
+from .fieldsets import SparseFieldsetMixin
+from .filters import ListFilterMixin
+from .models import Author, Book, Editorial
+from .pagination import KeysetPagination
+from .projection import ValuesListMixin
+from .response_cache import cached_response
+from .serializers import AuthorSerializer, BookSerializer, EditorialSerializer
+from .streaming import NDJSONRenderer, StreamingListMixin
+
+
+class AsyncAPIView(View):
+    '''
+    The bits of APIView the async endpoints need: a DRF Request (parsed
+    data, query_params), authentication, IsAuthenticated, DRF error
+    responses and JSON rendering.
+
+    Session users are loaded with request.auser(); requests carrying an
+    Authorization header go through DRF's authentication classes in a
+    thread, as those are synchronous. Batch sub-requests come with their
+    user already authenticated (see BatchMixin).
+    '''
+
+    json_renderer_class = JSONRenderer
+
+    async def authenticate(self, request):
+        if getattr(request._request, '_force_auth_user', None) is not None:
+            return request.user
+        if 'HTTP_AUTHORIZATION' in request.META:
+            return await sync_to_async(lambda: request.user)()
+        user = await request._request.auser()
+        if user.is_authenticated and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            SessionAuthentication().enforce_csrf(request)
+        request.user = user
+        return user
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+        if NDJSONRenderer.media_type in request.META.get('HTTP_ACCEPT', ''):
+            request.accepted_renderer = NDJSONRenderer()
+        try:
+            user = await self.authenticate(request)
+            if not user.is_authenticated:
+                raise NotAuthenticated()
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                raise MethodNotAllowed(request.method)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(request, exc)
+        return self.finalize_response(response)
+
+    def handle_exception(self, request, exc):
+        '''
+        Same as APIView.handle_exception: unauthenticated requests get a 403
+        unless the first authentication class can ask for credentials
+        '''
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            authenticate_header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+            if authenticate_header:
+                exc.auth_header = authenticate_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        response = exception_handler(exc, {'view': self, 'request': request})
+        if response is None:
+            raise exc
+        return response
+
+    def finalize_response(self, response):
+        if not isinstance(response, Response):
+            return response
+        with metrics.rendering():
+            content = self.json_renderer_class().render(response.data)
+        rendered = HttpResponse(
+            content,
+            status=response.status_code,
+            content_type='application/json',
+        )
+        for header, value in response.headers.items():
+            if header.lower() != 'content-type':
+                rendered[header] = value
+        return rendered
+
+    async def acreate(self, serializer):
+        '''
+        Validates the serializer and creates its instance with acreate()
+        '''
+        if not await sync_to_async(serializer.is_valid)():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer.instance = await serializer.Meta.model.objects.acreate(**serializer.validated_data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    async def aupdate(self, serializer):
+        '''
+        Validates the serializer and saves its instance with asave()
+        '''
+        if not await sync_to_async(serializer.is_valid)():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        for attr, value in serializer.validated_data.items():
+            setattr(serializer.instance, attr, value)
+        await serializer.instance.asave()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AsyncEditorialListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, BulkCreateMixin, StreamingListMixin, AsyncAPIView):
+    cache_tags = ['editorial-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['name', 'book_count']
+
+    @cached_response
+    async def get(self, request, *args, **kwars):
+        '''
+        List the Editorial items in the system, one page at a time
+        '''
+        fields = self.get_fieldset(request, EditorialSerializer)
+        editorials = Editorial.objects.all()
+        etag, _ = await self.aget_queryset_validators(request, editorials, fields=fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.astream_response(editorials, EditorialSerializer, context={'fields': fields}), etag)
+        paginator = self.pagination_class()
+        rows = await paginator.apaginate_values(editorials, EditorialSerializer.value_columns(fields=fields), request, view=self)
+        return self.set_validators(paginator.get_paginated_response(EditorialSerializer.from_values(rows, fields=fields)), etag)
+
+    async def post(self, request, *args, **kwargs):
+        '''
+        Creates an Editorial with given data, or one Editorial per item if
+        given a list
+        '''
+        if self.is_bulk(request):
+            return await sync_to_async(self.bulk_create)(request, EditorialSerializer, ['name'])
+        data = {
+            'name': request.data.get('name'),
+        }
+        return await self.acreate(EditorialSerializer(data=data))
+
+
+class AsyncAuthorListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, ListFilterMixin, BulkCreateMixin, StreamingListMixin, AsyncAPIView):
+    cache_tags = ['author-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['lastname', 'birthdate', 'book_count']
+    filter_fields = {
+        'lastname_prefix': ('lastname', 'prefix', serializers.CharField()),
+        'birthdate_after': ('birthdate', 'gte', serializers.DateField()),
+        'birthdate_before': ('birthdate', 'lte', serializers.DateField()),
+    }
+
+    @cached_response
+    async def get(self, request, *args, **kwars):
+        '''
+        List the Author items in the system, one page at a time
+        '''
+        fields = self.get_fieldset(request, AuthorSerializer)
+        authors = self.filter_queryset(request, Author.objects.all())
+        etag, _ = await self.aget_queryset_validators(request, authors, fields=fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.astream_response(authors, AuthorSerializer, context={'fields': fields}), etag)
+        paginator = self.pagination_class()
+        page = self.filter_queryset(request, Author.objects.all(), paginator.get_ordering(request, self))
+        rows = await paginator.apaginate_values(page, AuthorSerializer.value_columns(fields=fields), request, view=self)
+        return self.set_validators(paginator.get_paginated_response(AuthorSerializer.from_values(rows, fields=fields)), etag)
+
+    async def post(self, request, *args, **kwargs):
+        '''
+        Creates an Author with given data, or one Author per item if
+        given a list
+        '''
+        if self.is_bulk(request):
+            return await sync_to_async(self.bulk_create)(request, AuthorSerializer, ['firstname', 'lastname', 'birthdate'])
+        data = {
+            'firstname': request.data.get('firstname'),
+            'lastname': request.data.get('lastname'),
+            'birthdate': request.data.get('birthdate'),
+        }
+        return await self.acreate(AuthorSerializer(data=data))
+
+
+class AsyncBookListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, ListFilterMixin, BulkCreateMixin, BookExpandMixin, StreamingListMixin, AsyncAPIView):
+    cache_tags = ['book-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['title', 'pub_date', 'author_count']
+    filter_fields = {
+        'pub_date_after': ('pub_date', 'gte', serializers.DateField()),
+        'pub_date_before': ('pub_date', 'lte', serializers.DateField()),
+        'editorial': ('editorial', 'exact', serializers.IntegerField()),
+        'author': ('author', 'exact', serializers.IntegerField()),
+        'title_prefix': ('title', 'prefix', serializers.CharField()),
+    }
+
+    @cached_response
+    async def get(self, request, *args, **kwars):
+        '''
+        List the Book items in the system, one page at a time
+        '''
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
+        books = self.filter_queryset(request, Book.objects.all())
+        etag, _ = await self.aget_queryset_validators(request, books, expand, fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.astream_response(books, BookSerializer, context={'expand': expand, 'fields': fields}), etag)
+        paginator = self.pagination_class()
+        page = self.filter_queryset(request, Book.objects.all(), paginator.get_ordering(request, self))
+        rows = await paginator.apaginate_values(page, BookSerializer.value_columns(expand, fields), request, view=self)
+        data = await BookSerializer.afrom_values(rows, expand, fields)
+        return self.set_validators(paginator.get_paginated_response(data), etag)
+
+    async def post(self, request, *args, **kwargs):
+        '''
+        Creates a Book with given data, or one Book per item if
+        given a list
+        '''
+        if self.is_bulk(request):
+            return await sync_to_async(self.bulk_create)(request, BookSerializer, ['title', 'description', 'pub_date', 'editorial'])
+        data = {
+            'title': request.data.get('title'),
+            'description': request.data.get('description'),
+            'pub_date': request.data.get('pub_date'),
+            'editorial': request.data.get('editorial'),
+        }
+        return await self.acreate(BookSerializer(data=data))
+
+
+class AsyncEditorialDetailApiView(ConditionalMixin, SparseFieldsetMixin, AsyncAPIView):
+    cache_tags = ['editorial:{editorial_id}']
+
+    @cached_response
+    async def get(self, request, editorial_id, *args, **kwargs):
+        '''
+        Retrieves the Editorial with given editorial_id
+        '''
+        fields = self.get_fieldset(request, EditorialSerializer)
+        editorial = await aget_object_or_404(self.only_queryset(Editorial.objects.all(), EditorialSerializer, fields), pk=editorial_id)
+        etag, last_modified = self.get_instance_validators(editorial, fields=fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = EditorialSerializer(editorial, context={'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
+
+    async def put(self, request, editorial_id, *args, **kwargs):
+        '''
+        Updates the Editorial item with given editorial_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
+        '''
+        editorial = await aget_object_or_404(Editorial, pk=editorial_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(editorial))
+        if precondition_failed is not None:
+            return precondition_failed
+        data = {
+            'name': request.data.get('name'),
+        }
+        response = await self.aupdate(EditorialSerializer(instance=editorial, data=data, partial=True))
+        if response.status_code == status.HTTP_200_OK:
+            self.set_validators(response, *self.get_instance_validators(editorial))
+        return response
+
+    async def delete(self, request, editorial_id, *args, **kwargs):
+        '''
+        Deletes the Editorial item with given editorial_id if exists
+        '''
+        editorial = await aget_object_or_404(Editorial, pk=editorial_id)
+        await editorial.adelete()
+        return Response(
+            {"res": "Editorial deleted!"},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncAuthorDetailApiView(ConditionalMixin, SparseFieldsetMixin, AsyncAPIView):
+    cache_tags = ['author:{author_id}']
+
+    @cached_response
+    async def get(self, request, author_id, *args, **kwargs):
+        '''
+        Retrieves the Author with given author_id
+        '''
+        fields = self.get_fieldset(request, AuthorSerializer)
+        author = await aget_object_or_404(self.only_queryset(Author.objects.all(), AuthorSerializer, fields), pk=author_id)
+        etag, last_modified = self.get_instance_validators(author, fields=fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = AuthorSerializer(author, context={'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
+
+    async def put(self, request, author_id, *args, **kwargs):
+        '''
+        Updates the Author item with given author_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
+        '''
+        author = await aget_object_or_404(Author, pk=author_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(author))
+        if precondition_failed is not None:
+            return precondition_failed
+        data = {
+            'firstname': request.data.get('firstname') or author.firstname,
+            'lastname': request.data.get('lastname') or author.lastname,
+            'birthdate': request.data.get('birthdate') or author.birthdate,
+        }
+        response = await self.aupdate(AuthorSerializer(instance=author, data=data, partial=True))
+        if response.status_code == status.HTTP_200_OK:
+            self.set_validators(response, *self.get_instance_validators(author))
+        return response
+
+    async def delete(self, request, author_id, *args, **kwargs):
+        '''
+        Deletes the Author item with given author_id if exists
+        '''
+        author = await aget_object_or_404(Author, pk=author_id)
+        await author.adelete()
+        return Response(
+            {"res": "Author deleted!"},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncBookDetailApiView(ConditionalMixin, SparseFieldsetMixin, BookExpandMixin, AsyncAPIView):
+    cache_tags = ['book:{book_id}']
+
+    @cached_response
+    async def get(self, request, book_id, *args, **kwargs):
+        '''
+        Retrieves the Book with given book_id
+        '''
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
+        books = self.only_queryset(self.expand_queryset(Book.objects.all(), expand), BookSerializer, fields, expand)
+        book = await aget_object_or_404(books, pk=book_id)
+        etag, last_modified = self.get_instance_validators(book, expand, fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = BookSerializer(book, context={'expand': expand, 'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
+
+    async def put(self, request, book_id, *args, **kwargs):
+        '''
+        Updates the Book item with given book_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
+        '''
+        book = await aget_object_or_404(Book, pk=book_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(book))
+        if precondition_failed is not None:
+            return precondition_failed
+        data = {
+            'title': request.data.get('title') or book.title,
+            'description': request.data.get('description') or book.description,
+            'pub_date': request.data.get('pub_date') or book.pub_date,
+        }
+        response = await self.aupdate(BookSerializer(instance=book, data=data, partial=True))
+        if response.status_code == status.HTTP_200_OK:
+            self.set_validators(response, *self.get_instance_validators(book))
+        return response
+
+    async def delete(self, request, book_id, *args, **kwargs):
+        '''
+        Deletes the Book item with given book_id if exists
+        '''
+        book = await aget_object_or_404(Book, pk=book_id)
+        await book.adelete()
+        return Response(
+            {"res": "Book deleted!"},
+            status=status.HTTP_200_OK
+        )
@@ -0,0 +1,170 @@
+import io
+import json
+import re
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+from rest_framework.response import Response
+
+from . import response_cache
+
+REFERENCE = re.compile(r'\{([A-Za-z_][\w-]*(?:\.[\w-]+)+)\}')
+# Request headers every sub-request inherits from the batch request.
+INHERITED_META = ('HTTP_HOST', 'SERVER_NAME', 'SERVER_PORT', 'REMOTE_ADDR', 'wsgi.url_scheme', 'HTTP_X_FORWARDED_PROTO')
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+    ref = serializers.RegexField(r'^[A-Za-z_][\w-]*$', required=False)
+
+
+class UnresolvedReference(Exception):
+    pass
+
+
+def lookup(refs, reference):
+    '''
+    Returns the value `name.field[.field...]` points to in the result of
+    the operation named `name`; list items are reached by index
+    '''
+    name, *keys = reference.split('.')
+    if name not in refs:
+        raise UnresolvedReference(f"Unknown reference '{name}'.")
+    value = refs[name]
+    for key in keys:
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise UnresolvedReference(f"Reference '{reference}' does not exist.")
+    return value
+
+
+def substitute(data, refs):
+    '''
+    Replaces every {"$ref": "name.field"} object in a request body by the
+    value it points to
+    '''
+    if isinstance(data, dict):
+        if set(data) == {'$ref'} and isinstance(data['$ref'], str):
+            return lookup(refs, data['$ref'])
+        return {key: substitute(value, refs) for key, value in data.items()}
+    if isinstance(data, list):
+        return [substitute(item, refs) for item in data]
+    return data
+
+
+def substitute_path(path, refs):
+    '''
+    Replaces every {name.field} in a path by the value it points to
+    '''
+    return REFERENCE.sub(lambda match: str(lookup(refs, match.group(1))), path)
+
+
+def response_data(response):
+    if hasattr(response, 'data'):
+        return response.data
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    return json.loads(content) if content else None
+
+
+class BatchMixin:
+    '''
+    Runs an ordered list of API requests in-process, in one transaction.
+
+    Each operation is {"method", "path", "body", "headers", "ref"}; all
+    but the first two are optional. An operation named with `ref` can be
+    referred to by later ones: `{name.field}` in their path and
+    {"$ref": "name.field"} anywhere in their body stand for that field of
+    its response (`name.0.id` for the first item of a list).
+
+    The sub-requests go through the same views as standalone ones, as the
+    user authenticated for the batch, without authenticating again. The
+    first one answering with an error stops the batch, rolls back all of
+    it and gives its status code to the whole response. GET operations
+    bypass the response cache, as the batch may still roll back what they
+    read.
+    '''
+    # The batch itself, and the whole-catalog download.
+    unbatched_routes = {'batch', 'snapshot'}
+
+    def run_batch(self, request):
+        max_length = getattr(settings, 'BOOKS_API_BATCH_MAX_OPERATIONS', 50)
+        operations = serializers.ListField(
+            child=BatchOperationSerializer(), allow_empty=False, max_length=max_length
+        ).run_validation(request.data.get('operations') if isinstance(request.data, dict) else request.data)
+
+        routes = self.get_batch_routes()
+        token = response_cache.uncommitted.set(True)
+        try:
+            return self.run_operations(request, operations, routes)
+        finally:
+            response_cache.uncommitted.reset(token)
+
+    def run_operations(self, request, operations, routes):
+        results = []
+        refs = {}
+        with transaction.atomic():
+            for index, operation in enumerate(operations):
+                try:
+                    path = substitute_path(operation['path'], refs)
+                    body = substitute(operation.get('body'), refs)
+                except UnresolvedReference as exc:
+                    code, data = status.HTTP_400_BAD_REQUEST, {'res': str(exc)}
+                else:
+                    code, data = self.run_operation(request, routes, operation['method'], path, body, operation.get('headers', {}))
+                results.append({'status': code, 'body': data})
+                if code >= 400:
+                    transaction.set_rollback(True)
+                    return Response({'failed': index, 'results': results}, status=code)
+                if 'ref' in operation:
+                    refs[operation['ref']] = data
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def run_operation(self, request, routes, method, path, body, headers):
+        '''
+        Returns (status code, response data) of one operation
+        '''
+        url = urlsplit(path)
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            match = None
+        if match is None or match.url_name not in routes:
+            return status.HTTP_400_BAD_REQUEST, {'res': f"'{url.path}' is not an API route that can be batched."}
+
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = url.path
+        sub.META = {key: value for key, value in request._request.META.items() if key in INHERITED_META}
+        sub.META.update({f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()})
+        sub.META.update(REQUEST_METHOD=method, PATH_INFO=url.path, QUERY_STRING=url.query, HTTP_ACCEPT='application/json')
+        sub.GET = QueryDict(url.query)
+        content = b'' if body is None else json.dumps(body).encode()
+        sub.META.update(CONTENT_TYPE='application/json', CONTENT_LENGTH=str(len(content)))
+        sub._stream = io.BytesIO(content)
+        sub._read_started = False
+        sub.user = request.user
+        sub.session = getattr(request._request, 'session', None)
+        sub.resolver_match = match
+        # DRF's hook for an already authenticated user (rest_framework.request.Request).
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+
+        view = match.func
+        if iscoroutinefunction(view):
+            view = async_to_sync(view)
+        response = view(sub, *match.args, **match.kwargs)
+        return response.status_code, response_data(response)
+
+    def get_batch_routes(self):
+        # Imported here: urls.py imports the views.
+        from .urls import build_urlpatterns
+        return {pattern.name for pattern in build_urlpatterns()} - self.unbatched_routes
@@ -0,0 +1,71 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+
+import math
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+
+
+def percentile(values, p):
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    '''
+    Throughput and latency percentiles (in milliseconds) of a list of
+    per-operation latencies in seconds measured over `elapsed` seconds
+    '''
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+def session_cookie(user):
+    '''
+    Opens a session for `user` and returns the Cookie header that uses it.
+    Benchmarks authenticate this way: HTTP Basic would hash the password on
+    every request and measure little else
+    '''
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+# Metrics compared by compare(), and whether a higher value is better.
+COMPARED = (('per_second', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False))
+
+
+def compare(baseline, current, threshold):
+    '''
+    Compares two {scenario: summarize() result} mappings. Returns
+    [(scenario, metric, before, after, change in %, regressed)] for the
+    scenarios present in both; a change worse than `threshold` percent is a
+    regression
+    '''
+    rows = []
+    for scenario in sorted(set(baseline) & set(current)):
+        for metric, higher_is_better in COMPARED:
+            before, after = baseline[scenario].get(metric), current[scenario].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            rows.append((scenario, metric, before, after, round(change, 1), worse > threshold))
+    return rows
@@ -0,0 +1,35 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class BulkCreateMixin:
+    '''
+    Lets a list view create many items from a single POSTed JSON array.
+
+    The whole array is validated first; if any item is invalid nothing is
+    written and the errors are reported with the index of the offending
+    item. Arrays longer than BOOKS_API_MAX_BULK_SIZE are rejected.
+    '''
+
+    def is_bulk(self, request):
+        return isinstance(request.data, list)
+
+    def bulk_create(self, request, serializer_class, fields):
+        data = [
+            {field: item.get(field) for field in fields} if isinstance(item, dict) else item
+            for item in request.data
+        ]
+        max_length = getattr(settings, 'BOOKS_API_MAX_BULK_SIZE', 10000)
+        serializer = serializer_class(data=data, many=True, max_length=max_length)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        errors = serializer.errors
+        # Depending on the DRF version item errors come as a list aligned
+        # with the input or as a dict keyed by index.
+        if isinstance(errors, list):
+            errors = dict(enumerate(errors))
+        if all(isinstance(index, int) for index in errors):
+            errors = [{'index': index, 'errors': item} for index, item in sorted(errors.items()) if item]
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
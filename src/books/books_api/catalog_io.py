@@ -0,0 +1,100 @@
+"""
+File format of the import_catalog / export_catalog commands.
+
+A catalog is a directory holding one file per table, in the order they
+have to be loaded: editorials, authors, books and author_books (the links),
+either all .csv (with a header row) or all .jsonl (one object per line).
+Columns are the table's own, ids included, so a restored catalog keeps its
+ids and its URLs.
+"""
+
+import csv
+import datetime
+import json
+import os
+
+from django.db import models
+
+from .models import Author, Book, Editorial
+
+FORMATS = ('csv', 'jsonl')
+
+# (file name, model, columns, {column: file name of the referenced rows})
+TABLES = [
+    ('editorials', Editorial, ['id', 'name'], {}),
+    ('authors', Author, ['id', 'firstname', 'lastname', 'birthdate'], {}),
+    ('books', Book, ['id', 'title', 'description', 'pub_date', 'editorial_id'], {'editorial_id': 'editorials'}),
+    ('author_books', Author.books.through, ['author_id', 'book_id'], {'author_id': 'authors', 'book_id': 'books'}),
+]
+
+
+def path_of(directory, name, file_format):
+    return os.path.join(directory, f'{name}.{file_format}')
+
+
+def detect_format(directory):
+    found = [file_format for file_format in FORMATS if os.path.exists(path_of(directory, TABLES[0][0], file_format))]
+    if len(found) != 1:
+        return None
+    return found[0]
+
+
+def get_parser(model, column):
+    '''
+    Returns the function turning a value read from a file into the
+    column's Python value
+    '''
+    field = model._meta.get_field(column)
+    if isinstance(field, (models.ForeignKey, models.AutoField, models.IntegerField)):
+        return int
+    if isinstance(field, models.DateField):
+        return lambda value: value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+    return str
+
+
+def to_text(value):
+    return value.isoformat() if isinstance(value, datetime.date) else value
+
+
+def read_rows(path, file_format, columns):
+    '''
+    Yields (line number, {column: raw value}) for every record of a file,
+    reading it a line at a time
+    '''
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            missing = set(columns).difference(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f'{path}: missing columns {", ".join(sorted(missing))}')
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+
+class RowWriter:
+    '''
+    Writes the rows of one table, as tuples in the order of its columns
+    '''
+
+    def __init__(self, path, file_format, columns):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.file_format = file_format
+        self.columns = columns
+        if file_format == 'csv':
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(columns)
+
+    def write(self, rows):
+        if self.file_format == 'csv':
+            self.csv.writerows([to_text(value) for value in row] for row in rows)
+        else:
+            self.file.writelines(
+                json.dumps(dict(zip(self.columns, map(to_text, row))), ensure_ascii=False) + '\n' for row in rows
+            )
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,144 @@
+"""
+Change log behind /api/changes, for clients that mirror the catalog.
+
+Every write recorded by the signal receivers (see signals.py) appends a
+Change row in the same transaction: `upsert` or `delete` of an editorial,
+author or book, `link` or `unlink` of an author and a book. Cascades are
+included: deleting an editorial logs the deletion of each of its books and
+the unlinking of their authors.
+
+Clients ask for the changes after the last `seq` they saw. The feed is
+compacted: only the latest change of each object (or link) is returned, so
+an object changed a thousand times costs one entry, with its current data.
+
+Writes that bypass the ORM (seed_catalog, import_catalog) and the retention
+of prune_changes leave a `reset` row instead: clients whose `seq` is older
+than the latest one must resync from the lists or a snapshot, which records
+the `seq` it was taken at.
+"""
+
+from django.db.models import Exists, Max, OuterRef
+
+from .models import Author, Book, Change, Editorial
+
+KINDS = {Editorial: 'editorial', Author: 'author', Book: 'book'}
+
+
+def record(changes):
+    '''
+    Appends [(kind, action, object id, related id)]
+    '''
+    if changes:
+        Change.objects.bulk_create([
+            Change(kind=kind, action=action, object_id=object_id, related_id=related_id)
+            for kind, action, object_id, related_id in changes
+        ])
+
+
+def saved(model, ids):
+    record([(KINDS[model], 'upsert', pk, 0) for pk in ids])
+
+
+def deleted(model, ids):
+    record([(KINDS[model], 'delete', pk, 0) for pk in ids])
+
+
+def links_changed(pairs, sign):
+    '''
+    `pairs` are (author id, book id), linked if `sign` is 1 and unlinked if
+    it is -1, as for stats.links_changed()
+    '''
+    action = 'link' if sign > 0 else 'unlink'
+    record([('author_book', action, author_id, book_id) for author_id, book_id in pairs])
+
+
+def reset():
+    '''
+    Marks that the catalog changed in ways the log does not hold
+    '''
+    record([('catalog', 'reset', 0, 0)])
+
+
+def head():
+    '''
+    The seq of the latest change, 0 if none
+    '''
+    return Change.objects.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def horizon():
+    '''
+    The seq clients must have reached to sync from the log; 0 while it
+    holds every change
+    '''
+    return Change.objects.filter(kind='catalog').aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def superseded():
+    '''
+    The changes some later change of the same object (or link) overrides
+    '''
+    later = Change.objects.filter(
+        kind=OuterRef('kind'), object_id=OuterRef('object_id'), related_id=OuterRef('related_id'), seq__gt=OuterRef('seq'),
+    )
+    return Exists(later)
+
+
+def get_page(since, limit):
+    '''
+    Returns the latest change of each object changed after `since`, in seq
+    order, at most `limit` of them plus one (which tells there are more)
+    '''
+    changes = Change.objects.filter(seq__gt=since).exclude(kind='catalog').filter(~superseded())
+    return list(changes.order_by('seq').values_list('seq', 'kind', 'action', 'object_id', 'related_id')[:limit + 1])
+
+
+def represent(rows):
+    '''
+    Turns get_page() rows into the feed entries, with the current data of
+    the upserted objects (one query per kind)
+    '''
+    # Imported here: the serializers import the signals, which import this.
+    from .serializers import AuthorSerializer, BookSerializer, EditorialSerializer
+
+    serializers = {'editorial': (Editorial, EditorialSerializer), 'author': (Author, AuthorSerializer), 'book': (Book, BookSerializer)}
+    data = {}
+    for kind, (model, serializer) in serializers.items():
+        ids = [object_id for _, row_kind, action, object_id, _ in rows if row_kind == kind and action == 'upsert']
+        if ids:
+            values = model.objects.filter(pk__in=ids).values_list(*serializer.value_columns())
+            data[kind] = {item['id']: item for item in serializer.from_values(values)}
+    entries = []
+    for seq, kind, action, object_id, related_id in rows:
+        if kind == 'author_book':
+            entries.append({'seq': seq, 'type': kind, 'action': action, 'author': object_id, 'book': related_id})
+            continue
+        entry = {'seq': seq, 'type': kind, 'action': action, 'id': object_id}
+        if action == 'upsert':
+            entry['data'] = data[kind].get(object_id)
+        entries.append(entry)
+    return entries
+
+
+def compact():
+    '''
+    Deletes the changes a later one overrides; the feed never returns them.
+    Returns how many were deleted
+    '''
+    return Change.objects.filter(superseded()).exclude(kind='catalog').delete()[0]
+
+
+def expire(before):
+    '''
+    Deletes the changes logged before the `before` datetime, and moves the
+    horizon past them. Returns how many were deleted
+    '''
+    last = Change.objects.filter(created_at__lt=before).aggregate(seq=Max('seq'))['seq']
+    if last is None:
+        return 0
+    count = Change.objects.filter(seq__lte=last).exclude(seq=last, kind='catalog').delete()[0]
+    if not Change.objects.filter(seq=last).exists():
+        # Takes the seq of the last deleted change, so the horizon is
+        # exactly where the log now starts.
+        Change.objects.create(seq=last, kind='catalog', action='reset')
+    return count
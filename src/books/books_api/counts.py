@@ -0,0 +1,151 @@
+"""
+Denormalized counters on the catalog rows.
+
+* Editorial.book_count: books of the editorial
+* Author.book_count: books linked to the author
+* Book.author_count: authors linked to the book
+
+Every write that changes them adjusts them (see signals.py) with
+UPDATE ... SET count = count + delta, in the transaction of the write, so
+concurrent writes add up instead of overwriting each other. The rows whose
+counter changes get a new `updated_at`, which changes their ETags, an
+upsert in the changes feed, and their cached responses are invalidated.
+
+rebuild() recounts everything from the tables; the `rebuild_counts`
+management command uses it to repair or verify the counters.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import changes, response_cache
+from .models import Author, Book, Editorial
+
+
+def counted(model):
+    '''
+    The expression counting, for each row of `model`, what its counter
+    counts
+    '''
+    through = Author.books.through
+    if model is Editorial:
+        rows = Book.objects.filter(editorial_id=OuterRef('pk')).values('editorial_id')
+    elif model is Author:
+        rows = through.objects.filter(author_id=OuterRef('pk')).values('author_id')
+    else:
+        rows = through.objects.filter(book_id=OuterRef('pk')).values('book_id')
+    count = Subquery(rows.order_by().annotate(n=Count('id')).values('n'), output_field=IntegerField())
+    return Coalesce(count, Value(0))
+
+
+def invalidate(model, pks):
+    '''
+    Invalidates the cached responses showing the counter of the `model`
+    rows `pks`: the rows themselves, their lists, and the lists embedding
+    them
+    '''
+    pks = list(pks)
+    if not pks:
+        return
+    through = Author.books.through
+    if model is Editorial:
+        response_cache.invalidate('editorial-list', 'editorials', *[f'editorial:{pk}' for pk in pks])
+    elif model is Author:
+        book_ids = through.objects.filter(author_id__in=pks).values_list('book_id', flat=True).distinct()
+        response_cache.invalidate(
+            'author-list',
+            'authors',
+            *[f'author:{pk}' for pk in pks],
+            *[f'book:{pk}:authors' for pk in book_ids],
+        )
+    else:
+        editorial_ids = Book.objects.filter(pk__in=pks).values_list('editorial_id', flat=True).distinct()
+        author_ids = through.objects.filter(book_id__in=pks).values_list('author_id', flat=True).distinct()
+        response_cache.invalidate(
+            'book-list',
+            *[f'book:{pk}' for pk in pks],
+            *[f'editorial:{pk}:books' for pk in editorial_ids],
+            *[f'author:{pk}:books' for pk in author_ids],
+        )
+
+
+def bump(model, deltas):
+    '''
+    Adds every {pk: delta} in deltas to the counter of `model`, with one
+    UPDATE per distinct delta. update() sends no post_save, so the changes
+    feed is told here
+    '''
+    [field] = model.counters
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    now = timezone.now()
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta, 'updated_at': now})
+    pks = [pk for pks in by_delta.values() for pk in pks]
+    changes.saved(model, pks)
+    invalidate(model, pks)
+
+
+def books_created(books):
+    bump(Editorial, Counter(book.editorial_id for book in books))
+
+
+def book_changed(old, book):
+    '''
+    `old` holds the editorial_id the Book had before saving
+    '''
+    if old['editorial_id'] != book.editorial_id:
+        bump(Editorial, {old['editorial_id']: -1, book.editorial_id: 1})
+
+
+def book_deleted(book, author_ids):
+    bump(Editorial, {book.editorial_id: -1})
+    bump(Author, {pk: -1 for pk in author_ids})
+
+
+def links_changed(pairs, sign):
+    '''
+    Accounts for (author id, book id) links that were just added (sign=1)
+    or removed (sign=-1)
+    '''
+    if not pairs:
+        return
+    bump(Author, {pk: sign * n for pk, n in Counter(author_id for author_id, _ in pairs).items()})
+    bump(Book, {pk: sign * n for pk, n in Counter(book_id for _, book_id in pairs).items()})
+
+
+def author_deleted(author, book_ids):
+    bump(Book, {pk: -1 for pk in book_ids})
+
+
+def differences():
+    '''
+    Returns [(model label, pk, stored value, expected value)] for every row
+    whose counter does not match the tables
+    '''
+    diffs = []
+    for model in (Editorial, Author, Book):
+        [field] = model.counters
+        rows = model.objects.annotate(expected=counted(model)).exclude(**{field: F('expected')})
+        for pk, have, want in rows.order_by('pk').values_list('pk', field, 'expected').iterator():
+            diffs.append((f'{model._meta.model_name}.{field}', pk, have, want))
+    return diffs
+
+
+def rebuild():
+    '''
+    Recounts every counter from the tables, with one UPDATE per model that
+    only touches the rows whose counter is wrong. Returns how many there
+    were. Cached responses are left to the caller
+    '''
+    now = timezone.now()
+    fixed = 0
+    for model in (Editorial, Author, Book):
+        [field] = model.counters
+        fixed += model.objects.exclude(**{field: counted(model)}).update(**{field: counted(model), 'updated_at': now})
+    return fixed
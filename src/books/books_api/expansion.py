@@ -0,0 +1,31 @@
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+
+from .models import Author
+
+
+class BookExpandMixin:
+    '''
+    Handles `?expand=editorial,authors` on the views returning Books.
+
+    The requested relations are loaded with select_related/prefetch_related
+    so the number of queries does not depend on the number of Books, and
+    BookSerializer embeds them when they are present in its context.
+    '''
+    expand_query_param = 'expand'
+    expandable = ('editorial', 'authors')
+
+    def get_expand(self, request):
+        value = request.query_params.get(self.expand_query_param, '')
+        expand = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = expand.difference(self.expandable)
+        if unknown:
+            raise ValidationError({self.expand_query_param: [f"Cannot expand '{name}'." for name in sorted(unknown)]})
+        return expand
+
+    def expand_queryset(self, queryset, expand):
+        if 'editorial' in expand:
+            queryset = queryset.select_related('editorial')
+        if 'authors' in expand:
+            queryset = queryset.prefetch_related(Prefetch('author_set', queryset=Author.objects.order_by('id')))
+        return queryset
@@ -0,0 +1,59 @@
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsetMixin:
+    '''
+    Handles `?fields=title,pub_date` and `?exclude=description` on the list
+    and detail views.
+
+    The selection trims the serializer's representation (the `fields`
+    argument of ValuesSerializerMixin, or the `fields` serializer context
+    entry) and the columns read: list views only put the selected columns
+    in their values_list(), detail views load the instance with only().
+    `id` is always returned. Expanding a relation that is not selected
+    does not embed it.
+
+    The selection is part of the ETag, as it changes the representation.
+    '''
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_fieldset(self, request, serializer_class):
+        '''
+        Returns the names of the fields to return, or None when the request
+        does not select any
+        '''
+        available = serializer_class.Meta.fields
+        selected = set(available)
+        errors = {}
+        present = False
+        for param in (self.fields_query_param, self.exclude_query_param):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            present = True
+            names = {name.strip() for name in value.split(',') if name.strip()}
+            unknown = names.difference(available)
+            if unknown:
+                errors[param] = [f"Unknown field '{name}'." for name in sorted(unknown)]
+            elif param == self.fields_query_param:
+                selected &= names
+            else:
+                selected -= names
+        if errors:
+            raise ValidationError(errors)
+        if not present:
+            return None
+        return tuple(name for name in available if name == 'id' or name in selected)
+
+    def only_queryset(self, queryset, serializer_class, fields, expand=()):
+        '''
+        Defers every column `fields` does not need. updated_at is kept for
+        the validators and the editorial for select_related()
+        '''
+        if fields is None:
+            return queryset
+        columns = serializer_class.value_columns(fields=fields) + ['updated_at']
+        if 'editorial' in expand:
+            columns.append('editorial')
+        return queryset.only(*columns)
@@ -0,0 +1,76 @@
+from django.db.models import Exists, F, Func, ManyToManyField, OuterRef
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class Unindexed(Func):
+    '''
+    The column behind `expression`, written as +column so that SQLite does
+    not use its index
+    '''
+    template = '+%(expressions)s'
+
+
+class ListFilterMixin:
+    '''
+    Query parameter filtering for the list views.
+
+    The view declares `filter_fields` as {param: (model field, kind, parser)}
+    where kind is one of 'exact', 'gte', 'lte' or 'prefix' and parser is the
+    DRF field used to validate the value. Every declared filter is backed by
+    an index (see Meta.indexes in models.py).
+
+    Prefixes are matched as a range (field >= prefix AND field < prefix +
+    U+10FFFF) rather than with LIKE, which SQLite cannot serve from an
+    index. They are therefore case sensitive.
+
+    Given the `ordering` of a page (see KeysetPagination.get_ordering), the
+    filters are written so that SQLite walks the index of the ordering and
+    checks the rest row by row, instead of reading every match from another
+    index and sorting it: ranges on other columns go through Unindexed, and
+    a many-to-many filter becomes an IN on the link table when ordering by
+    id (which that index keeps in order) and an EXISTS otherwise. Exact
+    filters on a column need an index on (column, ordering field).
+    '''
+    filter_fields = {}
+
+    def filter_queryset(self, request, queryset, ordering=None):
+        errors = {}
+        key = ordering.lstrip('-') if ordering else None
+        for param, (field, kind, parser) in self.filter_fields.items():
+            raw = request.query_params.get(param)
+            if raw is None:
+                continue
+            try:
+                value = parser.run_validation(raw)
+            except serializers.ValidationError as exc:
+                errors[param] = exc.detail
+                continue
+            if kind == 'exact':
+                queryset = self.filter_exact(queryset, field, value, key)
+                continue
+            if key is not None and field != key:
+                output_field = queryset.model._meta.get_field(field)
+                queryset = queryset.alias(**{f'{field}_unindexed': Unindexed(F(field), output_field=output_field)})
+                field = f'{field}_unindexed'
+            if kind == 'prefix':
+                queryset = queryset.filter(**{f'{field}__gte': value, f'{field}__lt': value + '\U0010ffff'})
+            else:
+                queryset = queryset.filter(**{f'{field}__{kind}': value})
+        if errors:
+            raise ValidationError(errors)
+        return queryset
+
+    def filter_exact(self, queryset, field, value, key):
+        relation = queryset.model._meta.get_field(field)
+        if key is None or not relation.many_to_many:
+            return queryset.filter(**{field: value})
+        if isinstance(relation, ManyToManyField):
+            m2m, own, other = relation, relation.m2m_field_name(), relation.m2m_reverse_field_name()
+        else:
+            m2m = relation.field
+            own, other = m2m.m2m_reverse_field_name(), m2m.m2m_field_name()
+        links = m2m.remote_field.through.objects.filter(**{other: value})
+        if key == 'id':
+            return queryset.filter(pk__in=links.values(own))
+        return queryset.filter(Exists(links.filter(**{own: OuterRef('pk')})))
@@ -0,0 +1,307 @@
+"""
+Group commit: one process writes, in one transaction per group of requests.
+
+With BOOKS_API_GROUP_COMMIT, GroupCommitMiddleware hands every write
+request to the API over to the `run_writer` process, through the Unix
+socket BOOKS_API_GROUP_COMMIT_SOCKET, instead of running it in the worker.
+The writer runs the requests that arrived while it was busy together, up to
+BOOKS_API_GROUP_COMMIT_MAX_BATCH of them, in one transaction: one BEGIN and
+one COMMIT for all of them, and no worker ever waits for the write lock.
+
+Each request still runs through the middleware and the view it would have
+run through in the worker, inside a savepoint (AtomicWritesMiddleware):
+one that fails is rolled back alone and gets its own error, the others
+commit. Responses are sent back once the group has committed. If the COMMIT
+itself fails, every request of the group gets a 503. The cached responses
+the group invalidates are invalidated once, when it commits (see
+response_cache.invalidate()).
+
+When the writer is not running, workers write themselves, as without
+BOOKS_API_GROUP_COMMIT.
+"""
+
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import DatabaseError, close_old_connections, transaction
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+
+from . import response_cache
+from .middleware import SAFE_METHODS
+
+FRAME = struct.Struct('>II')
+# Run by the worker that received the request, not again by the writer.
+# ReadReplicaMiddleware stamps the time of the write, which must come after
+# the group committed.
+WORKER_MIDDLEWARE = {
+    'books_api.metrics.MetricsMiddleware',
+    'books_api.replicas.ReadReplicaMiddleware',
+    'books_api.group_commit.GroupCommitMiddleware',
+}
+
+
+class WriterUnavailable(Exception):
+    pass
+
+
+def get_socket_path():
+    return getattr(settings, 'BOOKS_API_GROUP_COMMIT_SOCKET', '/run/books_api/writer.sock')
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, header, body):
+    '''
+    A frame is the lengths of a JSON header and of a body, then both
+    '''
+    header = json.dumps(header).encode()
+    sock.sendall(FRAME.pack(len(header), len(body)) + header + body)
+
+
+def recv_frame(sock):
+    header_size, body_size = FRAME.unpack(recv_exactly(sock, FRAME.size))
+    header = json.loads(recv_exactly(sock, header_size))
+    return header, recv_exactly(sock, body_size)
+
+
+def forward(request):
+    '''
+    Sends a request to the writer and returns its response. Raises
+    WriterUnavailable if the writer cannot be reached, before anything was
+    sent
+    '''
+    environ = {key: value for key, value in request.META.items() if isinstance(value, str)}
+    environ['wsgi.url_scheme'] = request.scheme
+    body = request.body
+    timeout = getattr(settings, 'BOOKS_API_GROUP_COMMIT_TIMEOUT', 30)
+    deadline = time.monotonic() + timeout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        while True:
+            try:
+                sock.connect(get_socket_path())
+                break
+            except (FileNotFoundError, ConnectionRefusedError) as exc:
+                raise WriterUnavailable(exc)
+            except BlockingIOError:
+                # The writer's backlog is full: it is running, wait for it.
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.005)
+        send_frame(sock, {'environ': environ}, body)
+        header, content = recv_frame(sock)
+    response = HttpResponse(content, status=header['status'])
+    for name, value in header['headers']:
+        if name.lower() == 'set-cookie':
+            response.cookies.update(SimpleCookie(value))
+        else:
+            response[name] = value
+    return response
+
+
+class GroupCommitMiddleware:
+    '''
+    Hands the write requests to the API over to the writer process (see
+    the module docstring). Goes before AtomicWritesMiddleware, which the
+    writer runs instead
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Imported here: urls.py imports the views.
+        from .urls import build_urlpatterns
+        self.routes = {pattern.name for pattern in build_urlpatterns()}
+
+    def __call__(self, request):
+        if (not getattr(settings, 'BOOKS_API_GROUP_COMMIT', False) or request.method in SAFE_METHODS
+                or not self.is_api_route(request)):
+            return self.get_response(request)
+        try:
+            return forward(request)
+        except WriterUnavailable:
+            return self.get_response(request)
+        except (OSError, ValueError):
+            # Sent, but no answer: whether it was committed is unknown.
+            return JsonResponse({'res': 'The writer did not answer, the request may or may not have been applied.'}, status=503)
+
+    def is_api_route(self, request):
+        try:
+            return resolve(request.path_info).url_name in self.routes
+        except Resolver404:
+            return False
+
+
+class Pending:
+    '''
+    A request waiting in the writer's queue, and then its response
+    '''
+
+    def __init__(self, environ, body):
+        self.environ = environ
+        self.body = body
+        self.done = threading.Event()
+        self.status = self.headers = self.content = None
+
+
+class WriterHandler(WSGIHandler):
+    '''
+    The WSGI handler of the workers, with the middleware in `middleware`
+    instead of settings.MIDDLEWARE. The writer only runs synchronously
+    '''
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+        super().__init__()
+
+    def load_middleware(self, is_async=False):
+        # BaseHandler.load_middleware() for sync middleware only.
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+        handler = convert_exception_to_response(self._get_response)
+        for path in reversed(self.middleware):
+            try:
+                middleware = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(middleware, 'process_view'):
+                self._view_middleware.insert(0, middleware.process_view)
+            if hasattr(middleware, 'process_template_response'):
+                self._template_response_middleware.append(middleware.process_template_response)
+            if hasattr(middleware, 'process_exception'):
+                self._exception_middleware.append(middleware.process_exception)
+            handler = convert_exception_to_response(middleware)
+        self._middleware_chain = handler
+
+
+class Writer:
+    '''
+    Runs the queued requests, one group (transaction) at a time, in the
+    thread that calls run()
+    '''
+
+    def __init__(self, max_batch=None):
+        self.max_batch = max_batch or getattr(settings, 'BOOKS_API_GROUP_COMMIT_MAX_BATCH', 64)
+        self.queue = queue.Queue()
+        self.handler = WriterHandler([path for path in settings.MIDDLEWARE if path not in WORKER_MIDDLEWARE])
+
+    def submit(self, environ, body):
+        pending = Pending(environ, body)
+        self.queue.put(pending)
+        return pending
+
+    def run(self):
+        while True:
+            group = [self.queue.get()]
+            while len(group) < self.max_batch:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.run_group(group)
+
+    def run_group(self, group):
+        # The handler would close the connection between requests, in the
+        # middle of the transaction.
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        token = response_cache.uncommitted.set(True)
+        try:
+            with transaction.atomic():
+                for pending in group:
+                    self.handle(pending)
+        except Exception as exc:
+            # Nothing of the group was saved (a failed COMMIT, or a bug
+            # outside of the views, whose errors are already responses).
+            status = 503 if isinstance(exc, DatabaseError) else 500
+            content = json.dumps({'res': f'The changes could not be saved ({exc}), try again.'}).encode()
+            for pending in group:
+                pending.status, pending.headers, pending.content = status, [('Content-Type', 'application/json')], content
+        finally:
+            response_cache.uncommitted.reset(token)
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+            if not transaction.get_connection().in_atomic_block:
+                close_old_connections()
+            for pending in group:
+                pending.done.set()
+
+    def handle(self, pending):
+        environ = dict(pending.environ)
+        environ.update({
+            'wsgi.input': io.BytesIO(pending.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        })
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = int(status.split()[0]), headers
+
+        response = self.handler(environ, start_response)
+        try:
+            pending.content = b''.join(response)
+        finally:
+            response.close()
+        pending.status, pending.headers = started['status'], started['headers']
+
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every worker thread of every Gunicorn worker may be connecting at once.
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, path, writer):
+        self.writer = writer
+        super().__init__(path, WriterRequestHandler)
+
+    def server_bind(self):
+        # The writer trusts the environ it is sent: only its own user (the
+        # one the workers run as) may connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+class WriterRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            header, body = recv_frame(self.request)
+        except (OSError, ValueError):
+            return
+        pending = self.server.writer.submit(header['environ'], body)
+        pending.done.wait()
+        try:
+            send_frame(self.request, {'status': pending.status, 'headers': pending.headers}, pending.content)
+        except OSError:
+            pass
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+class RelatedSetMixin:
+    '''
+    Changes the Author-Book links of one object from a JSON array of ids.
+
+    The ids are checked with a single in_bulk() query and the links are
+    written with one bulk insert and/or delete on the Author.books table:
+    `add` links the given ids, `remove` unlinks them and `set` replaces the
+    whole set with them.
+    '''
+    related_messages = {
+        'add': 'added',
+        'remove': 'deleted',
+        'set': 'replaced',
+    }
+
+    def get_related_ids(self, request):
+        data = request.data
+        max_length = getattr(settings, 'BOOKS_API_MAX_BULK_SIZE', 10000)
+        if not isinstance(data, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in data):
+            raise ValidationError({'ids': ['Expected a list of ids.']})
+        if len(data) > max_length:
+            raise ValidationError({'ids': [f'Ensure this field has no more than {max_length} elements.']})
+        return set(data)
+
+    def change_related(self, request, manager, related_model, action, label):
+        ids = self.get_related_ids(request)
+        existing = related_model.objects.in_bulk(ids)
+        missing = sorted(ids.difference(existing))
+        if missing:
+            return Response(
+                {'ids': [f'Invalid pk "{pk}" - object does not exist.' for pk in missing]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with transaction.atomic():
+            if action == 'set':
+                manager.set(ids)
+            else:
+                getattr(manager, action)(*ids)
+        return Response(
+            {"res": f"{label} {self.related_messages[action]}!"},
+            status=status.HTTP_200_OK
+        )
@@ -0,0 +1,105 @@
+"""
+Minimal asyncio HTTP/1.1 load generator used by the benchmark commands.
+
+Every simulated client keeps one connection open and sends requests back to
+back, reconnecting when the server closes it (as sync Gunicorn workers do
+after every response). Only the standard library is needed, so it runs
+anywhere the app runs.
+"""
+
+import asyncio
+import itertools
+import resource
+import time
+
+from .benchmark import summarize
+
+
+def raise_open_files_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+async def read_response(reader):
+    '''
+    Reads one response, returns (status, keep_alive)
+    '''
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    keep_alive = headers.get('connection', '').lower() != 'close' and status_line.startswith(b'HTTP/1.1')
+    return status, keep_alive
+
+
+async def client(host, port, requests, deadline, results, timeout):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        path, method, body, headers = next(requests)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            head = f'{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+            head += ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+            if body is not None:
+                head += f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+            writer.write(head.encode('latin-1') + b'\r\n' + (body or b''))
+            status, keep_alive = await asyncio.wait_for(read_response(reader), timeout)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, IndexError):
+            results['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.01)
+            continue
+        results['latencies'].append(time.perf_counter() - start)
+        results['statuses'][status] = results['statuses'].get(status, 0) + 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(host, port, requests, connections, duration, timeout=30):
+    '''
+    Drives `connections` concurrent clients for `duration` seconds, cycling
+    through `requests`, a list of (path, method, body bytes or None,
+    headers). Returns the throughput, latency percentiles, status counts
+    and number of failed requests. Requests taking longer than `timeout`
+    seconds count as failed
+    '''
+    raise_open_files_limit(connections + 256)
+    cycle = itertools.cycle(requests)
+    results = {'latencies': [], 'statuses': {}, 'errors': 0}
+    start = time.monotonic()
+    deadline = start + duration
+    clients = [asyncio.create_task(client(host, port, cycle, deadline, results, timeout)) for _ in range(connections)]
+    await asyncio.wait(clients)
+    elapsed = time.monotonic() - start
+    summary = summarize(results['latencies'], elapsed)
+    summary['statuses'] = dict(sorted(results['statuses'].items()))
+    summary['errors'] = results['errors']
+    return summary
+
+
+def run_load(host, port, requests, connections, duration, timeout=30):
+    return asyncio.run(run(host, port, requests, connections, duration, timeout))
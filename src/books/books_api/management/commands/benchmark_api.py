@@ -0,0 +1,236 @@
+import datetime
+import json
+import platform
+import time
+from urllib.parse import urlsplit
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from books_api import changes, tokens, urls
+from books_api.benchmark import compare, summarize
+from books_api.loadgen import run_load
+from books_api.models import Author, Book, Editorial, User
+
+# Requests made on each route, as [(method, query string[, JSON body])]
+# cycled through. Routes not listed here get one GET without query string,
+# so every route added to urls.py is measured.
+ROUTES = {
+    'book-list': [
+        [('GET', '')],
+        [('GET', '?expand=editorial,authors')],
+        [('GET', '?ordering=-pub_date&fields=id,title')],
+        [('GET', '?title_prefix={word}')],
+    ],
+    'author-list': [[('GET', '')], [('GET', '?ordering=lastname')]],
+    'book-detail': [[('GET', '')], [('GET', '?expand=editorial,authors')]],
+    'book-search': [[('GET', '?q={word}')]],
+    'token': [[('POST', '')]],
+    'batch': [[('POST', '', [
+        {'method': 'GET', 'path': '/books/api/book/{book_id}', 'ref': 'book'},
+        {'method': 'GET', 'path': '/books/api/editorial/{{book.editorial}}'},
+        {'method': 'GET', 'path': '/books/api/book/{book_id}/authors'},
+    ])]],
+    # From where the log starts: a seeded catalog only has the reset there.
+    'changes': [[('GET', '?since={horizon}')]],
+    # Changes data: only with --writes. The link is added then removed, so
+    # the catalog ends up as it was.
+    'author-book-detail': [[('PUT', ''), ('DELETE', '')]],
+}
+WRITE_ROUTES = {'author-book-detail'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures every route of books_api/urls.py, in-process or against a running server '
+        '(--url), and optionally compares the results with a previous run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User the requests are authenticated as (with a bearer token).')
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8020. '
+                                          'Requests are made in-process when omitted.')
+        parser.add_argument('--route', action='append', help='Only measure this route name (repeatable).')
+        parser.add_argument('--writes', action='store_true', help='Also measure the routes that change data.')
+        parser.add_argument('--requests', type=int, default=200, help='In-process: requests per scenario (default 200).')
+        parser.add_argument('--warmup', type=int, default=10, help='In-process: requests per scenario not measured (default 10).')
+        parser.add_argument('--no-cache', action='store_true', help='In-process: disable the response cache.')
+        parser.add_argument('--connections', type=int, default=10, help='Server: concurrent connections (default 10).')
+        parser.add_argument('--duration', type=float, default=5, help='Server: seconds per scenario (default 5).')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--load', help='Read the results from this JSON file instead of measuring.')
+        parser.add_argument('--compare', help='JSON file of a previous run to compare with.')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Change in %% counted as a regression by --compare (default 10).')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions.')
+
+    def handle(self, *args, **options):
+        if options['load']:
+            run = self.read(options['load'])
+        else:
+            run = self.measure(options)
+            self.print_results(run['results'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(run, f, indent=2)
+        if options['compare']:
+            rows = compare(self.read(options['compare'])['results'], run['results'], options['threshold'])
+            regressions = self.print_comparison(rows)
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} regressions over {options["threshold"]}%.')
+
+    def read(self, filename):
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read {filename}: {exc}')
+
+    def measure(self, options):
+        if not options['username']:
+            raise CommandError('--username is required to measure.')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+        scenarios = self.get_scenarios(options['route'], options['writes'])
+        if not scenarios:
+            raise CommandError('No route to measure.')
+        authorization = f'Bearer {tokens.issue_token(user)}'
+        if options['url']:
+            results = self.measure_server(options, scenarios, authorization)
+        else:
+            results = self.measure_in_process(options, scenarios, authorization)
+        return {
+            'meta': {
+                'target': options['url'] or 'in-process',
+                'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'catalog': {
+                    'editorials': Editorial.objects.count(),
+                    'books': Book.objects.count(),
+                    'authors': Author.objects.count(),
+                },
+                'options': {name: options[name] for name in ('requests', 'warmup', 'no_cache', 'connections', 'duration')},
+            },
+            'results': results,
+        }
+
+    def get_samples(self):
+        '''
+        Ids used in the URLs: the objects in the middle of each table, so
+        nested lists are neither the longest nor empty
+        '''
+        samples = {}
+        for model, kwarg in ((Editorial, 'editorial_id'), (Author, 'author_id'), (Book, 'book_id')):
+            last = model.objects.order_by('-id').values_list('id', flat=True).first()
+            if last is None:
+                raise CommandError(f'There are no {model._meta.verbose_name_plural}; see seed_catalog.')
+            samples[kwarg] = model.objects.filter(id__gte=last // 2).order_by('id').values_list('id', flat=True).first()
+        title = Book.objects.get(pk=samples['book_id']).title
+        samples['word'] = title.split()[0] if title.split() else 'a'
+        samples['horizon'] = changes.horizon()
+        return samples
+
+    def get_scenarios(self, names, writes):
+        '''
+        Returns {scenario name: [(method, path)]}
+        '''
+        samples = self.get_samples()
+        if writes:
+            # A book the author did not write, so that removing the link
+            # afterwards restores the catalog.
+            samples['book_id'] = Book.objects.exclude(author=samples['author_id']).order_by('id').values_list('id', flat=True).first()
+        scenarios = {}
+        for pattern in urls.urlpatterns:
+            name = pattern.name
+            if names and name not in names or name in WRITE_ROUTES and not writes:
+                continue
+            kwargs = {kwarg: samples[kwarg] for kwarg in pattern.pattern.converters}
+            path = reverse(name, kwargs=kwargs)
+            for requests in ROUTES.get(name, [[('GET', '')]]):
+                label = name + requests[0][1].format(**samples)
+                scenarios[label] = [
+                    (method, path + query.format(**samples), self.format_body(body, samples))
+                    for method, query, *body in requests
+                ]
+        return scenarios
+
+    def format_body(self, body, samples):
+        '''
+        Fills the samples into the strings of a JSON body, as bytes
+        '''
+        if not body:
+            return None
+
+        def fill(value):
+            if isinstance(value, str):
+                return value.format(**samples)
+            if isinstance(value, dict):
+                return {key: fill(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [fill(item) for item in value]
+            return value
+        return json.dumps(fill(body[0])).encode()
+
+    def measure_in_process(self, options, scenarios, authorization):
+        client = Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=authorization)
+        results = {}
+        # DEBUG would also log every query in memory.
+        overrides = {'DEBUG': False, 'ALLOWED_HOSTS': ['localhost'], 'BOOKS_API_CACHE_ENABLED': not options['no_cache']}
+        with override_settings(**overrides):
+            for label, requests in scenarios.items():
+                latencies, statuses = [], {}
+                started = None
+                for i in range(options['warmup'] + options['requests']):
+                    if i == options['warmup']:
+                        started = time.perf_counter()
+                    method, path, body = requests[i % len(requests)]
+                    start = time.perf_counter()
+                    response = client.generic(method, path, body or '', content_type='application/json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - start
+                    if i >= options['warmup']:
+                        latencies.append(elapsed)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                results[label] = summarize(latencies, time.perf_counter() - started)
+                results[label]['statuses'] = dict(sorted(statuses.items()))
+                self.stderr.write(f'{label}: {results[label]["per_second"]} req/s')
+        return results
+
+    def measure_server(self, options, scenarios, authorization):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url must be an http:// URL.')
+        host, port, prefix = url.hostname, url.port or 80, url.path.rstrip('/')
+        headers = {'Authorization': authorization}
+        results = {}
+        for label, requests in scenarios.items():
+            requests = [(prefix + path, method, body, headers) for method, path, body in requests]
+            results[label] = run_load(host, port, requests, options['connections'], options['duration'])
+            self.stderr.write(f'{label}: {results[label]["per_second"]} req/s')
+        return results
+
+    def print_results(self, results):
+        width = max(len(label) for label in results) + 2
+        self.stdout.write(f"{'scenario':<{width}}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+        for label, row in results.items():
+            self.stdout.write(
+                f"{label:<{width}}{row['per_second']:>10}{str(row['p50_ms']):>10}{str(row['p95_ms']):>10}"
+                f"{str(row['p99_ms']):>10}  {row['statuses']}"
+            )
+
+    def print_comparison(self, rows):
+        if not rows:
+            self.stdout.write('No scenario in common with the baseline.')
+            return 0
+        width = max(len(row[0]) for row in rows) + 2
+        self.stdout.write(f"{'scenario':<{width}}{'metric':<12}{'before':>10}{'after':>10}{'change':>9}")
+        for scenario, metric, before, after, change, regressed in rows:
+            line = f"{scenario:<{width}}{metric:<12}{before:>10}{after:>10}{change:>+8}%"
+            self.stdout.write(self.style.ERROR(line + '  regression') if regressed else line)
+        return sum(1 for row in rows if row[5])
@@ -0,0 +1,109 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books_api.benchmark import session_cookie
+from books_api.loadgen import run_load
+from books_api.models import Book, User
+
+# Gunicorn also reads gunicorn.conf.py from the working directory, whose
+# threads (4) would turn the sync workers into gthread ones and whose
+# max_requests would recycle them mid-run: both are overridden, so each mode
+# is what it says. Both modes keep preload_app.
+MODES = {
+    'wsgi': ['books.wsgi', '--worker-class', 'sync', '--threads', '1'],
+    'asgi': ['books.asgi', '--worker-class', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+# The SQLite profile the Docker image runs with (settings.py defaults to
+# `default`); BOOKS_API_SQLITE_PROFILE in the environment still wins.
+SERVER_ENV = {'BOOKS_API_SQLITE_PROFILE': 'production'}
+
+
+def server_environ():
+    '''
+    The environment the servers under test start with
+    '''
+    return {**SERVER_ENV, **os.environ}
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts Gunicorn with sync workers (wsgi) and with Uvicorn workers (asgi) in turn '
+        'and measures both under the same number of concurrent connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='User the requests are authenticated as.')
+        parser.add_argument('--mode', action='append', choices=sorted(MODES),
+                            help='Mode to run (repeatable). Defaults to both.')
+        parser.add_argument('--connections', type=int, default=1000, help='Concurrent connections (default 1000).')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds per mode (default 20).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Gunicorn workers (default: one per CPU).')
+        parser.add_argument('--port', type=int, default=8030, help='Port the servers listen on (default 8030).')
+        parser.add_argument('--path', action='append',
+                            help='Path to request (repeatable). Defaults to the book list and a book detail.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        host, port = '127.0.0.1', options['port']
+        paths = options['path']
+        if not paths:
+            book = Book.objects.order_by('id').first()
+            paths = ['/books/api/book'] + ([f'/books/api/book/{book.id}'] if book else [])
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+        headers = {'Cookie': session_cookie(user)}
+        requests = [(path, 'GET', None, headers) for path in paths]
+
+        results = {}
+        for mode in options['mode'] or ['wsgi', 'asgi']:
+            if mode == 'asgi' and importlib.util.find_spec('uvicorn_worker') is None:
+                self.stderr.write('Skipping asgi: uvicorn-worker is not installed.')
+                continue
+            env = dict(server_environ(), BOOKS_API_ASYNC='1' if mode == 'asgi' else '0')
+            command = [
+                sys.executable, '-m', 'gunicorn', *MODES[mode],
+                '--bind', f'{host}:{port}', '--workers', str(options['workers']),
+                '--backlog', str(max(2048, options['connections'])), '--max-requests', '0', '--log-level', 'warning',
+            ]
+            server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+            try:
+                if not wait_for_port(host, port, timeout=30):
+                    raise CommandError(f'{mode} server did not start.')
+                results[mode] = run_load(host, port, requests, options['connections'], options['duration'])
+            finally:
+                server.terminate()
+                server.wait()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}  statuses")
+        for mode, row in results.items():
+            self.stdout.write(
+                f"{mode:<6}{row['per_second']:>10}{str(row['p50_ms']):>10}{str(row['p95_ms']):>10}"
+                f"{str(row['p99_ms']):>10}{row['errors']:>8}  {row['statuses']}"
+            )
@@ -0,0 +1,124 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from books_api import sqlite
+from books_api.benchmark import summarize
+
+# What settings.py pairs with each profile: production starts write
+# transactions with BEGIN IMMEDIATE, default with a plain (deferred) BEGIN.
+BEGIN = {'default': 'BEGIN', 'production': 'BEGIN IMMEDIATE'}
+
+SCHEMA = '''
+    CREATE TABLE book (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        pub_date TEXT NOT NULL,
+        editorial_id INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE INDEX book_updated_at ON book (updated_at);
+'''
+
+
+def seed(path, rows):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    db.executemany(
+        'INSERT INTO book (title, description, pub_date, editorial_id, updated_at) VALUES (?, ?, ?, ?, ?)',
+        ((f'Book {i}', 'x' * 200, '2000-01-01', i % 50, '2000-01-01') for i in range(rows)),
+    )
+    db.commit()
+    db.close()
+
+
+def worker(path, profile, duration, write_ratio, seed_value):
+    '''
+    Runs a mix of keyset page reads and small write transactions (read a
+    row, update it, insert another) until `duration` seconds have passed
+    '''
+    rng = random.Random(seed_value)
+    db = sqlite3.connect(path, timeout=5, isolation_level=None)
+    sqlite.apply_pragmas(db.cursor(), sqlite.get_pragmas(profile))
+    top = db.execute('SELECT max(id) FROM book').fetchone()[0]
+    reads, writes, errors = [], [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if rng.random() < write_ratio:
+                pk = rng.randint(1, top)
+                db.execute(BEGIN[profile])
+                try:
+                    db.execute('SELECT title FROM book WHERE id = ?', (pk,)).fetchone()
+                    db.execute("UPDATE book SET updated_at = datetime('now') WHERE id = ?", (pk,))
+                    db.execute(
+                        'INSERT INTO book (title, description, pub_date, editorial_id, updated_at) '
+                        "VALUES ('New', '', '2020-01-01', 1, datetime('now'))"
+                    )
+                    db.execute('COMMIT')
+                except sqlite3.Error:
+                    db.execute('ROLLBACK')
+                    raise
+                writes.append(time.perf_counter() - start)
+            else:
+                db.execute('SELECT * FROM book WHERE id > ? ORDER BY id LIMIT 100', (rng.randint(1, top),)).fetchall()
+                reads.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            errors += 1
+    db.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    help = 'Compares SQLite profiles under concurrent reads and writes from several processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=sorted(sqlite.PROFILES),
+                            help='Profile to run (repeatable). Defaults to all of them.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent processes (default 8).')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per profile (default 10).')
+        parser.add_argument('--write-ratio', type=float, default=0.1,
+                            help='Fraction of operations that write (default 0.1).')
+        parser.add_argument('--rows', type=int, default=20000, help='Rows seeded before each run (default 20000).')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profile'] or sorted(sqlite.PROFILES):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                seed(path, options['rows'])
+                args = [
+                    (path, profile, options['duration'], options['write_ratio'], n)
+                    for n in range(options['workers'])
+                ]
+                start = time.monotonic()
+                with multiprocessing.get_context('spawn').Pool(options['workers']) as pool:
+                    outcomes = pool.starmap(worker, args)
+                elapsed = time.monotonic() - start
+            results[profile] = {
+                'reads': summarize([t for reads, _, _ in outcomes for t in reads], elapsed),
+                'writes': summarize([t for _, writes, _ in outcomes for t in writes], elapsed),
+                'errors': sum(errors for _, _, errors in outcomes),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'profile':<12}{'op':<8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for profile, result in results.items():
+            for op in ('reads', 'writes'):
+                row = result[op]
+                self.stdout.write(
+                    f"{profile:<12}{op:<8}{row['per_second']:>10}{str(row['p50_ms']):>10}"
+                    f"{str(row['p95_ms']):>10}{str(row['p99_ms']):>10}"
+                    f"{result['errors'] if op == 'writes' else '':>8}"
+                )
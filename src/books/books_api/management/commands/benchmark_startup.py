@@ -0,0 +1,184 @@
+import os
+import re
+import runpy
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books_api import tokens
+from books_api.loadgen import run_load
+from books_api.management.commands.benchmark_asgi import server_environ
+from books_api.models import User
+
+READY = re.compile(r'Worker (\d+) ready')
+# The command line start-server.sh used before gunicorn.conf.py: 9 sync
+# workers, each importing the app itself, never restarted.
+BASELINE = {'BOOKS_API_WORKERS': '9', 'BOOKS_API_THREADS': '1', 'BOOKS_API_PRELOAD': '0', 'BOOKS_API_MAX_REQUESTS': '0'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def memory(pid):
+    '''
+    Returns the RSS, PSS and USS (private pages) of a process, in bytes,
+    from /proc/<pid>/smaps_rollup
+    '''
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0]) * 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts Gunicorn with gunicorn.conf.py and reports how long it takes until every worker is '
+        'ready, and the memory of each worker after serving some requests'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', action='store_true',
+                            help='Measure the former setup instead: 9 sync workers, no preload, no recycling.')
+        parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                            help='Environment variable for gunicorn.conf.py, e.g. BOOKS_API_THREADS=4 (repeatable).')
+        parser.add_argument('--runs', type=int, default=3, help='Server starts; the median is reported (default 3).')
+        parser.add_argument('--username', help='Authenticate the requests as this user (with a bearer token).')
+        parser.add_argument('--path', default='/books/api/book', help='Path requested before measuring memory.')
+        parser.add_argument('--duration', type=float, default=3, help='Seconds of requests before measuring memory (default 3).')
+        parser.add_argument('--connections', type=int, default=10, help='Concurrent connections (default 10).')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the workers (default 60).')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive.')
+        env = dict(server_environ(), **(BASELINE if options['baseline'] else {}))
+        for item in options['env']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'--env expects NAME=VALUE, not {item!r}.')
+            env[name] = value
+        headers = {}
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['username']}' does not exist.")
+            headers['Authorization'] = f'Bearer {tokens.issue_token(user)}'
+
+        runs = [self.run_server(env, headers, options) for _ in range(options['runs'])]
+        run = sorted(runs, key=lambda run: run['ready_seconds'])[len(runs) // 2]
+        workers = run['workers']
+        self.stdout.write(
+            f"{len(workers)} workers ready in {statistics.median(r['ready_seconds'] for r in runs):.2f}s "
+            f"(first response after {statistics.median(r['first_response_seconds'] for r in runs):.2f}s), "
+            f"{run['load']['per_second']} req/s {run['load']['statuses']}"
+        )
+        self.stdout.write(f"{'':<10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+        for name, rows in (('master', [run['master']]), ('worker', workers)):
+            averages = [statistics.mean(row[key] for row in rows) / 1e6 for key in ('rss', 'pss', 'uss')]
+            self.stdout.write(f'{name:<10}' + ''.join(f'{value:>10.1f}' for value in averages))
+        total = (run['master']['pss'] + sum(row['pss'] for row in workers)) / 1e6
+        self.stdout.write(self.style.SUCCESS(f'Total PSS: {total:.1f} MB'))
+
+    def run_server(self, env, headers, options):
+        '''
+        Starts Gunicorn, waits for every worker, serves requests for a few
+        seconds, reads the memory of every process and stops it
+        '''
+        port = free_port()
+        env = dict(env, BOOKS_API_BIND=f'127.0.0.1:{port}')
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', self.config_path()],
+            cwd=settings.BASE_DIR, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True,
+        )
+        ready = {}
+        log = []
+
+        def read_log():
+            for line in server.stderr:
+                log.append(line)
+                match = READY.search(line)
+                if match:
+                    ready[int(match.group(1))] = time.monotonic() - started
+
+        reader = threading.Thread(target=read_log, daemon=True)
+        reader.start()
+        try:
+            first_response = self.wait_for_response(server, port, started, options['timeout'])
+            expected = self.read_config(env)['workers']
+            deadline = started + options['timeout']
+            while len(ready) < expected:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise CommandError('Gunicorn did not start:\n' + ''.join(log[-20:]))
+                time.sleep(0.01)
+            ready_seconds = max(ready.values())
+            load = run_load('127.0.0.1', port, [(options['path'], 'GET', None, headers)], options['connections'], options['duration'])
+            children = self.children(server.pid)
+            return {
+                'ready_seconds': ready_seconds,
+                'first_response_seconds': first_response,
+                'load': load,
+                'master': memory(server.pid),
+                'workers': [memory(pid) for pid in children],
+            }
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            reader.join(5)
+
+    def wait_for_response(self, server, port, started, timeout):
+        while time.monotonic() < started + timeout:
+            if server.poll() is not None:
+                raise CommandError('Gunicorn exited; is the configuration valid?')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+                    sock.sendall(b'GET /books/api/book HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n')
+                    if sock.recv(16).startswith(b'HTTP/'):
+                        return time.monotonic() - started
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise CommandError(f'No response from Gunicorn after {timeout}s.')
+
+    def read_config(self, env):
+        '''
+        Evaluates gunicorn.conf.py as Gunicorn would, with `env` as the
+        environment
+        '''
+        saved = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(env)
+        try:
+            return runpy.run_path(self.config_path())
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+    def config_path(self):
+        return os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+
+    def children(self, pid):
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
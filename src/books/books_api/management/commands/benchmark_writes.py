@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from books_api import tokens
+from books_api.loadgen import run_load
+from books_api.management.commands.benchmark_asgi import server_environ, wait_for_port
+from books_api.models import Book, Editorial, User
+
+MODES = ('direct', 'group')
+LOCKED = 'django.db.utils.OperationalError: database is locked'
+
+
+class Command(BaseCommand):
+    help = (
+        'Starts Gunicorn on a copy of the database, with every worker writing itself (direct) and with '
+        'the writes handed to run_writer (group), and measures both under concurrent write requests'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='User the requests are authenticated as (with a bearer token).')
+        parser.add_argument('--mode', action='append', choices=MODES, help='Mode to run (repeatable). Defaults to both.')
+        parser.add_argument('--connections', type=int, default=50, help='Concurrent connections (default 50).')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per mode (default 10).')
+        parser.add_argument('--workers', type=int, default=9, help='Gunicorn workers (default 9).')
+        parser.add_argument('--threads', type=int, default=1, help='Threads per worker (default 1: sync workers).')
+        parser.add_argument('--port', type=int, default=8040, help='Port the servers listen on (default 8040).')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied for the benchmark.')
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+        book = Book.objects.order_by('id').first()
+        editorial = Editorial.objects.order_by('id').first()
+        if book is None:
+            raise CommandError('There are no books; see seed_catalog.')
+        headers = {'Authorization': f'Bearer {tokens.issue_token(user)}'}
+        author = {'firstname': 'Firstname', 'lastname': 'Lastname', 'birthdate': '1980-01-01'}
+        requests = [
+            ('/books/api/author', 'POST', json.dumps(author).encode(), headers),
+            (f'/books/api/book/{book.id}', 'PUT', json.dumps({'title': book.title}).encode(), headers),
+            (f'/books/api/editorial/{editorial.id}', 'PUT', json.dumps({'name': editorial.name}).encode(), headers),
+        ]
+
+        results = {}
+        directory = tempfile.mkdtemp()
+        try:
+            for mode in options['mode'] or MODES:
+                results[mode] = self.run_mode(mode, directory, requests, options)
+        finally:
+            shutil.rmtree(directory)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'locked':>8}  statuses")
+        for mode, row in results.items():
+            self.stdout.write(
+                f"{mode:<8}{row['per_second']:>10}{str(row['p50_ms']):>10}{str(row['p95_ms']):>10}"
+                f"{str(row['p99_ms']):>10}{row['errors']:>8}{row['locked']:>8}  {row['statuses']}"
+            )
+
+    def run_mode(self, mode, directory, requests, options):
+        '''
+        Serves a fresh copy of the database in `mode` and measures it. Counts
+        the "database is locked" errors the server logged
+        '''
+        database = os.path.join(directory, f'{mode}.sqlite3')
+        source = sqlite3.connect(settings.DATABASES['default']['NAME'])
+        target = sqlite3.connect(database)
+        source.backup(target)
+        source.close()
+        target.close()
+        socket_path = os.path.join(directory, f'{mode}.sock')
+        env = dict(
+            server_environ(),
+            BOOKS_API_DATABASE_PATH=database,
+            BOOKS_API_BIND=f"127.0.0.1:{options['port']}",
+            BOOKS_API_WORKERS=str(options['workers']),
+            BOOKS_API_THREADS=str(options['threads']),
+            BOOKS_API_GROUP_COMMIT='1' if mode == 'group' else '0',
+            BOOKS_API_GROUP_COMMIT_SOCKET=socket_path,
+            BOOKS_API_CACHE_DIR=os.path.join(directory, f'{mode}-cache'),
+        )
+        log_path = os.path.join(directory, f'{mode}.log')
+        processes = []
+        with open(log_path, 'w') as log:
+            try:
+                if mode == 'group':
+                    processes.append(subprocess.Popen(
+                        [sys.executable, 'manage.py', 'run_writer'], cwd=settings.BASE_DIR, env=env, stdout=log, stderr=log,
+                    ))
+                processes.append(subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--log-level', 'warning'],
+                    cwd=settings.BASE_DIR, env=env, stdout=log, stderr=log,
+                ))
+                if not wait_for_port('127.0.0.1', options['port'], timeout=30):
+                    raise CommandError(f'{mode} server did not start.')
+                result = run_load('127.0.0.1', options['port'], requests, options['connections'], options['duration'])
+            finally:
+                for process in reversed(processes):
+                    process.terminate()
+                    process.wait()
+        with open(log_path) as log:
+            # One per failed request, at the end of its traceback.
+            result['locked'] = sum(1 for line in log if line.startswith(LOCKED))
+        return result
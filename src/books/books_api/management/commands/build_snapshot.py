@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books_api import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes a new precompressed snapshot of the catalog, or with --watch keeps rebuilding it '
+        'after writes (see BOOKS_API_SNAPSHOT_DEBOUNCE)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='Keep running, rebuilding the snapshot after writes.')
+        parser.add_argument('--interval', type=float, default=1, help='--watch: seconds between checks (default 1).')
+
+    def handle(self, *args, **options):
+        if not options['watch']:
+            self.report(snapshots.build())
+            return
+        while True:
+            try:
+                manifest = snapshots.build_if_due()
+            except Exception as exc:
+                # The changes stay pending: tried again on the next check.
+                self.stderr.write(f'Snapshot failed: {exc!r}')
+                manifest = None
+            if manifest is not None:
+                self.report(manifest)
+            time.sleep(options['interval'])
+
+    def report(self, manifest):
+        if manifest is None:
+            self.stdout.write('Another snapshot is being built.')
+            return
+        sizes = ', '.join(f'{encoding} {size / 1e6:.1f} MB' for encoding, size in manifest['sizes'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {manifest['version']}: {manifest['counts']['books']} books in "
+            f"{manifest['build_seconds']:.1f}s ({sizes})."
+        ))
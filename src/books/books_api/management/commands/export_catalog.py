@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books_api.catalog_io import FORMATS, TABLES, RowWriter, path_of
+from books_api.sqlite import read_transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the editorials, authors, books and author-book links to a directory, one CSV or '
+        'JSONL file per table, to be loaded with import_catalog'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory the files are written to (created if missing).')
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='File format (default csv).')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows fetched per query (default 5000).')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        directory, file_format = options['directory'], options['format']
+        os.makedirs(directory, exist_ok=True)
+        started = time.perf_counter()
+        total = 0
+        with read_transaction():
+            for name, model, columns, _ in TABLES:
+                path = path_of(directory, name, file_format)
+                table_started = time.perf_counter()
+                writer = RowWriter(path, file_format, columns)
+                count = 0
+                try:
+                    # iterator() fetches chunk_size rows at a time instead of
+                    # the whole table.
+                    rows = model.objects.order_by('pk').values_list(*columns)
+                    batch = []
+                    for row in rows.iterator(chunk_size=options['chunk_size']):
+                        batch.append(row)
+                        if len(batch) == options['chunk_size']:
+                            writer.write(batch)
+                            count += len(batch)
+                            batch = []
+                    writer.write(batch)
+                    count += len(batch)
+                finally:
+                    writer.close()
+                total += count
+                self.report(name, count, time.perf_counter() - table_started)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {total} rows to {directory} in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s).'
+        ))
+
+    def report(self, name, count, elapsed):
+        self.stdout.write(f'{name}: {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)')
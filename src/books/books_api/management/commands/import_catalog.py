@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from books_api import changes, counts, response_cache, search, snapshots, stats
+from books_api.catalog_io import FORMATS, TABLES, detect_format, get_parser, path_of, read_rows
+
+CHECKPOINT_NAME = '.import_checkpoint.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads a directory written by export_catalog (or in the same format), keeping the ids of the '
+        'files. Rows are inserted in batches, one transaction per chunk; an interrupted import '
+        'carries on from its last committed chunk with --resume'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory holding the editorials, authors, books and author_books files.')
+        parser.add_argument('--format', choices=FORMATS, help='File format (default: guessed from the file names).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default 5000).')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per transaction (default 50000).')
+        parser.add_argument('--checkpoint', help=f'Checkpoint file (default: <directory>/{CHECKPOINT_NAME}).')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows the checkpoint records as imported.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--batch-size and --chunk-size must be positive.')
+        directory = os.path.abspath(options['directory'])
+        file_format = options['format'] or detect_format(directory)
+        if file_format is None:
+            raise CommandError(f'No editorials.csv or editorials.jsonl (or both) in {directory}; use --format.')
+        for name, *_ in TABLES:
+            if not os.path.exists(path_of(directory, name, file_format)):
+                raise CommandError(f'{path_of(directory, name, file_format)} does not exist.')
+        self.batch_size, self.chunk_size = options['batch_size'], options['chunk_size']
+        self.checkpoint_path = options['checkpoint'] or os.path.join(directory, CHECKPOINT_NAME)
+        self.checkpoint = self.read_checkpoint(directory, file_format) if options['resume'] else {
+            'directory': directory, 'format': file_format, 'done': {},
+        }
+
+        # Foreign keys are checked against the ids known to exist, in memory:
+        # a per-row query would cost more than the insert itself, and the
+        # database only reports deferred violations at COMMIT, without
+        # saying which row.
+        self.known = {
+            name: set(model.objects.values_list('pk', flat=True).iterator(chunk_size=self.chunk_size))
+            for name, model, _, _ in TABLES if name != 'author_books'
+        }
+
+        started = time.perf_counter()
+        total = 0
+        sqlite = connection.vendor == 'sqlite'
+        # Without the search index and its triggers while loading: it is
+        # built in one pass at the end, even if the import fails, so the
+        # chunks already committed are searchable.
+        if sqlite:
+            with transaction.atomic(), connection.cursor() as cursor:
+                search.drop_index(cursor)
+        try:
+            for name, model, columns, references in TABLES:
+                total += self.load(name, model, columns, references, path_of(directory, name, file_format), file_format)
+        finally:
+            self.finish(sqlite)
+        os.remove(self.checkpoint_path)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total} rows from {directory} in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s).'
+        ))
+
+    def read_checkpoint(self, directory, file_format):
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read the checkpoint {self.checkpoint_path}: {exc}')
+        if checkpoint.get('directory') != directory or checkpoint.get('format') != file_format:
+            raise CommandError(f'The checkpoint {self.checkpoint_path} belongs to another import.')
+        return checkpoint
+
+    def write_checkpoint(self):
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.checkpoint_path)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(self.checkpoint, tmp)
+        os.replace(path, self.checkpoint_path)
+
+    def load(self, name, model, columns, references, path, file_format):
+        '''
+        Inserts the rows of one file, chunk_size at a time, each chunk in a
+        transaction followed by a checkpoint. Returns the number of rows
+        read from the file (already imported ones excluded)
+        '''
+        parsers = {column: get_parser(model, column) for column in columns}
+        done = self.checkpoint['done'].get(name, 0)
+        started = time.perf_counter()
+        chunk = []
+        count = 0
+        try:
+            for index, (line, raw) in enumerate(read_rows(path, file_format, columns)):
+                if index < done:
+                    continue
+                try:
+                    values = {column: parsers[column](raw[column]) for column in columns}
+                except (KeyError, TypeError, ValueError) as exc:
+                    raise CommandError(f'{path}, line {line}: invalid row ({exc!r}).')
+                for column, target in references.items():
+                    if values[column] not in self.known[target]:
+                        raise CommandError(f'{path}, line {line}: {column} {values[column]} does not exist.')
+                chunk.append(model(**values))
+                if len(chunk) == self.chunk_size:
+                    count += self.commit(name, model, chunk, done + count)
+                    chunk = []
+                    self.stdout.write(f'{name}: {count} rows ({count / (time.perf_counter() - started):.0f} rows/s)', ending='\r')
+        except ValueError as exc:
+            # Unreadable file: missing CSV columns, bad JSON.
+            raise CommandError(f'{path}: {exc}')
+        count += self.commit(name, model, chunk, done + count)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)')
+        return count
+
+    def commit(self, name, model, chunk, done):
+        '''
+        Rows whose id (or link) already exists are left as they are, so a
+        chunk imported twice, after a crash between its COMMIT and its
+        checkpoint, is harmless
+        '''
+        with transaction.atomic():
+            model.objects.bulk_create(chunk, batch_size=self.batch_size, ignore_conflicts=True)
+        if name in self.known:
+            self.known[name].update(obj.pk for obj in chunk)
+        self.checkpoint['done'][name] = done + len(chunk)
+        self.write_checkpoint()
+        return len(chunk)
+
+    def finish(self, sqlite):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if sqlite:
+                    search.create_index(cursor)
+                # Inserting explicit ids does not move sequences forward on
+                # the databases that have them (a no-op on SQLite).
+                for sql in connection.ops.sequence_reset_sql(no_style(), [model for _, model, _, _ in TABLES]):
+                    cursor.execute(sql)
+            stats.rebuild()
+            counts.rebuild()
+            # Bulk inserts send no signals: mirrors of the catalog resync.
+            changes.reset()
+            transaction.on_commit(response_cache.get_cache().clear)
+            snapshots.changed()
@@ -0,0 +1,31 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from books_api import changes
+
+
+class Command(BaseCommand):
+    help = (
+        'Compacts the change log behind /api/changes, keeping only the latest change of each object, '
+        'and deletes the changes older than the retention (clients behind them must resync)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='Retention in days (default: BOOKS_API_CHANGES_RETENTION_DAYS).')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'BOOKS_API_CHANGES_RETENTION_DAYS', 30)
+        if days < 0:
+            raise CommandError('--days must not be negative.')
+        with transaction.atomic():
+            compacted = changes.compact()
+            expired = changes.expire(timezone.now() - datetime.timedelta(days=days))
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {compacted} superseded and {expired} expired changes; the log starts after seq {changes.horizon()}.'
+        ))
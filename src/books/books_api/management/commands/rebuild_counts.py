@@ -0,0 +1,41 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books_api import counts, response_cache
+from books_api.models import Author, Book, Editorial
+
+
+class Command(BaseCommand):
+    help = 'Recounts the book and author counters of the catalog from scratch, or only checks them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the stored counters with the tables; fail if they differ.',
+        )
+        parser.add_argument(
+            '--clear-cache', action='store_true',
+            help='Also empty the response cache, e.g. once after the migration that added the counters.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            diffs = counts.differences()
+            for label, pk, have, want in diffs:
+                self.stdout.write(f'{label}[{pk}]: stored {have}, expected {want}')
+            if options['verify']:
+                if diffs:
+                    raise CommandError(f'{len(diffs)} counters out of date.')
+                self.stdout.write(self.style.SUCCESS('Catalog counters are up to date.'))
+                return
+            counts.rebuild()
+            fixed = defaultdict(list)
+            for label, pk, _, _ in diffs:
+                fixed[label.split('.')[0]].append(pk)
+            for model in (Editorial, Author, Book):
+                counts.invalidate(model, fixed[model._meta.model_name])
+            if options['clear_cache']:
+                transaction.on_commit(response_cache.get_cache().clear)
+        self.stdout.write(self.style.SUCCESS(f'Catalog counters rebuilt ({len(diffs)} counters fixed).'))
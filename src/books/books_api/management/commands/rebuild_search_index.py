@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from books_api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index over Book titles, descriptions and author names'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The search index is only available on SQLite.')
+        with transaction.atomic(), connection.cursor() as cursor:
+            count = search.rebuild_index(cursor)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} books.'))
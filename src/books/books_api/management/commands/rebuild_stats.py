@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books_api import stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the catalog statistics from scratch, or only checks them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the stored counters with the tables; fail if they differ.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            diffs = stats.differences()
+            for name, key, have, want in diffs:
+                self.stdout.write(f'{name}[{key}]: stored {have}, expected {want}')
+            if options['verify']:
+                if diffs:
+                    raise CommandError(f'{len(diffs)} counters out of date.')
+                self.stdout.write(self.style.SUCCESS('Catalog statistics are up to date.'))
+                return
+            stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Catalog statistics rebuilt ({len(diffs)} counters fixed).'))
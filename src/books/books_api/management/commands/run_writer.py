@@ -0,0 +1,35 @@
+import os
+import threading
+
+from django.core.management.base import BaseCommand
+
+from books_api.group_commit import Writer, WriterServer, get_socket_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the single writer the workers hand their write requests to with BOOKS_API_GROUP_COMMIT, '
+        'committing the requests that arrive together in one transaction'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', help='Unix socket to listen on (default: BOOKS_API_GROUP_COMMIT_SOCKET).')
+        parser.add_argument('--max-batch', type=int, help='Requests per transaction (default: BOOKS_API_GROUP_COMMIT_MAX_BATCH).')
+
+    def handle(self, *args, **options):
+        path = options['socket'] or get_socket_path()
+        # Private to the user the writer and the workers run as.
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Left behind by a writer that did not exit cleanly.
+        if os.path.exists(path):
+            os.remove(path)
+        writer = Writer(options['max_batch'])
+        server = WriterServer(path, writer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.stdout.write(f'Writing on {path}, up to {writer.max_batch} requests per transaction.')
+        try:
+            writer.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.remove(path)
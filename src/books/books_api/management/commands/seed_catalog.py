@@ -0,0 +1,143 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from books_api import changes, counts, response_cache, search, snapshots, stats
+from books_api.models import Author, Book, CatalogStat, Editorial
+
+WORDS = (
+    'shadow river garden winter silent empire glass memory hunger ocean night city stone letter '
+    'summer forgotten secret house island storm paper crown desert fire iron light road mirror '
+    'history love war journey dream music north broken golden last little hidden wild quiet'
+).split()
+FIRSTNAMES = (
+    'Ana Bruno Carmen Diego Elena Felipe Gloria Hugo Irene Jorge Laura Manuel Nora Oscar '
+    'Paula Ramon Sara Tomas Ursula Victor Alice Bernard Claire David Emma Frank Grace Henry'
+).split()
+LASTNAMES = (
+    'Garcia Martinez Lopez Sanchez Perez Gomez Ruiz Diaz Moreno Alvarez Romero Navarro Torres '
+    'Smith Johnson Brown Miller Wilson Taylor Anderson Thomas Moore Martin Clark Walker Young'
+).split()
+# Share of books with 0, 1, 2, 3 and 4 authors.
+AUTHORS_PER_BOOK = {0: 0.03, 1: 0.70, 2: 0.19, 3: 0.06, 4: 0.02}
+
+
+def random_date(rng, first_year, last_year):
+    start = datetime.date(first_year, 1, 1).toordinal()
+    end = datetime.date(last_year, 12, 31).toordinal()
+    return datetime.date.fromordinal(rng.randint(start, end))
+
+
+def phrase(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with a synthetic catalog of editorials, books and authors, '
+        'the same for the same options (--seed included), for benchmarks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--editorials', type=int, default=10000, help='Editorials to create (default 10000).')
+        parser.add_argument('--books', type=int, default=1000000, help='Books to create (default 1000000).')
+        parser.add_argument('--authors', type=int, default=300000, help='Authors to create (default 300000).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default 0).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default 5000).')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete every editorial, book and author first, and empty the response cache.')
+
+    def handle(self, *args, **options):
+        if min(options['editorials'], options['books'], options['authors']) < 0 or options['batch_size'] < 1:
+            raise CommandError('Counts must not be negative and --batch-size must be positive.')
+        if options['books'] and not options['editorials']:
+            raise CommandError('Books need at least one editorial.')
+        rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        # The search index is dropped while inserting and built again in one
+        # pass at the end, instead of being updated by a trigger per row.
+        with transaction.atomic():
+            sqlite = connection.vendor == 'sqlite'
+            if sqlite:
+                with connection.cursor() as cursor:
+                    search.drop_index(cursor)
+            if options['clear']:
+                self.clear()
+            editorial_ids = self.create_editorials(rng, options['editorials'])
+            author_ids = self.create_authors(rng, options['authors'])
+            books, links = self.create_books(rng, options['books'], editorial_ids, author_ids)
+            if sqlite:
+                with connection.cursor() as cursor:
+                    search.create_index(cursor)
+            stats.rebuild()
+            counts.rebuild()
+            # Bulk inserts send no signals: mirrors of the catalog resync.
+            changes.reset()
+            if options['clear']:
+                transaction.on_commit(response_cache.get_cache().clear)
+            else:
+                response_cache.invalidate('editorial-list', 'author-list', 'book-list', 'editorials', 'authors')
+            snapshots.changed()
+
+        elapsed = time.perf_counter() - started
+        rows = len(editorial_ids) + len(author_ids) + books + links
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(editorial_ids)} editorials, {len(author_ids)} authors, {books} books and '
+            f'{links} author-book links in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s).'
+        ))
+
+    def clear(self):
+        # Plain DELETEs: the ORM would load every row to send its signals.
+        with connection.cursor() as cursor:
+            for model in (Author.books.through, Book, Author, Editorial, CatalogStat):
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+    def insert(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_editorials(self, rng, count):
+        editorials = [Editorial(name=f'{phrase(rng, 1, 2).title()} Press {i}') for i in range(count)]
+        return [editorial.pk for editorial in self.insert(Editorial, editorials)]
+
+    def create_authors(self, rng, count):
+        ids = []
+        for start in range(0, count, self.batch_size):
+            authors = [
+                Author(firstname=rng.choice(FIRSTNAMES), lastname=rng.choice(LASTNAMES),
+                       birthdate=random_date(rng, 1900, 2000))
+                for _ in range(start, min(count, start + self.batch_size))
+            ]
+            ids.extend(author.pk for author in self.insert(Author, authors))
+        return ids
+
+    def create_books(self, rng, count, editorial_ids, author_ids):
+        '''
+        Books go to editorials uniformly. Authors are picked with a skew
+        towards the first ones, so a few of them write many books, as in a
+        real catalog
+        '''
+        Link = Author.books.through
+        fan_out, weights = zip(*AUTHORS_PER_BOOK.items())
+        created = links = 0
+        for start in range(0, count, self.batch_size):
+            books = [
+                Book(title=f'{phrase(rng, 2, 5).capitalize()} {start + i}', description=phrase(rng, 10, 40) + '.',
+                     pub_date=random_date(rng, 1900, 2024), editorial_id=rng.choice(editorial_ids))
+                for i in range(min(self.batch_size, count - start))
+            ]
+            books = self.insert(Book, books)
+            rows = []
+            for book in books:
+                wanted = rng.choices(fan_out, weights)[0] if author_ids else 0
+                chosen = {author_ids[int(len(author_ids) * rng.random() ** 3)] for _ in range(wanted)}
+                rows.extend(Link(book_id=book.pk, author_id=author_id) for author_id in chosen)
+            self.insert(Link, rows)
+            created += len(books)
+            links += len(rows)
+            self.stdout.write(f'{created}/{count} books', ending='\r')
+        return created, links
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from books_api import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the primary database into the read replicas (BOOKS_API_READ_DATABASES) with the '
+        'SQLite backup API, or with --watch keeps copying it every BOOKS_API_REPLICA_SYNC_INTERVAL seconds'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', help='Replica to sync (repeatable; default: all of them).')
+        parser.add_argument('--watch', action='store_true', help='Keep running, syncing the replicas periodically.')
+        parser.add_argument('--interval', type=float, help='--watch: seconds between syncs (default: BOOKS_API_REPLICA_SYNC_INTERVAL).')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or replicas.get_read_databases()
+        if not aliases:
+            raise CommandError('No replica to sync: set BOOKS_API_READ_REPLICA=1 or use --database.')
+        for alias in aliases:
+            if alias not in connections or alias == 'default' or connections[alias].vendor != 'sqlite':
+                raise CommandError(f"'{alias}' is not an SQLite database other than the primary.")
+        interval = options['interval'] or getattr(settings, 'BOOKS_API_REPLICA_SYNC_INTERVAL', 2)
+        while True:
+            for alias in aliases:
+                try:
+                    started = replicas.sync(alias)
+                except Exception as exc:
+                    if not options['watch']:
+                        raise
+                    # The replica ages past BOOKS_API_REPLICA_MAX_LAG and
+                    # stops being read until a sync succeeds.
+                    self.stderr.write(f'Syncing {alias} failed: {exc!r}')
+                    continue
+                if not options['watch']:
+                    self.stdout.write(self.style.SUCCESS(f'{alias} synced in {time.time() - started:.2f}s.'))
+            if not options['watch']:
+                return
+            time.sleep(interval)
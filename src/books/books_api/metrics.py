@@ -0,0 +1,389 @@
+"""
+Per-endpoint request metrics in the Prometheus text format.
+
+MetricsMiddleware records, for every request, under the name of the URL
+pattern it matched (`book-list`, `author-book-detail`...):
+
+* the latency, as a histogram
+* the number of SQL queries and the time spent in them, counted by a
+  wrapper installed with execute_wrapper() on every new connection
+* the time spent rendering the response body
+* the size of the response body, as a histogram
+
+and sends the same figures back in a Server-Timing header.
+
+Every worker keeps its own samples in memory and writes them to
+BOOKS_API_METRICS_DIR/<pid>-<start time>.json at most once every
+BOOKS_API_METRICS_FLUSH_INTERVAL seconds. When a worker exits, the Gunicorn
+master folds its file into exited.json (fold(), from child_exit in
+gunicorn.conf.py), so recycled workers do not pile up files. /metrics adds
+up the files of the running workers and exited.json: counters never go back,
+which is why start-server.sh empties the directory on start.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+FAMILIES = {
+    'books_api_requests_total': ('counter', 'Requests handled, by URL name, method and status.'),
+    'books_api_request_duration_seconds': ('histogram', 'Time from the first middleware to the response, by URL name and method.'),
+    'books_api_db_queries_total': ('counter', 'SQL queries run, by URL name.'),
+    'books_api_db_query_seconds_total': ('counter', 'Time spent in SQL queries, by URL name.'),
+    'books_api_render_seconds_total': ('counter', 'Time spent rendering response bodies, by URL name.'),
+    'books_api_response_size_bytes': ('histogram', 'Size of the response bodies, streams excluded, by URL name.'),
+}
+
+# The samples of the workers that exited.
+EXITED = 'exited.json'
+
+current = contextvars.ContextVar('books_api_request_metrics', default=None)
+
+
+class RequestMetrics:
+    '''
+    What one request spent, filled in while it runs
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+class Registry:
+    '''
+    The samples of one worker: {(sample name, sorted labels): value}
+    '''
+
+    def __init__(self, pid=None):
+        self._pid = pid
+        self._started = None
+        self.samples = defaultdict(float)
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+
+    @property
+    def pid(self):
+        # Looked up every time: the registry may be created before the
+        # server forks its workers.
+        return self._pid or os.getpid()
+
+    @property
+    def filename(self):
+        '''
+        <pid>-<start time>.json: a worker may be given the pid of one that
+        exited, whose file must not be overwritten
+        '''
+        pid = self.pid
+        if self._started is None or self._started[0] != pid:
+            self._started = (pid, time.time_ns())
+        return f'{pid}-{self._started[1]}.json'
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.samples[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            # Buckets the value does not fall in are added to as well: a
+            # histogram must expose all of them.
+            for le in buckets:
+                self.samples[(f'{name}_bucket', tuple(sorted({**labels, 'le': str(le)}.items())))] += value <= le
+            key = tuple(sorted(labels.items()))
+            self.samples[(f'{name}_bucket', tuple(sorted({**labels, 'le': '+Inf'}.items())))] += 1
+            self.samples[(f'{name}_sum', key)] += value
+            self.samples[(f'{name}_count', key)] += 1
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def flush(self, directory=None, force=False):
+        '''
+        Writes the samples to <directory>/<filename>, atomically, unless that
+        was done less than BOOKS_API_METRICS_FLUSH_INTERVAL seconds ago
+        '''
+        now = time.monotonic()
+        if not force and now - self.last_flush < getattr(settings, 'BOOKS_API_METRICS_FLUSH_INTERVAL', 1):
+            return
+        self.last_flush = now
+        directory = directory or get_directory()
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            data = dump_samples(self.samples)
+        write_file(directory, self.filename, data)
+
+
+registry = Registry()
+
+
+@atexit.register
+def flush_on_exit():
+    if registry.samples:
+        try:
+            registry.flush(force=True)
+        except OSError:
+            pass
+
+
+def get_directory():
+    return getattr(settings, 'BOOKS_API_METRICS_DIR', '/tmp/books_api_metrics')
+
+
+def dump_samples(samples):
+    return [[name, list(labels), value] for (name, labels), value in samples.items()]
+
+
+def add_samples(totals, data):
+    for name, labels, value in data:
+        totals[(name, tuple(tuple(label) for label in labels))] += value
+
+
+def write_file(directory, filename, data):
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as tmp:
+        json.dump(data, tmp)
+    os.replace(path, os.path.join(directory, filename))
+
+
+def read_exited(directory):
+    '''
+    exited.json: {"generation", "folded", "samples"}. `folded` lists the
+    worker files fold() added last, which may not be deleted yet
+    '''
+    try:
+        with open(os.path.join(directory, EXITED)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'generation': 0, 'folded': [], 'samples': []}
+
+
+def fold(pid, directory=None):
+    '''
+    Adds the files of the exited worker `pid` to exited.json, then deletes
+    them. Run by the Gunicorn master only, one worker at a time
+    '''
+    directory = directory or get_directory()
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.startswith(f'{pid}-') and name.endswith('.json'))
+    except FileNotFoundError:
+        return
+    if not names:
+        return
+    exited = read_exited(directory)
+    totals = defaultdict(float)
+    add_samples(totals, exited['samples'])
+    for filename in names:
+        if filename in exited['folded']:
+            # Added by a fold() that stopped before deleting it.
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                add_samples(totals, json.load(f))
+        except (OSError, ValueError):
+            continue
+    write_file(directory, EXITED, {'generation': exited['generation'] + 1, 'folded': names, 'samples': dump_samples(totals)})
+    for filename in names:
+        os.remove(os.path.join(directory, filename))
+
+
+def collect(directory=None):
+    '''
+    Adds up the samples of the exited workers, those flushed by the running
+    ones, and the current ones of this worker
+    '''
+    directory = directory or get_directory()
+    while True:
+        exited = read_exited(directory)
+        totals = defaultdict(float)
+        add_samples(totals, exited['samples'])
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            names = []
+        skipped = {EXITED, registry.filename, *exited['folded']}
+        for filename in names:
+            if not filename.endswith('.json') or filename in skipped:
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    add_samples(totals, json.load(f))
+            except (OSError, ValueError):
+                continue
+        # A worker folded meanwhile could be counted twice, or not at all.
+        if read_exited(directory)['generation'] == exited['generation']:
+            break
+    with registry.lock:
+        for key, value in registry.samples.items():
+            totals[key] += value
+    return totals
+
+
+def family_of(sample_name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in FAMILIES:
+            return sample_name[:-len(suffix)]
+    return sample_name
+
+
+def sort_key(item):
+    '''
+    Keeps the samples of one histogram together, buckets first and in
+    increasing order
+    '''
+    (name, labels), _ = item
+    le = dict(labels).get('le')
+    others = [label for label in labels if label[0] != 'le']
+    return (others, not name.endswith('_bucket'), float(le) if le else 0, name)
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def exposition(totals):
+    '''
+    Renders collect() in the Prometheus text format, version 0.0.4
+    '''
+    families = defaultdict(list)
+    for key, value in totals.items():
+        families[family_of(key[0])].append((key, value))
+    lines = []
+    for family in sorted(families):
+        kind, help_text = FAMILIES.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for (name, labels), value in sorted(families[family], key=sort_key):
+            rendered = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+            lines.append(f'{name}{{{rendered}}} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_seconds += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    '''
+    Same as wrapping every request in connection.execute_wrapper(), but
+    also covers the connections async requests use from other threads
+    '''
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def rendering():
+    '''
+    Adds the time spent in the block to the current request's render time
+    '''
+    metrics = current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.render_seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    '''
+    Records the metrics of every request (see the module docstring). Must
+    come first in MIDDLEWARE so the latency covers the other middleware
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled():
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.record(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not self.enabled():
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.record(request, response, metrics)
+
+    def enabled(self):
+        return getattr(settings, 'BOOKS_API_METRICS_ENABLED', True)
+
+    def process_template_response(self, request, response):
+        '''
+        DRF responses are rendered after the view returns: time it from
+        here to the end of render()
+        '''
+        metrics = current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_seconds += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, metrics):
+        elapsed = time.perf_counter() - metrics.start
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        labels = {'view': view}
+        registry.inc('books_api_requests_total', {**labels, 'method': request.method, 'status': str(response.status_code)})
+        registry.observe('books_api_request_duration_seconds', {**labels, 'method': request.method}, elapsed, DURATION_BUCKETS)
+        registry.inc('books_api_db_queries_total', labels, metrics.queries)
+        registry.inc('books_api_db_query_seconds_total', labels, metrics.query_seconds)
+        registry.inc('books_api_render_seconds_total', labels, metrics.render_seconds)
+        if not response.streaming:
+            registry.observe('books_api_response_size_bytes', labels, len(response.content), SIZE_BUCKETS)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.query_seconds * 1000:.1f};desc="{metrics.queries} queries"',
+            f'render;dur={metrics.render_seconds * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+        try:
+            registry.flush()
+        except OSError:
+            pass
+        return response
@@ -0,0 +1,46 @@
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import transaction
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class AtomicWritesMiddleware:
+    '''
+    Runs every write request in one transaction, so the derived data written
+    along (catalog statistics...) commits or rolls back with it, and rolls it
+    back when the response is an error.
+
+    Unlike ATOMIC_REQUESTS, reads stay in autocommit mode: with IMMEDIATE
+    transactions (see books_api/sqlite.py) wrapping them would make every
+    GET take the write lock.
+
+    Under ASGI, reads stay on the event loop. Writes run the transaction in
+    the request's thread; the async ORM calls of the view join that thread,
+    and so the transaction.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method in SAFE_METHODS:
+            return self.get_response(request)
+        return self.atomic_response(self.get_response, request)
+
+    async def __acall__(self, request):
+        if request.method in SAFE_METHODS:
+            return await self.get_response(request)
+        return await sync_to_async(self.atomic_response)(async_to_sync(self.get_response), request)
+
+    def atomic_response(self, get_response, request):
+        with transaction.atomic():
+            response = get_response(request)
+            if response.status_code >= 400:
+                transaction.set_rollback(True)
+            return response
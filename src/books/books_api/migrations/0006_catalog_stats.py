@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books_api', '0005_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('key', models.BigIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'value'], name='catalogstat_name_value_idx')],
+                'constraints': [models.UniqueConstraint(fields=('name', 'key'), name='catalogstat_name_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+from collections import Counter
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def populate_catalog_stats(apps, schema_editor):
+    # Historical models, so this does not depend on stats.py as it is now.
+    # The names are those of stats.py.
+    Author = apps.get_model('books_api', 'Author')
+    Book = apps.get_model('books_api', 'Book')
+    CatalogStat = apps.get_model('books_api', 'CatalogStat')
+    through = Author.books.through
+
+    stats = {
+        'books_per_editorial': Book.objects.order_by().values_list('editorial_id').annotate(n=Count('id')),
+        'books_per_year': Book.objects.order_by().values_list(ExtractYear('pub_date')).annotate(n=Count('id')),
+        'books_per_author': through.objects.order_by().values_list('author_id').annotate(n=Count('id')),
+    }
+    stats = {name: dict(rows) for name, rows in stats.items()}
+    links = Counter(through.objects.values_list('book_id', flat=True).iterator())
+    by_author_count = Counter(links.values())
+    by_author_count[0] = Book.objects.count() - len(links)
+    stats['books_by_author_count'] = by_author_count
+
+    CatalogStat.objects.all().delete()
+    CatalogStat.objects.bulk_create(
+        CatalogStat(name=name, key=key, value=value)
+        for name, counters in stats.items()
+        for key, value in counters.items()
+        if value
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books_api', '0006_catalog_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_catalog_stats, migrations.RunPython.noop),
+    ]
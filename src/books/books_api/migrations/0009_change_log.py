@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books_api', '0008_token_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('editorial', 'editorial'), ('author', 'author'), ('book', 'book'), ('author_book', 'author_book'), ('catalog', 'catalog')], max_length=20)),
+                ('action', models.CharField(choices=[('upsert', 'upsert'), ('delete', 'delete'), ('link', 'link'), ('unlink', 'unlink'), ('reset', 'reset')], max_length=10)),
+                ('object_id', models.BigIntegerField(default=0)),
+                ('related_id', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'related_id', 'seq'], name='change_object_seq_idx')],
+            },
+        ),
+    ]
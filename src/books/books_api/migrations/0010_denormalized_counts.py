@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+from books_api import search
+
+
+# Adding (or removing) the counters rebuilds the editorial, author and book
+# tables: the search triggers are dropped meanwhile (see search.py).
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        search.drop_triggers(cursor)
+
+
+def create_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        search.create_triggers(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books_api', '0009_change_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, create_search_triggers),
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='author_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='editorial',
+            name='book_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['book_count'], name='author_book_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author_count'], name='book_author_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='editorial',
+            index=models.Index(fields=['book_count'], name='editorial_book_count_idx'),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def count(rows):
+    '''
+    Coalesce(count of `rows`, 0), `rows` being filtered on OuterRef('pk')
+    and reduced to the column it is filtered on
+    '''
+    rows = Subquery(rows.order_by().annotate(n=Count('id')).values('n'), output_field=IntegerField())
+    return Coalesce(rows, Value(0))
+
+
+def populate_counts(apps, schema_editor):
+    # Historical models, so this does not depend on counts.py as it is now.
+    Author = apps.get_model('books_api', 'Author')
+    Book = apps.get_model('books_api', 'Book')
+    Editorial = apps.get_model('books_api', 'Editorial')
+    through = Author.books.through
+    now = timezone.now()
+    Editorial.objects.update(
+        book_count=count(Book.objects.filter(editorial_id=OuterRef('pk')).values('editorial_id')), updated_at=now,
+    )
+    Author.objects.update(
+        book_count=count(through.objects.filter(author_id=OuterRef('pk')).values('author_id')), updated_at=now,
+    )
+    Book.objects.update(
+        author_count=count(through.objects.filter(book_id=OuterRef('pk')).values('book_id')), updated_at=now,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books_api', '0010_denormalized_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -2,26 +2,145 @@ from django.db import models
 from django.contrib.auth.models import User
 
 
-class Editorial(models.Model):
+class CountedModel(models.Model):
+    '''
+    A catalog model with denormalized counters (see counts.py). They only
+    change through F() updates: saving a row that already exists leaves
+    them out, so an instance loaded before they changed cannot write its
+    stale values back.
+    '''
+    counters = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counters and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class Editorial(CountedModel):
     name = models.CharField(max_length=100)
+    book_count = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    counters = ('book_count',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book_count'], name='editorial_book_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
     
-class Book(models.Model):
+class Book(CountedModel):
     title = models.CharField(max_length=150)
     description = models.TextField(max_length=1000)
     pub_date = models.DateField()
     editorial = models.ForeignKey(Editorial, on_delete = models.CASCADE)
+    author_count = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    counters = ('author_count',)
+
+    class Meta:
+        # One index per filter/ordering supported by BookListApiView, and
+        # one per ordering behind the editorial filter (the editorial FK
+        # index serves id). The id tie-breaker comes for free: SQLite
+        # appends the rowid to every index entry.
+        indexes = [
+            models.Index(fields=['pub_date'], name='book_pub_date_idx'),
+            models.Index(fields=['title'], name='book_title_idx'),
+            models.Index(fields=['editorial', 'pub_date'], name='book_editorial_pub_date_idx'),
+            models.Index(fields=['editorial', 'title'], name='book_editorial_title_idx'),
+            models.Index(fields=['editorial', 'author_count'], name='book_editorial_authors_idx'),
+            models.Index(fields=['author_count'], name='book_author_count_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.editorial.name})"
     
-class Author(models.Model):
+class Author(CountedModel):
     firstname = models.CharField(max_length=50)
     lastname = models.CharField(max_length=50)
     birthdate = models.DateField()
     books = models.ManyToManyField(Book)
+    book_count = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    counters = ('book_count',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lastname'], name='author_lastname_idx'),
+            models.Index(fields=['birthdate'], name='author_birthdate_idx'),
+            models.Index(fields=['book_count'], name='author_book_count_idx'),
+        ]
     
     def __str__(self):
         return f"{self.firstname} {self.lastname}"
+
+class CatalogStat(models.Model):
+    '''
+    Counter behind /api/stats, kept up to date on every write (see stats.py).
+    `name` says what is counted and `key` for which editorial, year, author
+    or number of authors.
+    '''
+    name = models.CharField(max_length=30)
+    key = models.BigIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'key'], name='catalogstat_name_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['name', 'value'], name='catalogstat_name_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.key}] = {self.value}"
+
+class TokenGeneration(models.Model):
+    '''
+    Bearer tokens (see tokens.py) carry the generation of their user at the
+    time they were issued; bumping it revokes every token issued before.
+    '''
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='token_generation')
+    generation = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} tokens: generation {self.generation}"
+
+class Change(models.Model):
+    '''
+    Append-only log of the catalog writes behind /api/changes (see
+    changes.py), written in the same transaction as the write itself.
+    `object_id` is the changed editorial, author or book; for author-book
+    links it is the author and `related_id` the book. `catalog` rows mark
+    a horizon: the changes before them are not in the log any more.
+    '''
+    KINDS = ['editorial', 'author', 'book', 'author_book', 'catalog']
+    ACTIONS = ['upsert', 'delete', 'link', 'unlink', 'reset']
+
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=[(kind, kind) for kind in KINDS])
+    action = models.CharField(max_length=10, choices=[(action, action) for action in ACTIONS])
+    object_id = models.BigIntegerField(default=0)
+    related_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Finds the later changes of the same object (compaction).
+            models.Index(fields=['kind', 'object_id', 'related_id', 'seq'], name='change_object_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.seq} {self.action} {self.kind} {self.object_id}"
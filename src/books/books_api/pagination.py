@@ -0,0 +1,169 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Opaque cursor pagination keyed on (ordering field, id).
+
+    Every page is fetched with a WHERE clause on the last row seen instead
+    of an OFFSET, so page N costs the same as page 1. The response body is
+    still a plain list; the cursor for the following page travels in the
+    Link header (rel="next").
+
+    The view declares which fields may be used to sort with
+    ``ordering_fields``; ``id`` is always accepted and used as tie-breaker.
+    '''
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'BOOKS_API_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'BOOKS_API_MAX_PAGE_SIZE', 1000)
+        self.next_cursor = None
+
+    def get_ordering(self, request, view):
+        ordering = request.query_params.get(self.ordering_query_param, 'id')
+        field = ordering.lstrip('-')
+        if field != 'id' and field not in getattr(view, 'ordering_fields', []):
+            raise ValidationError({self.ordering_query_param: [f"Cannot order by '{field}'."]})
+        return ordering
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param)
+        if page_size is None:
+            return self.page_size
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: ['A valid integer is required.']})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: ['Ensure this value is greater than or equal to 1.']})
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request, ordering, model):
+        '''
+        Returns the (value, id) position the cursor points at, with the value
+        converted by the ordering field of `model`: cursors come from the
+        client, so a tampered value must not reach the query
+        '''
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if cursor.get('o') != ordering:
+                raise NotFound(self.invalid_cursor_message)
+            value = model._meta.get_field(ordering.lstrip('-')).to_python(cursor['v'])
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            return (value, int(cursor['id']))
+        except (ValueError, TypeError, KeyError, AttributeError, OverflowError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, ordering, value, pk):
+        cursor = json.dumps({'o': ordering, 'v': value, 'id': pk}, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    def apply_position(self, queryset, ordering, position):
+        field = ordering.lstrip('-')
+        value, pk = position
+        if field == 'id':
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            return queryset.filter(**{f'id__{lookup}': pk})
+        # The redundant range on `field` alone is what lets SQLite walk the
+        # index instead of evaluating the OR over every row.
+        if ordering.startswith('-'):
+            return queryset.filter(**{f'{field}__lte': value}).filter(
+                Q(**{f'{field}__lt': value}) | Q(id__lt=pk))
+        return queryset.filter(**{f'{field}__gte': value}).filter(
+            Q(**{f'{field}__gt': value}) | Q(id__gt=pk))
+
+    def page_queryset(self, queryset, request, view=None):
+        '''
+        Returns the query fetching the requested page plus one row, which
+        tells whether there is a next page. Used by paginate_queryset and
+        apaginate_queryset
+        '''
+        self.request = request
+        self.ordering = self.get_ordering(request, view)
+        self.limit = self.get_page_size(request)
+
+        field = self.ordering.lstrip('-')
+        if field == 'id':
+            queryset = queryset.order_by(self.ordering)
+        else:
+            direction = '-' if self.ordering.startswith('-') else ''
+            queryset = queryset.order_by(self.ordering, f'{direction}id')
+
+        position = self.decode_cursor(request, self.ordering, queryset.model)
+        if position is not None:
+            queryset = self.apply_position(queryset, self.ordering, position)
+        return queryset[:self.limit + 1]
+
+    def finish_page(self, page, columns=None):
+        '''
+        Trims the extra row and remembers the position of the last one. With
+        `columns` the page is made of values_list() rows of those columns
+        '''
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            last = page[-1]
+            field = self.ordering.lstrip('-')
+            if columns is None:
+                self.next_cursor = self.encode_cursor(self.ordering, getattr(last, field), last.pk)
+            else:
+                self.next_cursor = self.encode_cursor(self.ordering, last[columns.index(field)], last[columns.index('id')])
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.finish_page([obj async for obj in self.page_queryset(queryset, request, view)])
+
+    def page_columns(self, columns):
+        '''
+        `columns` followed by `id` and the ordering field when they are not
+        among them, as the cursor is made of both
+        '''
+        keys = dict.fromkeys(['id', self.ordering.lstrip('-')])
+        return list(columns) + [column for column in keys if column not in columns]
+
+    def paginate_values(self, queryset, columns, request, view=None):
+        '''
+        paginate_queryset returning values_list() rows of `columns`. The
+        rows may end with the extra columns of page_columns()
+        '''
+        queryset = self.page_queryset(queryset, request, view)
+        columns = self.page_columns(columns)
+        return self.finish_page(list(queryset.values_list(*columns)), columns)
+
+    async def apaginate_values(self, queryset, columns, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        columns = self.page_columns(columns)
+        return self.finish_page([row async for row in queryset.values_list(*columns)], columns)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link is not None:
+            headers['Link'] = f'<{next_link}>; rel="next"'
+        return Response(data, headers=headers)
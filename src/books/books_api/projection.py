@@ -0,0 +1,27 @@
+from rest_framework.renderers import JSONRenderer
+
+from .renderers import FastJSONRenderer
+
+
+class ValuesListMixin:
+    '''
+    Serves a list view's JSON from values_list() rows (see
+    ValuesSerializerMixin) and renders it with FastJSONRenderer instead of
+    JSONRenderer. The bytes sent are the same; building them skips the
+    model instances, the serializer fields and the stdlib encoder.
+    '''
+    json_renderer_class = FastJSONRenderer
+
+    def get_renderers(self):
+        return [
+            self.json_renderer_class() if type(renderer) is JSONRenderer else renderer
+            for renderer in super().get_renderers()
+        ]
+
+    def list_values(self, queryset, serializer_class, expand=(), fields=None):
+        rows = queryset.values_list(*serializer_class.value_columns(expand, fields))
+        return serializer_class.from_values(list(rows), expand, fields)
+
+    async def alist_values(self, queryset, serializer_class, expand=(), fields=None):
+        rows = queryset.values_list(*serializer_class.value_columns(expand, fields))
+        return await serializer_class.afrom_values([row async for row in rows], expand, fields)
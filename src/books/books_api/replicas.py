@@ -0,0 +1,173 @@
+"""
+Read replicas: GET requests read the catalog from a copy of the database.
+
+ReadReplicaRouter sends the catalog queries of a GET request (editorials,
+authors, books, their links, statistics and changes) to one of the
+databases in BOOKS_API_READ_DATABASES; everything else, writes, users,
+sessions and tokens included, goes to `default`, the primary. Outside of
+requests (commands, signals) every query goes to the primary.
+
+The replicas are plain SQLite files that `sync_replica` copies the primary
+into with the SQLite backup API, every BOOKS_API_REPLICA_SYNC_INTERVAL
+seconds with --watch. Each copy is a consistent state of the primary, taken
+when the copy started; that time is kept in BOOKS_API_REPLICA_STATE_DIR.
+Reads are never staler than BOOKS_API_REPLICA_MAX_LAG seconds: a replica
+whose last copy started before that is not used, and the request reads from
+the primary instead.
+
+A client that writes gets a cookie with the time of its write, and reads
+from the primary until a replica holds a copy started after it, so it
+always reads its own writes.
+"""
+
+import contextvars
+import math
+import os
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .middleware import SAFE_METHODS
+
+COOKIE = 'books_api_written'
+# By model_name; the others (tokens, users, sessions...) are never read
+# from a replica.
+REPLICATED_MODELS = {'editorial', 'author', 'book', 'author_books', 'catalogstat', 'change'}
+
+# The database the queries of the current request read from; None for the
+# primary.
+current = contextvars.ContextVar('books_api_read_database', default=None)
+
+
+def get_read_databases():
+    return getattr(settings, 'BOOKS_API_READ_DATABASES', [])
+
+
+def get_max_lag():
+    return getattr(settings, 'BOOKS_API_REPLICA_MAX_LAG', 10)
+
+
+def state_path(alias):
+    directory = getattr(settings, 'BOOKS_API_REPLICA_STATE_DIR', '/tmp/books_api_replicas')
+    return os.path.join(directory, f'{alias}.synced')
+
+
+def synced_at(alias):
+    '''
+    The time the last copy of the primary into `alias` started, None if it
+    was never synced
+    '''
+    try:
+        return os.stat(state_path(alias)).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def sync(alias):
+    '''
+    Copies the primary into the replica `alias` in one step, as of when it
+    starts. Readers of the replica are not blocked; they see the new copy
+    from their next transaction. Returns the time the copy started
+    '''
+    source, target = connections[DEFAULT_DB_ALIAS], connections[alias]
+    source.ensure_connection()
+    target.ensure_connection()
+    started = time.time()
+    source.connection.backup(target.connection)
+    path = state_path(alias)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        pass
+    os.utime(path, (started, started))
+    return started
+
+
+def choose_database(written=None, now=None):
+    '''
+    Returns one of the replicas synced after `written` (the time of the
+    client's last write) and within BOOKS_API_REPLICA_MAX_LAG seconds, or
+    None if there is none and the primary must be read
+    '''
+    now = time.time() if now is None else now
+    fresh = []
+    for alias in get_read_databases():
+        started = synced_at(alias)
+        if started is not None and now - started <= get_max_lag() and (written is None or started > written):
+            fresh.append(alias)
+    return random.choice(fresh) if fresh else None
+
+
+def get_written(request):
+    try:
+        return float(request.COOKIES[COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = current.get()
+        if alias is not None and model._meta.app_label == 'books_api' and model._meta.model_name in REPLICATED_MODELS:
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema with the data, from sync().
+        return db not in get_read_databases()
+
+
+class ReadReplicaMiddleware:
+    '''
+    Picks the database the catalog is read from for GET requests (see
+    choose_database()), and sets the cookie of the clients that wrote.
+    Goes before AtomicWritesMiddleware: the write has committed when the
+    cookie is set, so a copy started later holds it
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_read_databases():
+            return self.get_response(request)
+        if request.method in SAFE_METHODS:
+            token = current.set(choose_database(get_written(request)))
+            try:
+                return self.get_response(request)
+            finally:
+                current.reset(token)
+        return self.remember_write(self.get_response(request))
+
+    async def __acall__(self, request):
+        if not get_read_databases():
+            return await self.get_response(request)
+        if request.method in SAFE_METHODS:
+            token = current.set(choose_database(get_written(request)))
+            try:
+                return await self.get_response(request)
+            finally:
+                current.reset(token)
+        return self.remember_write(await self.get_response(request))
+
+    def remember_write(self, response):
+        if response.status_code < 400:
+            # After max_lag seconds no replica older than the write is used
+            # anyway.
+            response.set_cookie(COOKIE, f'{time.time():.6f}', max_age=math.ceil(get_max_lag()), httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,188 @@
+"""
+Response cache for the GET handlers.
+
+Cached entries are keyed on the request (user, URL, query parameters) and on
+the current generation of every tag the response depends on, e.g.
+`book:7`, `book-list` or `editorial:3:books`. Writes never delete entries,
+they bump the generation of the affected tags (see signals.py), which makes
+every key built from the old generation unreachable. Old entries simply
+expire.
+
+A generation is the time (time.time_ns()) of the bump that set it, which
+tells whether a read replica holds every write behind it: a response read
+from a replica is only stored when the copy started after the newest
+generation it was looked up with (see store()).
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import time
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from . import replicas
+
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Link', 'Vary')
+
+EXPAND_TAGS = {
+    'editorial': 'editorials',
+    'authors': 'authors',
+}
+
+# Set while the handlers run inside a transaction that may still roll back
+# (batch.py, group_commit.py): what they read may never be committed, so
+# they bypass the cache, and their writes are only invalidated on commit.
+uncommitted = contextvars.ContextVar('books_api_uncommitted', default=False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'BOOKS_API_CACHE_ALIAS', 'default')]
+
+
+def generation_key(tag):
+    return f'books_api:gen:{tag}'
+
+
+def get_generations(cache, tags):
+    keys = [generation_key(tag) for tag in tags]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            # Start unknown (or evicted) tags at an unpredictable value so a
+            # missing counter can never bring old entries back to life.
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump(tags):
+    if tags:
+        now = time.time_ns()
+        get_cache().set_many({generation_key(tag): now for tag in tags}, timeout=None)
+
+
+def invalidate(*tags):
+    '''
+    Bumps the generation of the given tags.
+
+    Inside a transaction the tags are bumped again once it commits, so that
+    a concurrent reader cannot cache the pre-commit state under the new
+    generation. All the tags of a transaction are bumped then by the same
+    hook, once each, however many writes (or group-committed requests) it
+    holds. With `uncommitted` set, that is the only bump: the transaction
+    does not read from the cache, and others cannot see its writes before.
+    '''
+    tags = set(tags)
+    connection = transaction.get_connection()
+    if not (uncommitted.get() and connection.in_atomic_block):
+        bump(tags)
+    if not connection.in_atomic_block:
+        return
+    hook = getattr(connection, 'books_api_bump', None)
+    # Gone if it ran, or if the savepoint it was registered in was rolled
+    # back.
+    if hook is None or all(entry[1] is not hook for entry in connection.run_on_commit):
+        hook = connection.books_api_bump = partial(bump, set())
+        transaction.on_commit(hook)
+    hook.args[0].update(tags)
+
+
+def get_request_tags(view, request, kwargs):
+    tags = [tag.format(**kwargs) for tag in view.cache_tags]
+    expand = request.query_params.get('expand', '')
+    for name in expand.split(','):
+        if name.strip() in EXPAND_TAGS:
+            tags.append(EXPAND_TAGS[name.strip()])
+    return tags
+
+
+def make_key(request, generations):
+    user = request.user.pk if request.user.is_authenticated else None
+    # The ETag depends on the negotiated media type (see ConditionalMixin).
+    media_type = getattr(getattr(request, 'accepted_renderer', None), 'media_type', None)
+    parts = repr((user, request.build_absolute_uri(), media_type, generations))
+    return 'books_api:response:' + hashlib.sha1(parts.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(view, request):
+    wants_stream = getattr(view, 'wants_stream', None)
+    return (getattr(settings, 'BOOKS_API_CACHE_ENABLED', True) and not uncommitted.get()
+            and not (wants_stream and wants_stream(request)))
+
+
+def lookup(view, request, kwargs):
+    '''
+    Returns (cache, key, generations, response); response is the cached
+    one, or a 304 if the request's validators match it, or None on a miss
+    '''
+    cache = get_cache()
+    generations = get_generations(cache, get_request_tags(view, request, kwargs))
+    key = make_key(request, generations)
+    entry = cache.get(key)
+    if entry is None:
+        return cache, key, generations, None
+    data, headers = entry
+    last_modified = parse_http_date_safe(headers.get('Last-Modified', ''))
+    not_modified = get_conditional_response(request, etag=headers.get('ETag'), last_modified=last_modified)
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return cache, key, generations, not_modified
+    return cache, key, generations, Response(data, headers=headers)
+
+
+def store(cache, key, generations, response):
+    alias = replicas.current.get()
+    if alias is not None:
+        # Read from a copy that may predate the write behind the newest
+        # generation: stored, it would be served stale until the next bump.
+        # A write commits before its last bump, so a copy started after
+        # that bump holds it.
+        synced = replicas.synced_at(alias)
+        if synced is None or synced * 1e9 < max(generations, default=0):
+            return
+    if isinstance(response, Response) and response.status_code == 200:
+        headers = {header: response[header] for header in CACHED_HEADERS if header in response}
+        timeout = getattr(settings, 'BOOKS_API_CACHE_TIMEOUT', 300)
+        cache.set(key, (response.data, headers), timeout=timeout)
+
+
+def cached_response(view_method):
+    '''
+    Serves a GET handler from the response cache.
+
+    The view declares the tags its responses depend on in `cache_tags`,
+    formatted with the URL kwargs. Only 200 responses are stored, and
+    streaming exports bypass the cache altogether. Works on both regular
+    and async handlers.
+    '''
+    if asyncio.iscoroutinefunction(view_method):
+        @wraps(view_method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            if not is_cacheable(self, request):
+                return await view_method(self, request, *args, **kwargs)
+            cache, key, generations, response = await sync_to_async(lookup)(self, request, kwargs)
+            if response is None:
+                response = await view_method(self, request, *args, **kwargs)
+                await sync_to_async(store)(cache, key, generations, response)
+            return response
+        return async_wrapper
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not is_cacheable(self, request):
+            return view_method(self, request, *args, **kwargs)
+        cache, key, generations, response = lookup(self, request, kwargs)
+        if response is None:
+            response = view_method(self, request, *args, **kwargs)
+            store(cache, key, generations, response)
+        return response
+    return wrapper
@@ -0,0 +1,149 @@
+"""
+Full-text search over Books with SQLite FTS5.
+
+`books_api_book_fts` holds, for every Book (rowid = book id), its title, its
+description and the names of its authors. It is kept in sync by triggers on
+the book, author and author-book tables, so every write path (views, bulk
+inserts, cascades, the admin, raw SQL) updates it in the same transaction.
+
+Django drops a table's triggers whenever a migration has to rebuild that
+table on SQLite, and renaming the rebuilt table fails while triggers on
+other tables refer to it; migrations that do so must call drop_triggers()
+first and create_triggers() again after.
+"""
+
+from .models import Book
+
+FTS_TABLE = 'books_api_book_fts'
+
+AUTHOR_NAMES_SQL = '''
+    (SELECT coalesce(group_concat(a.firstname || ' ' || a.lastname, ' '), '')
+       FROM books_api_author a
+       JOIN books_api_author_books ab ON ab.author_id = a.id
+      WHERE ab.book_id = {book_id})
+'''
+
+CREATE_TABLE_SQL = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(title, description, authors, tokenize = 'unicode61 remove_diacritics 2')
+'''
+
+TRIGGERS_SQL = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_book_fts_insert AFTER INSERT ON books_api_book BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, title, description, authors)
+        VALUES (new.id, new.title, new.description, '');
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_book_fts_update AFTER UPDATE OF title, description ON books_api_book BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, description = new.description WHERE rowid = new.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_book_fts_delete AFTER DELETE ON books_api_book BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_author_books_fts_insert AFTER INSERT ON books_api_author_books BEGIN
+        UPDATE {FTS_TABLE} SET authors = {AUTHOR_NAMES_SQL.format(book_id='new.book_id')} WHERE rowid = new.book_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_author_books_fts_delete AFTER DELETE ON books_api_author_books BEGIN
+        UPDATE {FTS_TABLE} SET authors = {AUTHOR_NAMES_SQL.format(book_id='old.book_id')} WHERE rowid = old.book_id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS books_api_author_fts_update AFTER UPDATE OF firstname, lastname ON books_api_author BEGIN
+        UPDATE {FTS_TABLE} SET authors = {AUTHOR_NAMES_SQL.format(book_id=f'{FTS_TABLE}.rowid')}
+         WHERE rowid IN (SELECT book_id FROM books_api_author_books WHERE author_id = new.id);
+    END
+    ''',
+]
+
+TRIGGER_NAMES = [
+    'books_api_book_fts_insert',
+    'books_api_book_fts_update',
+    'books_api_book_fts_delete',
+    'books_api_author_books_fts_insert',
+    'books_api_author_books_fts_delete',
+    'books_api_author_fts_update',
+]
+
+POPULATE_SQL = f'''
+    INSERT INTO {FTS_TABLE} (rowid, title, description, authors)
+    SELECT b.id, b.title, b.description, {AUTHOR_NAMES_SQL.format(book_id='b.id')}
+      FROM books_api_book b
+'''
+
+
+def create_triggers(cursor):
+    for sql in TRIGGERS_SQL:
+        cursor.execute(sql)
+
+
+def drop_triggers(cursor):
+    for name in TRIGGER_NAMES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def create_index(cursor):
+    '''
+    Creates the FTS table and its triggers, and indexes the existing Books
+    '''
+    cursor.execute(CREATE_TABLE_SQL)
+    create_triggers(cursor)
+    cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    cursor.execute(POPULATE_SQL)
+
+
+def drop_index(cursor):
+    drop_triggers(cursor)
+    cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def rebuild_index(cursor):
+    '''
+    Re-creates the triggers, reindexes every Book and merges the index
+    b-trees. Returns the number of indexed Books
+    '''
+    drop_index(cursor)
+    create_index(cursor)
+    cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+    return cursor.fetchone()[0]
+
+
+def build_match_query(text):
+    '''
+    Turns free text into an FTS5 query: every word must match, the last
+    one as a prefix. Words are quoted so FTS5 operators and punctuation in
+    the input cannot produce syntax errors
+    '''
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_books(text, limit):
+    '''
+    Returns the Books matching `text`, best first, with `rank` (lower is
+    better) and a highlighted `snippet` attribute
+    '''
+    match = build_match_query(text)
+    if match is None:
+        return []
+    sql = f'''
+        SELECT b.*, bm25({FTS_TABLE}, 10.0, 1.0, 5.0) AS rank,
+               snippet({FTS_TABLE}, -1, '<mark>', '</mark>', '…', 16) AS snippet
+          FROM {FTS_TABLE}
+          JOIN books_api_book b ON b.id = {FTS_TABLE}.rowid
+         WHERE {FTS_TABLE} MATCH %s
+         ORDER BY rank
+         LIMIT %s
+    '''
+    return list(Book.objects.raw(sql, [match, limit]))
@@ -1,19 +1,225 @@
-from rest_framework import serializers
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import Book, Editorial, Author
-        
-class AuthorSerializer(serializers.ModelSerializer):
+from .signals import post_bulk_create
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    '''
+    List serializer used when a JSON array is POSTed to a list endpoint.
+
+    Related objects referenced by the items are fetched with one in_bulk()
+    query per field before validation, and the validated items are inserted
+    with bulk_create() in batches of BOOKS_API_BULK_BATCH_SIZE, all inside
+    one transaction. post_bulk_create is sent once for the whole list.
+    '''
+
+    def to_internal_value(self, data):
+        self.related_cache = {}
+        if isinstance(data, list):
+            for name, field in self.child.fields.items():
+                if isinstance(field, BulkPrimaryKeyRelatedField):
+                    pks = {field.to_pk(item.get(name)) for item in data if isinstance(item, dict)}
+                    pks.discard(None)
+                    self.related_cache[name] = field.get_queryset().in_bulk(pks)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        batch_size = getattr(settings, 'BOOKS_API_BULK_BATCH_SIZE', 500)
+        with transaction.atomic():
+            instances = model.objects.bulk_create([model(**attrs) for attrs in validated_data], batch_size=batch_size)
+            post_bulk_create.send(sender=model, instances=instances)
+        return instances
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''
+    PrimaryKeyRelatedField that resolves against the objects preloaded by
+    BulkCreateListSerializer instead of issuing one query per item
+    '''
+
+    def to_pk(self, data):
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            return None
+
+    def to_internal_value(self, data):
+        cache = getattr(self.root, 'related_cache', {}).get(self.field_name)
+        pk = self.to_pk(data)
+        if cache is None or pk is None or isinstance(data, bool):
+            return super().to_internal_value(data)
+        if pk not in cache:
+            self.fail('does_not_exist', pk_value=data)
+        return cache[pk]
+
+
+def date_to_representation(value):
+    return value.isoformat() if value else None
+
+
+class ValuesSerializerMixin:
+    '''
+    Read-only fast path producing the serializer's representation straight
+    from QuerySet.values_list() rows, without model instances or a field
+    object per value.
+
+    The columns and conversions are derived once from the serializer's own
+    fields, which may only be integers, strings, dates (ISO 8601) and
+    primary key relations, so the result is exactly what .data would be.
+    The list views use it through ValuesListMixin.
+
+    Both paths can be limited to some of the fields: the `fields` argument
+    here, the `fields` context entry for instances (see SparseFieldsetMixin).
+    '''
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get('fields')
+        if selected is not None:
+            fields = {name: field for name, field in fields.items() if name in selected}
+        return fields
+
+    @classmethod
+    def get_value_fields(cls, fields=None):
+        '''
+        Returns [(name, column, conversion or None)] for the serializer
+        fields, or for the ones named in `fields`
+        '''
+        if '_value_fields' not in cls.__dict__:
+            value_fields = []
+            for name, field in cls().fields.items():
+                if isinstance(field, serializers.PrimaryKeyRelatedField):
+                    value_fields.append((name, f'{field.source}_id', None))
+                elif isinstance(field, serializers.DateField) and \
+                        (getattr(field, 'format', api_settings.DATE_FORMAT) or '').lower() == ISO_8601:
+                    value_fields.append((name, field.source, date_to_representation))
+                elif isinstance(field, serializers.CharField) or \
+                        (isinstance(field, serializers.IntegerField) and not getattr(field, 'coerce_to_string', False)):
+                    value_fields.append((name, field.source, None))
+                else:
+                    raise ImproperlyConfigured(f'{cls.__name__}.{name} has no values() representation.')
+            cls._value_fields = value_fields
+        if fields is None:
+            return cls._value_fields
+        return [value_field for value_field in cls._value_fields if value_field[0] in fields]
+
+    @classmethod
+    def value_columns(cls, expand=(), fields=None):
+        return [column for _, column, _ in cls.get_value_fields(fields)]
+
+    @classmethod
+    def from_values(cls, rows, expand=(), fields=None):
+        '''
+        Turns rows of value_columns() into the representation of each item.
+        Extra trailing columns are ignored
+        '''
+        value_fields = cls.get_value_fields(fields)
+        names = [name for name, _, _ in value_fields]
+        conversions = [(name, index, convert) for index, (name, _, convert) in enumerate(value_fields) if convert]
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, index, convert in conversions:
+                item[name] = convert(row[index])
+            data.append(item)
+        return data
+
+    @classmethod
+    async def afrom_values(cls, rows, expand=(), fields=None):
+        return cls.from_values(rows, expand, fields)
+
+
+class AuthorSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
-        fields = ["id", "firstname", "lastname", "birthdate"]
+        fields = ["id", "firstname", "lastname", "birthdate", "book_count"]
         extra_kwargs = {'books': {'required': False}}
+        list_serializer_class = BulkCreateListSerializer
         
-class EditorialSerializer(serializers.ModelSerializer):
+class EditorialSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Editorial
-        fields = ["id", "name"]
+        fields = ["id", "name", "book_count"]
+        list_serializer_class = BulkCreateListSerializer
+
+class BookSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
+    editorial = BulkPrimaryKeyRelatedField(queryset=Editorial.objects.all())
 
-class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = ["id", "title", "description", "pub_date", "editorial"]
-        
+        fields = ["id", "title", "description", "pub_date", "editorial", "author_count"]
+        list_serializer_class = BulkCreateListSerializer
+
+    def to_representation(self, instance):
+        '''
+        Embeds the editorial and/or the authors when asked to through the
+        `expand` context entry (see BookExpandMixin)
+        '''
+        data = super().to_representation(instance)
+        expand = self.context.get('expand', ())
+        if 'editorial' in expand and 'editorial' in self.fields:
+            data['editorial'] = EditorialSerializer(instance.editorial).data
+        if 'authors' in expand:
+            data['authors'] = AuthorSerializer(instance.author_set.all(), many=True).data
+        return data
+
+    @staticmethod
+    def embeds_editorial(expand, fields):
+        return 'editorial' in expand and (fields is None or 'editorial' in fields)
+
+    @classmethod
+    def value_columns(cls, expand=(), fields=None):
+        columns = super().value_columns(fields=fields)
+        if cls.embeds_editorial(expand, fields):
+            columns += [f'editorial__{column}' for column in EditorialSerializer.value_columns()]
+        return columns
+
+    @classmethod
+    def from_values(cls, rows, expand=(), fields=None):
+        '''
+        The editorial comes from the columns added by value_columns(); the
+        authors of all the rows are read with one more query
+        '''
+        data = super().from_values(rows, fields=fields)
+        if cls.embeds_editorial(expand, fields):
+            start = len(cls.get_value_fields(fields))
+            end = start + len(EditorialSerializer.value_columns())
+            editorials = EditorialSerializer.from_values([row[start:end] for row in rows])
+            for item, editorial in zip(data, editorials):
+                item['editorial'] = editorial
+        if 'authors' in expand:
+            authors = cls.authors_of([item['id'] for item in data])
+            for item in data:
+                item['authors'] = authors.get(item['id'], [])
+        return data
+
+    @classmethod
+    async def afrom_values(cls, rows, expand=(), fields=None):
+        if 'authors' in expand:
+            return await sync_to_async(cls.from_values)(rows, expand, fields)
+        return cls.from_values(rows, expand, fields)
+
+    @staticmethod
+    def authors_of(book_ids):
+        '''
+        Returns {book id: [author representation]}, authors ordered by id
+        '''
+        columns = ['book_id'] + [f'author__{column}' for column in AuthorSerializer.value_columns()]
+        rows = list(Author.books.through.objects.filter(book_id__in=book_ids).order_by('author_id').values_list(*columns))
+        authors = {}
+        for row, author in zip(rows, AuthorSerializer.from_values([row[1:] for row in rows])):
+            authors.setdefault(row[0], []).append(author)
+        return authors
+
+class BookSearchSerializer(BookSerializer):
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta(BookSerializer.Meta):
+        fields = BookSerializer.Meta.fields + ["rank", "snippet"]
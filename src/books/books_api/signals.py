@@ -0,0 +1,221 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import changes, counts, response_cache, snapshots, stats
+from .models import Author, Book, Editorial
+
+# Sent by BulkCreateListSerializer once a list of objects has been inserted
+# with bulk_create(), which does not send post_save.
+post_bulk_create = Signal()
+
+
+@receiver(m2m_changed, sender=Author.books.through)
+def touch_author_book_links(sender, instance, action, reverse, model, pk_set, **kwargs):
+    '''
+    Bumps `updated_at` on both sides of an Author-Book link change, so the
+    ETags of the related lists change with it, and invalidates the cached
+    lists on both sides.
+
+    QuerySet.update() is used on purpose: it does not send post_save.
+    '''
+    if action == 'pre_clear':
+        related = instance.author_set if reverse else instance.books
+        pk_set = set(related.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+    now = timezone.now()
+    type(instance).objects.filter(pk=instance.pk).update(updated_at=now)
+    model.objects.filter(pk__in=pk_set).update(updated_at=now)
+
+    if reverse:
+        book_ids, author_ids = [instance.pk], pk_set
+    else:
+        book_ids, author_ids = pk_set, [instance.pk]
+    response_cache.invalidate(
+        'authors',
+        *[f'author:{pk}:books' for pk in author_ids],
+        *[f'book:{pk}:authors' for pk in book_ids],
+    )
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_authors(sender, instance, **kwargs):
+    '''
+    The links of a Book are gone by the time post_delete is sent
+    '''
+    instance._author_ids = list(instance.author_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+def touch_books_of_deleted_author(sender, instance, **kwargs):
+    '''
+    Deleting an Author silently drops its links; bump its Books instead.
+    '''
+    instance._book_ids = list(instance.books.values_list('pk', flat=True))
+    instance.books.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book(sender, instance, **kwargs):
+    author_ids = getattr(instance, '_author_ids', None)
+    if author_ids is None:
+        author_ids = instance.author_set.values_list('pk', flat=True)
+    response_cache.invalidate(
+        'book-list',
+        f'book:{instance.pk}',
+        f'book:{instance.pk}:authors',
+        f'editorial:{instance.editorial_id}:books',
+        *[f'author:{pk}:books' for pk in author_ids],
+    )
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author(sender, instance, **kwargs):
+    book_ids = getattr(instance, '_book_ids', None)
+    if book_ids is None:
+        book_ids = instance.books.values_list('pk', flat=True)
+    response_cache.invalidate(
+        'author-list',
+        'authors',
+        f'author:{instance.pk}',
+        f'author:{instance.pk}:books',
+        *[f'book:{pk}:authors' for pk in book_ids],
+    )
+
+
+@receiver(post_save, sender=Editorial)
+@receiver(post_delete, sender=Editorial)
+def invalidate_editorial(sender, instance, **kwargs):
+    response_cache.invalidate(
+        'editorial-list',
+        'editorials',
+        f'editorial:{instance.pk}',
+        f'editorial:{instance.pk}:books',
+    )
+
+
+@receiver(post_bulk_create)
+def invalidate_bulk_created(sender, instances, **kwargs):
+    if sender is Book:
+        editorial_ids = {book.editorial_id for book in instances}
+        response_cache.invalidate('book-list', *[f'editorial:{pk}:books' for pk in editorial_ids])
+    elif sender is Author:
+        response_cache.invalidate('author-list')
+    elif sender is Editorial:
+        response_cache.invalidate('editorial-list')
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_state(sender, instance, **kwargs):
+    '''
+    Keeps what the stats need from the row about to be overwritten
+    '''
+    instance._old_state = None
+    if not instance._state.adding:
+        instance._old_state = Book.objects.filter(pk=instance.pk).values('editorial_id', 'pub_date').first()
+
+
+@receiver(post_save, sender=Book)
+def count_saved_book(sender, instance, created, **kwargs):
+    if created:
+        stats.books_created([instance])
+        counts.books_created([instance])
+    elif instance._old_state is not None:
+        stats.book_changed(instance._old_state, instance)
+        counts.book_changed(instance._old_state, instance)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, **kwargs):
+    stats.book_deleted(instance, instance._author_ids)
+    counts.book_deleted(instance, instance._author_ids)
+
+
+@receiver(post_delete, sender=Author)
+def count_deleted_author(sender, instance, **kwargs):
+    stats.author_deleted(instance, instance._book_ids)
+    counts.author_deleted(instance, instance._book_ids)
+
+
+@receiver(post_delete, sender=Editorial)
+def count_deleted_editorial(sender, instance, **kwargs):
+    stats.editorial_deleted(instance)
+
+
+@receiver(post_bulk_create, sender=Book)
+def count_bulk_created_books(sender, instances, **kwargs):
+    stats.books_created(instances)
+    counts.books_created(instances)
+
+
+@receiver(m2m_changed, sender=Author.books.through)
+def record_author_book_links(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Counts the links that changed and logs them. remove() reports every id
+    it was given, linked or not, so the links that really go away are
+    looked up beforehand
+    '''
+    if action in ('pre_remove', 'pre_clear'):
+        related = instance.author_set if reverse else instance.books
+        linked = related.values_list('pk', flat=True)
+        if action == 'pre_remove':
+            linked = linked.filter(pk__in=pk_set)
+        instance._unlinked_ids = list(linked)
+        return
+    if action == 'post_add':
+        ids, sign = pk_set, 1
+    elif action in ('post_remove', 'post_clear'):
+        ids, sign = instance._unlinked_ids, -1
+    else:
+        return
+    if reverse:
+        pairs = [(pk, instance.pk) for pk in ids]
+    else:
+        pairs = [(instance.pk, pk) for pk in ids]
+    stats.links_changed(pairs, sign)
+    counts.links_changed(pairs, sign)
+    changes.links_changed(pairs, sign)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Editorial)
+def log_saved(sender, instance, **kwargs):
+    changes.saved(sender, [instance.pk])
+
+
+@receiver(post_bulk_create)
+def log_bulk_created(sender, instances, **kwargs):
+    changes.saved(sender, [instance.pk for instance in instances])
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Editorial)
+def log_deleted(sender, instance, **kwargs):
+    '''
+    Deleting a Book or an Author drops its links without m2m_changed;
+    they are logged from the ids kept by the pre_delete receivers
+    '''
+    changes.deleted(sender, [instance.pk])
+    if sender is Book:
+        changes.links_changed([(pk, instance.pk) for pk in instance._author_ids], -1)
+    elif sender is Author:
+        changes.links_changed([(instance.pk, pk) for pk in instance._book_ids], -1)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Editorial)
+@receiver(post_delete, sender=Editorial)
+@receiver(post_bulk_create)
+@receiver(m2m_changed, sender=Author.books.through)
+def outdate_snapshot(sender, **kwargs):
+    snapshots.changed()
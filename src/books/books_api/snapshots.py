@@ -0,0 +1,346 @@
+"""
+Precompressed snapshots of the whole catalog.
+
+build() writes every editorial, author and book (with the ids of its
+authors) as one JSON document, catalog-<version>.json, together with a
+gzip copy and, when the brotli package is installed, a brotli one, all in a
+single pass over the database. The document also holds `changes_seq`, the
+latest change of /api/changes it includes, where mirrors carry on from.
+current.json names the latest version; it is replaced last, so readers never see a partial snapshot. Older versions
+are deleted, keeping BOOKS_API_SNAPSHOT_KEEP of them for the downloads
+still in progress.
+
+Writes do not rebuild anything themselves: once committed they only touch
+a marker file (mark_dirty()), and `build_snapshot --watch` rebuilds when no
+write came for BOOKS_API_SNAPSHOT_DEBOUNCE seconds, or at the latest
+BOOKS_API_SNAPSHOT_MAX_DELAY seconds after the first unsnapshotted one.
+
+SnapshotApiView authenticates the download and then, behind nginx, hands
+the file over with X-Accel-Redirect (BOOKS_API_SNAPSHOT_ACCEL_PREFIX), so
+sending it costs the worker nothing.
+"""
+
+import datetime
+import fcntl
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import changes
+from .models import Author, Book, Editorial
+from .sqlite import read_transaction
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MANIFEST = 'current.json'
+DIRTY = 'dirty'
+LOCK = '.lock'
+# Content-Encoding: file suffix, best first.
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+CHUNK_SIZE = 5000
+
+
+def get_directory():
+    return getattr(settings, 'BOOKS_API_SNAPSHOT_DIR', '/tmp/books_api_snapshots')
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def read_manifest(directory=None):
+    '''
+    Returns the description of the current snapshot, or None
+    '''
+    try:
+        with open(os.path.join(directory or get_directory(), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_atomically(directory, name, content):
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(content)
+    os.chmod(path, 0o644)
+    os.replace(path, os.path.join(directory, name))
+
+
+class SnapshotWriter:
+    '''
+    Writes the same bytes to a temporary file per encoding, compressing as
+    it goes, and moves them in place on commit()
+    '''
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.files = {}
+        for encoding, suffix in [('identity', '')] + list(ENCODINGS.items()):
+            if encoding == 'br' and brotli is None:
+                continue
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            self.files[encoding] = (path, os.fdopen(fd, 'wb'), name + suffix)
+        # mtime=0 so the same catalog always compresses to the same bytes.
+        self.gzip = gzip.GzipFile(fileobj=self.files['gzip'][1], mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+        self.brotli = brotli.Compressor(quality=BROTLI_QUALITY) if brotli is not None else None
+
+    def write(self, data):
+        self.files['identity'][1].write(data)
+        self.gzip.write(data)
+        if self.brotli is not None:
+            self.files['br'][1].write(self.brotli.process(data))
+
+    def commit(self):
+        '''
+        Returns {encoding: (file name, size)}
+        '''
+        self.gzip.close()
+        if self.brotli is not None:
+            self.files['br'][1].write(self.brotli.finish())
+        written = {}
+        for encoding, (path, f, name) in self.files.items():
+            f.close()
+            os.chmod(path, 0o644)
+            os.replace(path, os.path.join(self.directory, name))
+            written[encoding] = (name, os.path.getsize(os.path.join(self.directory, name)))
+        return written
+
+    def discard(self):
+        for path, f, _ in self.files.values():
+            f.close()
+            os.remove(path)
+
+
+def chunks(queryset, columns, size=CHUNK_SIZE):
+    '''
+    Yields the values_list() rows of `queryset` in id order, `size` at a
+    time, each chunk with its own keyset query
+    '''
+    last = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last).order_by('pk').values_list(*columns)[:size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def write_items(writer, items, first):
+    '''
+    Writes a chunk of a JSON array; `first` tells whether it starts it
+    '''
+    if items:
+        writer.write((b'' if first else b',') + dumps(items)[1:-1])
+
+
+def write_catalog(writer, version, generated_at, changes_seq):
+    '''
+    Returns the number of editorials, authors and books written
+    '''
+    # Imported here: the serializers import the signals, which import this.
+    from .serializers import AuthorSerializer, BookSerializer, EditorialSerializer
+
+    counts = {}
+    writer.write(b'{"version":' + dumps(version) + b',"generated_at":' + dumps(generated_at)
+                 + b',"changes_seq":' + dumps(changes_seq))
+    for name, model, serializer in (('editorials', Editorial, EditorialSerializer), ('authors', Author, AuthorSerializer)):
+        writer.write(b',"' + name.encode() + b'":[')
+        counts[name] = 0
+        for rows in chunks(model.objects.all(), serializer.value_columns()):
+            write_items(writer, serializer.from_values(rows), not counts[name])
+            counts[name] += len(rows)
+        writer.write(b']')
+    writer.write(b',"books":[')
+    counts['books'] = 0
+    Link = Author.books.through
+    for rows in chunks(Book.objects.all(), BookSerializer.value_columns()):
+        books = BookSerializer.from_values(rows)
+        authors = {}
+        links = Link.objects.filter(book_id__gte=rows[0][0], book_id__lte=rows[-1][0]).order_by('book_id', 'author_id')
+        for book_id, author_id in links.values_list('book_id', 'author_id'):
+            authors.setdefault(book_id, []).append(author_id)
+        for book in books:
+            book['authors'] = authors.get(book['id'], [])
+        write_items(writer, books, not counts['books'])
+        counts['books'] += len(rows)
+    writer.write(b']}')
+    return counts
+
+
+def build(directory=None):
+    '''
+    Writes a new snapshot and makes it the current one. Returns its
+    manifest, or None when another build is running
+    '''
+    directory = directory or get_directory()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        previous = read_manifest(directory)
+        version = previous['version'] + 1 if previous else 1
+        generated_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        started = time.perf_counter()
+        writer = SnapshotWriter(directory, f'catalog-{version}.json')
+        try:
+            with read_transaction():
+                changes_seq = changes.head()
+                counts = write_catalog(writer, version, generated_at, changes_seq)
+        except BaseException:
+            writer.discard()
+            raise
+        written = writer.commit()
+        manifest = {
+            'version': version,
+            'generated_at': generated_at,
+            'build_seconds': round(time.perf_counter() - started, 3),
+            'counts': counts,
+            'changes_seq': changes_seq,
+            'files': {encoding: name for encoding, (name, _) in written.items()},
+            'sizes': {encoding: size for encoding, (_, size) in written.items()},
+        }
+        write_atomically(directory, MANIFEST, json.dumps(manifest, indent=2).encode())
+        prune(directory, version)
+        return manifest
+
+
+def prune(directory, version):
+    keep = getattr(settings, 'BOOKS_API_SNAPSHOT_KEEP', 2)
+    for name in os.listdir(directory):
+        if not name.startswith('catalog-'):
+            continue
+        try:
+            old = int(name[len('catalog-'):].split('.')[0])
+        except ValueError:
+            continue
+        if old <= version - keep:
+            os.remove(os.path.join(directory, name))
+
+
+def mark_dirty(directory=None):
+    '''
+    Records that the catalog changed: the marker file holds the time of the
+    first change since the last build, its mtime is the time of the latest
+    '''
+    directory = directory or get_directory()
+    path = os.path.join(directory, DIRTY)
+    try:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            os.makedirs(directory, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        with os.fdopen(fd, 'w') as f:
+            f.write(repr(time.time()))
+    except OSError:
+        # Never fail a write over the snapshot; the next one marks it again.
+        pass
+
+
+def changed():
+    '''
+    Marks the snapshot outdated once the current transaction commits
+    '''
+    if getattr(settings, 'BOOKS_API_SNAPSHOT_ENABLED', True):
+        transaction.on_commit(mark_dirty)
+
+
+def pending(directory=None):
+    '''
+    Returns (first change, latest change) since the last build, or None
+    '''
+    path = os.path.join(directory or get_directory(), DIRTY)
+    try:
+        with open(path) as f:
+            first = float(f.read() or 0)
+        return first, os.stat(path).st_mtime
+    except (OSError, ValueError):
+        return None
+
+
+def is_due(times, now=None):
+    if times is None:
+        return False
+    now = time.time() if now is None else now
+    first, latest = times
+    return (now - latest >= getattr(settings, 'BOOKS_API_SNAPSHOT_DEBOUNCE', 10)
+            or now - first >= getattr(settings, 'BOOKS_API_SNAPSHOT_MAX_DELAY', 300))
+
+
+def build_if_due(directory=None, now=None):
+    '''
+    Builds a snapshot when there is none yet or the debounce delay of the
+    pending changes has passed. Returns the new manifest, or None
+    '''
+    directory = directory or get_directory()
+    if read_manifest(directory) is not None and not is_due(pending(directory), now):
+        return None
+    # Removed before building: changes committed meanwhile mark the new
+    # snapshot outdated again.
+    try:
+        os.remove(os.path.join(directory, DIRTY))
+    except FileNotFoundError:
+        pass
+    try:
+        manifest = build(directory)
+    except BaseException:
+        mark_dirty(directory)
+        raise
+    if manifest is None:
+        # Another build was running, maybe started before these changes.
+        mark_dirty(directory)
+    return manifest
+
+
+def accepted_encodings(header):
+    '''
+    The content codings an Accept-Encoding header allows, q=0 excluded
+    '''
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_file(manifest, accept_encoding):
+    '''
+    Returns (content coding or None, file name) of the best file of
+    `manifest` for the client
+    '''
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ENCODINGS:
+        if encoding in manifest['files'] and (encoding in accepted or '*' in accepted):
+            return encoding, manifest['files'][encoding]
+    return None, manifest['files']['identity']
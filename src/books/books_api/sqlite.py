@@ -0,0 +1,130 @@
+"""
+SQLite tuning for running several gunicorn workers on one database file.
+
+The profile named by BOOKS_API_SQLITE_PROFILE is applied to every new
+connection (connection_created). `production` switches to WAL, so readers
+never wait for writers, relaxes fsyncs to WAL commits (synchronous=NORMAL,
+still durable against application crashes), memory maps the file and lets
+writers queue for the lock (busy_timeout) instead of failing straight
+away. BOOKS_API_SQLITE_PRAGMAS overrides single pragmas.
+
+settings.py pairs the production profile with IMMEDIATE transactions, so a
+writer takes the lock when its transaction starts and never fails upgrading
+a read lock halfway through.
+"""
+
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,
+    },
+}
+
+
+def get_pragmas(profile=None):
+    profile = profile or getattr(settings, 'BOOKS_API_SQLITE_PROFILE', 'default')
+    pragmas = dict(PROFILES[profile])
+    pragmas.update(getattr(settings, 'BOOKS_API_SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = get_pragmas()
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
+
+
+def run_maintenance(cursor, checkpoint='PASSIVE'):
+    '''
+    Copies the WAL back into the database file without blocking anybody
+    (PASSIVE) and lets SQLite refresh the statistics it plans queries with
+    '''
+    cursor.execute(f'PRAGMA wal_checkpoint({checkpoint})')
+    cursor.execute('PRAGMA optimize')
+
+
+@contextmanager
+def read_transaction(connection=default_connection):
+    '''
+    Runs the block's queries against one state of the database. On SQLite
+    a deferred transaction is enough, and does not take the write lock that
+    transaction.atomic() takes with transaction_mode IMMEDIATE, so writers
+    carry on while long reads (exports, snapshots) run
+    '''
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=connection.alias):
+            yield
+        return
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('BEGIN DEFERRED')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('COMMIT')
+
+
+class MaintenanceMiddleware:
+    '''
+    Runs run_maintenance() at most once every
+    BOOKS_API_SQLITE_MAINTENANCE_INTERVAL seconds per worker, after a
+    response has been produced
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.last_run = time.monotonic()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.is_due():
+            self.maintain()
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.is_due():
+            await sync_to_async(self.maintain)()
+        return response
+
+    def is_due(self):
+        interval = getattr(settings, 'BOOKS_API_SQLITE_MAINTENANCE_INTERVAL', 300)
+        return interval and time.monotonic() - self.last_run >= interval
+
+    def maintain(self):
+        if default_connection.vendor != 'sqlite' or default_connection.in_atomic_block:
+            return
+        self.last_run = time.monotonic()
+        with default_connection.cursor() as cursor:
+            run_maintenance(cursor)
@@ -0,0 +1,216 @@
+"""
+Catalog statistics maintained incrementally.
+
+Every write to Books, Authors, Editorials and their links adjusts a handful
+of CatalogStat counters (see signals.py), so /api/stats never has to scan
+the catalog:
+
+* books_per_editorial: key = editorial id
+* books_per_year: key = publication year
+* books_per_author: key = author id
+* books_by_author_count: key = number of authors, value = number of books
+  having that many authors
+
+rebuild() recomputes everything from the tables; the `rebuild_stats`
+management command uses it to repair or verify the counters.
+"""
+
+import datetime
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+from .models import Author, Book, CatalogStat, Editorial
+
+BOOKS_PER_EDITORIAL = 'books_per_editorial'
+BOOKS_PER_YEAR = 'books_per_year'
+BOOKS_PER_AUTHOR = 'books_per_author'
+BOOKS_BY_AUTHOR_COUNT = 'books_by_author_count'
+
+UPSERT_SQL = '''
+    INSERT INTO books_api_catalogstat (name, "key", value) VALUES (%s, %s, %s)
+    ON CONFLICT (name, "key") DO UPDATE SET value = value + excluded.value
+'''
+
+
+def year_of(pub_date):
+    if isinstance(pub_date, str):
+        pub_date = datetime.date.fromisoformat(pub_date)
+    return pub_date.year
+
+
+def bump(name, deltas):
+    '''
+    Adds every {key: delta} in deltas to the `name` counters with one
+    upsert per key
+    '''
+    rows = [(name, key, delta) for key, delta in deltas.items() if delta]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(UPSERT_SQL, rows)
+
+
+def forget(name, key):
+    CatalogStat.objects.filter(name=name, key=key).delete()
+
+
+def author_counts(book_ids):
+    '''
+    Returns {book id: current number of authors} for the given Books
+    '''
+    through = Author.books.through
+    counts = dict.fromkeys(book_ids, 0)
+    rows = through.objects.filter(book_id__in=book_ids).values('book_id').annotate(n=Count('id'))
+    counts.update((row['book_id'], row['n']) for row in rows)
+    return counts
+
+
+def move_between_author_counts(book_deltas):
+    '''
+    Moves every Book in {book id: change in its number of authors} to its
+    new books_by_author_count bucket. Must run after the links changed
+    '''
+    buckets = Counter()
+    for book_id, count in author_counts(list(book_deltas)).items():
+        buckets[count - book_deltas[book_id]] -= 1
+        buckets[count] += 1
+    bump(BOOKS_BY_AUTHOR_COUNT, buckets)
+
+
+def books_created(books):
+    bump(BOOKS_PER_EDITORIAL, Counter(book.editorial_id for book in books))
+    bump(BOOKS_PER_YEAR, Counter(year_of(book.pub_date) for book in books))
+    bump(BOOKS_BY_AUTHOR_COUNT, {0: len(books)})
+
+
+def book_changed(old, book):
+    '''
+    `old` holds the editorial_id and pub_date the Book had before saving
+    '''
+    if old['editorial_id'] != book.editorial_id:
+        bump(BOOKS_PER_EDITORIAL, {old['editorial_id']: -1, book.editorial_id: 1})
+    if year_of(old['pub_date']) != year_of(book.pub_date):
+        bump(BOOKS_PER_YEAR, {year_of(old['pub_date']): -1, year_of(book.pub_date): 1})
+
+
+def book_deleted(book, author_ids):
+    bump(BOOKS_PER_EDITORIAL, {book.editorial_id: -1})
+    bump(BOOKS_PER_YEAR, {year_of(book.pub_date): -1})
+    bump(BOOKS_PER_AUTHOR, {pk: -1 for pk in author_ids})
+    bump(BOOKS_BY_AUTHOR_COUNT, {len(author_ids): -1})
+
+
+def links_changed(pairs, sign):
+    '''
+    Accounts for (author id, book id) links that were just added (sign=1)
+    or removed (sign=-1)
+    '''
+    if not pairs:
+        return
+    per_author = Counter(author_id for author_id, _ in pairs)
+    per_book = Counter(book_id for _, book_id in pairs)
+    bump(BOOKS_PER_AUTHOR, {pk: sign * n for pk, n in per_author.items()})
+    move_between_author_counts({pk: sign * n for pk, n in per_book.items()})
+
+
+def author_deleted(author, book_ids):
+    forget(BOOKS_PER_AUTHOR, author.pk)
+    move_between_author_counts({pk: -1 for pk in book_ids})
+
+
+def editorial_deleted(editorial):
+    forget(BOOKS_PER_EDITORIAL, editorial.pk)
+
+
+def compute():
+    '''
+    Computes every counter from scratch. Only the columns involved are read
+    '''
+    through = Author.books.through
+    stats = {
+        BOOKS_PER_EDITORIAL: {
+            row['editorial_id']: row['n']
+            for row in Book.objects.order_by().values('editorial_id').annotate(n=Count('id'))
+        },
+        BOOKS_PER_YEAR: {
+            row['year']: row['n']
+            for row in Book.objects.order_by().values(year=ExtractYear('pub_date')).annotate(n=Count('id'))
+        },
+        BOOKS_PER_AUTHOR: {
+            row['author_id']: row['n']
+            for row in through.objects.order_by().values('author_id').annotate(n=Count('id'))
+        },
+    }
+    links = Counter(through.objects.values_list('book_id', flat=True).iterator())
+    books = Book.objects.count()
+    by_author_count = Counter(links.values())
+    by_author_count[0] = books - len(links)
+    stats[BOOKS_BY_AUTHOR_COUNT] = dict(by_author_count)
+    return stats
+
+
+def stored():
+    stats = {name: {} for name in (BOOKS_PER_EDITORIAL, BOOKS_PER_YEAR, BOOKS_PER_AUTHOR, BOOKS_BY_AUTHOR_COUNT)}
+    for name, key, value in CatalogStat.objects.values_list('name', 'key', 'value').iterator():
+        stats.setdefault(name, {})[key] = value
+    return stats
+
+
+def differences():
+    '''
+    Returns [(name, key, stored value, expected value)] for every counter
+    that does not match the tables. Zero counters are the same as missing
+    ones
+    '''
+    expected, current = compute(), stored()
+    diffs = []
+    for name in sorted(set(expected) | set(current)):
+        want, have = expected.get(name, {}), current.get(name, {})
+        for key in sorted(set(want) | set(have)):
+            if want.get(key, 0) != have.get(key, 0):
+                diffs.append((name, key, have.get(key, 0), want.get(key, 0)))
+    return diffs
+
+
+def rebuild():
+    CatalogStat.objects.all().delete()
+    CatalogStat.objects.bulk_create(
+        CatalogStat(name=name, key=key, value=value)
+        for name, counters in compute().items()
+        for key, value in counters.items()
+        if value
+    )
+
+
+def summary(top=10):
+    '''
+    The /api/stats payload
+    '''
+    def counters(name):
+        return CatalogStat.objects.filter(name=name, value__gt=0)
+
+    per_editorial = list(counters(BOOKS_PER_EDITORIAL).order_by('-value', 'key'))
+    editorials = Editorial.objects.in_bulk([stat.key for stat in per_editorial])
+    top_authors = list(counters(BOOKS_PER_AUTHOR).order_by('-value', 'key')[:top])
+    authors = Author.objects.in_bulk([stat.key for stat in top_authors])
+    return {
+        'books_per_editorial': [
+            {'editorial': stat.key, 'name': editorials[stat.key].name, 'books': stat.value}
+            for stat in per_editorial if stat.key in editorials
+        ],
+        'books_per_year': [
+            {'year': stat.key, 'books': stat.value}
+            for stat in counters(BOOKS_PER_YEAR).order_by('key')
+        ],
+        'authors_per_book': [
+            {'authors': stat.key, 'books': stat.value}
+            for stat in counters(BOOKS_BY_AUTHOR_COUNT).order_by('key')
+        ],
+        'top_authors': [
+            {'author': stat.key, 'firstname': authors[stat.key].firstname,
+             'lastname': authors[stat.key].lastname, 'books': stat.value}
+            for stat in top_authors if stat.key in authors
+        ],
+    }
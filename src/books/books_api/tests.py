@@ -1,10 +1,95 @@
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase, APIClient, APIRequestFactory
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient, APIRequestFactory
 from .models import *
+from . import changes, counts, group_commit, metrics, renderers, replicas, response_cache, snapshots, sqlite, stats, tokens
+from .middleware import AtomicWritesMiddleware
+from .urls import build_urlpatterns
+from .renderers import FastJSONRenderer
+from .expansion import BookExpandMixin
+from .serializers import AuthorSerializer, BookSerializer, EditorialSerializer
+from rest_framework.renderers import JSONRenderer
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.http import HttpResponse
+from django.urls import include, path
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+import base64
+import datetime
+import gzip
+import importlib
+import itertools
 import json
+import os
+import re
+import runpy
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from unittest import addModuleCleanup, mock, skipUnless
 
-class BookTests(APITestCase):
+
+def setUpModule():
+    # A server running on this machine adds up every file in its metrics
+    # directory: neither the requests of the tests nor the servers they
+    # start (see BenchmarkCommandTests) must write there.
+    directory = tempfile.mkdtemp()
+    addModuleCleanup(shutil.rmtree, directory, ignore_errors=True)
+    environ = mock.patch.dict(
+        os.environ, BOOKS_API_METRICS_DIR=directory, BOOKS_API_CACHE_DIR=os.path.join(directory, 'cache'),
+    )
+    environ.start()
+    addModuleCleanup(environ.stop)
+    # Nor share its response cache (see EmptyCacheMixin).
+    overrides = override_settings(
+        BOOKS_API_METRICS_DIR=directory,
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'books_api_tests'}},
+    )
+    overrides.enable()
+    addModuleCleanup(overrides.disable)
+    # Or the samples left would be flushed at exit, to the default one.
+    addModuleCleanup(metrics.registry.clear)
+
+
+class EmptyCacheMixin:
+    '''
+    Runs every test with an empty response cache. Ids are reused once a
+    test is rolled back, and the invalidations of a write only run on
+    commit, which a TestCase never does: what an earlier test cached would
+    be served for the rows of the next one
+    '''
+
+    def run(self, result=None):
+        response_cache.get_cache().clear()
+        return super().run(result)
+
+
+def temporary_directory(test):
+    '''
+    Returns a new temporary directory, removed when `test` is over
+    '''
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
+def next_link(response):
+    '''
+    Returns the rel="next" URL from the response Link header, if any
+    '''
+    match = re.search(r'<([^>]*)>; rel="next"', response.get('Link', ''))
+    return match.group(1) if match else None
+
+class BookTests(EmptyCacheMixin, APITestCase):
 
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -116,7 +201,7 @@ class BookTests(APITestCase):
         self.client.logout()
                 
         
-class EditorialTests(APITestCase):
+class EditorialTests(EmptyCacheMixin, APITestCase):
 
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -187,7 +272,7 @@ class EditorialTests(APITestCase):
         self.assertEqual(Editorial.objects.get().name, 'Editorial Testing 2')
         self.client.logout()
         
-class AuthorTests(APITestCase):
+class AuthorTests(EmptyCacheMixin, APITestCase):
 
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -261,7 +346,7 @@ class AuthorTests(APITestCase):
         self.client.logout()
         
 
-class AuthorBookTests(APITestCase):
+class AuthorBookTests(EmptyCacheMixin, APITestCase):
 
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -356,7 +441,7 @@ class AuthorBookTests(APITestCase):
      
 
 
-class EditorialBookTests(APITestCase):
+class EditorialBookTests(EmptyCacheMixin, APITestCase):
 
     def setUp(self):
         self.factory = APIRequestFactory()
@@ -382,3 +467,2083 @@ class EditorialBookTests(APITestCase):
         self.assertEqual(response.data[0]["title"], 'Book Testing 1')
         self.assertEqual(response.data[1]["title"], 'Book Testing 2')
         self.client.logout()
+
+
+class PaginationTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_list_book_pages(self):
+        """
+        Ensure we can walk the Book list page by page following the next cursor.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        for i in range(5):
+            Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=editorial)
+
+        self.client.login(username='testuser', password='testing')
+
+        url = reverse('book-list')
+        response = self.client.get(url, {"limit": 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([b["title"] for b in response.data], ['Book Testing 0', 'Book Testing 1'])
+
+        titles = []
+        next_url = next_link(response)
+        while next_url:
+            response = self.client.get(next_url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            titles += [b["title"] for b in response.data]
+            next_url = next_link(response)
+        self.assertEqual(titles, ['Book Testing 2', 'Book Testing 3', 'Book Testing 4'])
+        self.client.logout()
+
+    def test_list_book_ordering_ties(self):
+        """
+        Ensure books sharing the same pub_date are neither skipped nor repeated across pages.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        dates = ["2023-06-09", "2021-01-01", "2023-06-09", "2021-01-01", "2022-03-03"]
+        for i, pub_date in enumerate(dates):
+            Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date=pub_date, editorial=editorial)
+
+        self.client.login(username='testuser', password='testing')
+
+        for ordering in ("pub_date", "-pub_date"):
+            seen = []
+            response = self.client.get(reverse('book-list'), {"limit": 2, "ordering": ordering}, format='json')
+            while True:
+                seen += [(b["pub_date"], b["id"]) for b in response.data]
+                if next_link(response) is None:
+                    break
+                response = self.client.get(next_link(response), format='json')
+            expected = sorted(seen, reverse=ordering.startswith("-"))
+            self.assertEqual(seen, expected)
+            self.assertEqual(len(set(seen)), 5)
+        self.client.logout()
+
+    def test_list_author_invalid_ordering(self):
+        """
+        Ensure we cannot order the Author list by a field that is not allowed.
+        """
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('author-list'), {"ordering": "firstname"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+
+    def test_list_editorial_invalid_cursor(self):
+        """
+        Ensure a tampered cursor is rejected.
+        """
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('editorial-list'), {"cursor": "not-a-cursor"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.logout()
+
+    def test_list_book_tampered_cursor_value(self):
+        """
+        Ensure a well-formed cursor whose value does not fit the ordering field is rejected.
+        """
+        self.client.login(username='testuser', password='testing')
+        for value in ("garbage", None, ["2023-06-09"], {"a": 1}):
+            cursor = json.dumps({"o": "pub_date", "v": value, "id": 1})
+            encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+            response = self.client.get(reverse('book-list'), {"ordering": "pub_date", "cursor": encoded}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, value)
+        self.client.logout()
+
+
+class StreamingTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_stream_book_list(self):
+        """
+        Ensure ?stream=1 returns every Book as newline delimited JSON, ignoring the page size.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        for i in range(3):
+            Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=editorial)
+
+        self.client.login(username='testuser', password='testing')
+        with self.settings(BOOKS_API_PAGE_SIZE=1, BOOKS_API_STREAM_CHUNK_SIZE=2):
+            response = self.client.get(reverse('book-list'), {"stream": 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([r["title"] for r in rows], ['Book Testing 0', 'Book Testing 1', 'Book Testing 2'])
+        self.assertEqual(rows[0]["editorial"], editorial.id)
+        self.client.logout()
+
+    def test_stream_editorial_books_accept_header(self):
+        """
+        Ensure the Accept header selects the NDJSON mode on the books of an editorial.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=editorial)
+        Book.objects.create(title="Book Testing 2", description="Description 2", pub_date="2023-06-09", editorial=editorial)
+
+        self.client.login(username='testuser', password='testing')
+        url = reverse('editorial-book-list', kwargs={'editorial_id': editorial.id})
+        response = self.client.get(url, HTTP_ACCEPT='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["title"] for line in lines], ['Book Testing 1', 'Book Testing 2'])
+        self.client.logout()
+
+
+class ExpandTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def create_books(self, editorial, count):
+        for i in range(count):
+            book = Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=editorial)
+            author = Author.objects.create(firstname=f"Firstname {i}", lastname="lastname", birthdate="1981-12-02")
+            author.books.add(book)
+
+    def test_list_book_expanded(self):
+        """
+        Ensure the Book list embeds editorial and authors with a constant number of queries.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.create_books(editorial, 2)
+        self.client.login(username='testuser', password='testing')
+
+        url = reverse('book-list')
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url, {"expand": "editorial,authors"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["editorial"], {"id": editorial.id, "name": "Editorial Testing 1", "book_count": 2})
+        self.assertEqual(response.data[1]["authors"][0]["firstname"], 'Firstname 1')
+
+        self.create_books(editorial, 5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url, {"expand": "editorial,authors"}, format='json')
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.client.logout()
+
+    def test_detail_book_expanded(self):
+        """
+        Ensure a single Book can embed its authors.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.create_books(editorial, 1)
+        book = Book.objects.get()
+        self.client.login(username='testuser', password='testing')
+
+        url = reverse('book-detail', kwargs={'book_id': book.id})
+        response = self.client.get(url, {"expand": "authors"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["editorial"], editorial.id)
+        self.assertEqual(response.data["authors"][0]["firstname"], 'Firstname 0')
+        self.client.logout()
+
+    def test_expand_unknown_relation(self):
+        """
+        Ensure we cannot expand a relation that does not exist.
+        """
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('book-list'), {"expand": "publisher"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+
+
+class BulkCreateTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_bulk_create_books(self):
+        """
+        Ensure we can create many books in one request with a constant number of queries.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial1 = Editorial.objects.create(name="Editorial Testing 1")
+        editorial2 = Editorial.objects.create(name="Editorial Testing 2")
+        url = reverse('book-list')
+
+        def payload(count):
+            return [{"title": f"Book Testing {i}",
+                     "description": "Description",
+                     "pub_date": "2023-06-09",
+                     "editorial": (editorial1 if i % 2 else editorial2).id
+                     } for i in range(count)]
+
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.post(url, payload(2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.settings(BOOKS_API_BULK_BATCH_SIZE=100):
+            with CaptureQueriesContext(connection) as many:
+                response = self.client.post(url, payload(50), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 50)
+        self.assertTrue(all(item["id"] for item in response.data))
+        self.assertEqual(Book.objects.count(), 52)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.client.logout()
+
+    def test_bulk_create_errors_by_index(self):
+        """
+        Ensure nothing is created when some items are invalid, and errors carry their index.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('author-list')
+        data = [{"firstname": "Firstname 1", "lastname": "lastname", "birthdate": "1981-12-02"},
+                {"firstname": "Firstname 2", "lastname": "lastname", "birthdate": "not a date"},
+                {"firstname": "Firstname 3", "lastname": "lastname", "birthdate": "1981-12-02"},
+                {"firstname": "Firstname 4", "birthdate": "1981-12-02"}]
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([e["index"] for e in response.data], [1, 3])
+        self.assertIn("birthdate", response.data[0]["errors"])
+        self.assertIn("lastname", response.data[1]["errors"])
+        self.assertEqual(Author.objects.count(), 0)
+        self.client.logout()
+
+    def test_bulk_create_too_many(self):
+        """
+        Ensure we cannot create more items than BOOKS_API_MAX_BULK_SIZE at once.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('editorial-list')
+        data = [{"name": f"Editorial Testing {i}"} for i in range(3)]
+        with self.settings(BOOKS_API_MAX_BULK_SIZE=2):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Editorial.objects.count(), 0)
+        self.client.logout()
+
+
+class AuthorBookSetTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.books = [Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=self.editorial)
+                      for i in range(4)]
+        self.author = Author.objects.create(firstname="Firstname", lastname="lastname", birthdate="1981-12-02")
+
+    def test_add_and_remove_books_for_author(self):
+        """
+        Ensure we can link and unlink many books to an author in one request.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('author-book-list', kwargs={'author_id': self.author.id})
+
+        response = self.client.patch(url, [b.id for b in self.books[:3]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(self.author.books.values_list('id', flat=True)), {b.id for b in self.books[:3]})
+
+        response = self.client.delete(url, [self.books[0].id, self.books[1].id], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.author.books.values_list('id', flat=True)), [self.books[2].id])
+        self.client.logout()
+
+    def test_replace_authors_for_book(self):
+        """
+        Ensure PUT replaces the whole set of authors of a book.
+        """
+        other = Author.objects.create(firstname="Other", lastname="lastname", birthdate="1981-12-02")
+        self.author.books.add(self.books[0])
+        self.client.login(username='testuser', password='testing')
+
+        url = reverse('book-author-list', kwargs={'book_id': self.books[0].id})
+        response = self.client.put(url, [other.id], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.books[0].author_set.all()), [other])
+        self.client.logout()
+
+    def test_add_non_existent_books_for_author(self):
+        """
+        Ensure nothing is linked when some of the given ids do not exist.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('author-book-list', kwargs={'author_id': self.author.id})
+        missing = self.books[-1].id + 1
+        response = self.client.patch(url, [self.books[0].id, missing], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(missing), response.data["ids"][0])
+        self.assertEqual(self.author.books.count(), 0)
+
+        response = self.client.patch(url, {"ids": [self.books[0].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+
+
+class ConditionalRequestTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book = Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=self.editorial)
+
+    def test_detail_book_not_modified(self):
+        """
+        Ensure a Book answers If-None-Match with 304 until it changes.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-detail', kwargs={'book_id': self.book.id})
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        self.client.put(url, {"title": "Book Testing 2"}, format='json')
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.client.logout()
+
+    def test_list_not_modified(self):
+        """
+        Ensure list ETags change when items are added or linked.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-list')
+        etag = self.client.get(url, format='json')['ETag']
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Book.objects.create(title="Book Testing 2", description="Description 2", pub_date="2023-06-09", editorial=self.editorial)
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        author = Author.objects.create(firstname="Firstname", lastname="lastname", birthdate="1981-12-02")
+        etag = self.client.get(url, {"expand": "authors"}, format='json')['ETag']
+        author.books.add(self.book)
+        response = self.client.get(url, {"expand": "authors"}, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["authors"][0]["id"], author.id)
+        self.client.logout()
+
+    def test_list_pages_etags(self):
+        """
+        Ensure every page and every ordering of a list gets its own ETag.
+        """
+        Book.objects.create(title="Book Testing 2", description="Description 2", pub_date="2023-06-10", editorial=self.editorial)
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-list')
+        first = self.client.get(url, {"limit": 1}, format='json')
+        second = self.client.get(next_link(first), format='json')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        response = self.client.get(next_link(first), format='json', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["title"], "Book Testing 2")
+        response = self.client.get(url, {"limit": 1, "ordering": "-id"}, format='json', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.logout()
+
+    def test_list_stream_etag(self):
+        """
+        Ensure the JSON page and the NDJSON stream of a list have different ETags and vary on Accept.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-list')
+        page = self.client.get(url, HTTP_ACCEPT='application/json')
+        stream = self.client.get(url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertNotEqual(stream['ETag'], page['ETag'])
+        self.assertIn('Accept', page['Vary'])
+        self.assertIn('Accept', stream['Vary'])
+        response = self.client.get(url, HTTP_ACCEPT='application/x-ndjson', HTTP_IF_NONE_MATCH=page['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))["id"], self.book.id)
+        response = self.client.get(url, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=page['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('Accept', response['Vary'])
+        self.client.logout()
+
+    def test_change_book_if_match(self):
+        """
+        Ensure we cannot change a Book with a stale If-Match.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-detail', kwargs={'book_id': self.book.id})
+        etag = self.client.get(url, format='json')['ETag']
+
+        response = self.client.put(url, {"title": "Book Testing 2"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.put(url, {"title": "Book Testing 3"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Book.objects.get().title, 'Book Testing 2')
+        self.client.logout()
+
+
+class ResponseCacheTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book = Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=self.editorial)
+        self.author = Author.objects.create(firstname="Firstname", lastname="lastname", birthdate="1981-12-02")
+        self.author.books.add(self.book)
+
+    def get_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [q['sql'] for q in queries.captured_queries if 'books_api_' in q['sql']]
+
+    def test_detail_book_cached(self):
+        """
+        Ensure a repeated GET does not query the Book table.
+        """
+        self.client.login(username='testuser', password='testing')
+        url = reverse('book-detail', kwargs={'book_id': self.book.id})
+        self.get_queries(url)
+        response, queries = self.get_queries(url)
+        self.assertEqual(response.data["title"], 'Book Testing 1')
+        self.assertEqual(queries, [])
+        self.client.logout()
+
+    def test_change_book_invalidates_lists(self):
+        """
+        Ensure editing a Book evicts its detail, the Book list and the lists of its editorial and authors.
+        """
+        self.client.login(username='testuser', password='testing')
+        urls = [reverse('book-detail', kwargs={'book_id': self.book.id}),
+                reverse('book-list'),
+                reverse('editorial-book-list', kwargs={'editorial_id': self.editorial.id}),
+                reverse('author-book-list', kwargs={'author_id': self.author.id})]
+        for url in urls:
+            self.get_queries(url)
+
+        response = self.client.put(urls[0], {"title": "Book Testing 2"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response, _ = self.get_queries(urls[0])
+        self.assertEqual(response.data["title"], 'Book Testing 2')
+        for url in urls[1:]:
+            response, _ = self.get_queries(url)
+            self.assertEqual(response.data[0]["title"], 'Book Testing 2')
+        self.client.logout()
+
+    def test_unlink_author_invalidates_lists(self):
+        """
+        Ensure unlinking an author evicts the author's books and the book's authors.
+        """
+        self.client.login(username='testuser', password='testing')
+        books_url = reverse('author-book-list', kwargs={'author_id': self.author.id})
+        authors_url = reverse('book-author-list', kwargs={'book_id': self.book.id})
+        self.assertEqual(len(self.get_queries(books_url)[0].data), 1)
+        self.assertEqual(len(self.get_queries(authors_url)[0].data), 1)
+
+        url = reverse('author-book-detail', kwargs={'author_id': self.author.id, 'book_id': self.book.id})
+        self.client.delete(url, format='json')
+
+        self.assertEqual(len(self.get_queries(books_url)[0].data), 0)
+        self.assertEqual(len(self.get_queries(authors_url)[0].data), 0)
+        self.client.logout()
+
+
+class BookSearchTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book1 = Book.objects.create(title="The Dragon Keeper", description="A story about dragons", pub_date="2023-06-09", editorial=editorial)
+        self.book2 = Book.objects.create(title="Gardening", description="Even a dragon needs a garden", pub_date="2023-06-09", editorial=editorial)
+        self.author = Author.objects.create(firstname="Ursula", lastname="Leguin", birthdate="1929-10-21")
+        self.author.books.add(self.book2)
+
+    def search(self, q):
+        response = self.client.get(reverse('book-search'), {"q": q}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_books(self):
+        """
+        Ensure search ranks title matches first and returns snippets.
+        """
+        self.client.login(username='testuser', password='testing')
+        results = self.search("dragon")
+        self.assertEqual([r["id"] for r in results], [self.book1.id, self.book2.id])
+        self.assertIn("<mark>", results[0]["snippet"])
+        self.assertEqual(self.search("garden leguin")[0]["id"], self.book2.id)
+        self.assertEqual(self.search('"unbalanced ( AND'), [])
+        self.client.logout()
+
+    def test_search_follows_writes(self):
+        """
+        Ensure the index follows Book and Author changes.
+        """
+        self.client.login(username='testuser', password='testing')
+        self.author.firstname = "Margaret"
+        self.author.save()
+        self.assertEqual([r["id"] for r in self.search("margaret")], [self.book2.id])
+
+        self.author.books.add(self.book1)
+        self.assertEqual(len(self.search("margaret")), 2)
+
+        self.book1.delete()
+        self.assertEqual(len(self.search("margaret")), 1)
+        self.client.logout()
+
+    def test_rebuild_search_index(self):
+        """
+        Ensure the management command rebuilds the index from the tables.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM books_api_book_fts")
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn("Indexed 2 books", out.getvalue())
+        self.client.login(username='testuser', password='testing')
+        self.assertEqual(self.search("leguin")[0]["id"], self.book2.id)
+        self.client.logout()
+
+
+@override_settings(BOOKS_API_CACHE_ENABLED=False)
+class ListFilterTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial1 = Editorial.objects.create(name="Editorial Testing 1")
+        self.editorial2 = Editorial.objects.create(name="Editorial Testing 2")
+        self.author = Author.objects.create(firstname="Firstname", lastname="Adams", birthdate="1950-01-01")
+        Author.objects.create(firstname="Firstname", lastname="Abbott", birthdate="1960-01-01")
+        Author.objects.create(firstname="Firstname", lastname="Brown", birthdate="1970-01-01")
+        for i, (title, pub_date) in enumerate([("Alpha", "2020-01-01"), ("Alphabet", "2021-01-01"), ("Beta", "2022-01-01"),
+                                               ("Alps", "2023-01-01"), ("Gamma", "2021-06-01")]):
+            book = Book.objects.create(title=title, description="Description", pub_date=pub_date,
+                                       editorial=self.editorial1 if i % 2 else self.editorial2)
+            if i < 3:
+                self.author.books.add(book)
+
+    def list_titles(self, params):
+        response = self.client.get(reverse('book-list'), params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [b["title"] for b in response.data]
+
+    def test_filter_books(self):
+        """
+        Ensure we can filter the Book list by publication date, editorial, author and title prefix.
+        """
+        self.client.login(username='testuser', password='testing')
+        self.assertEqual(self.list_titles({"pub_date_after": "2021-01-01", "pub_date_before": "2022-01-01", "ordering": "pub_date"}),
+                         ["Alphabet", "Gamma", "Beta"])
+        self.assertEqual(self.list_titles({"editorial": self.editorial1.id}), ["Alphabet", "Alps"])
+        self.assertEqual(self.list_titles({"author": self.author.id, "ordering": "-title"}), ["Beta", "Alphabet", "Alpha"])
+        self.assertEqual(self.list_titles({"title_prefix": "Alph", "ordering": "title"}), ["Alpha", "Alphabet"])
+        response = self.client.get(reverse('book-list'), {"pub_date_after": "yesterday"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+
+    def test_filter_authors(self):
+        """
+        Ensure we can filter the Author list by lastname prefix and birthdate.
+        """
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('author-list'), {"lastname_prefix": "A", "ordering": "lastname"}, format='json')
+        self.assertEqual([a["lastname"] for a in response.data], ["Abbott", "Adams"])
+        response = self.client.get(reverse('author-list'), {"birthdate_after": "1955-01-01", "ordering": "-birthdate"}, format='json')
+        self.assertEqual([a["lastname"] for a in response.data], ["Brown", "Abbott"])
+        self.client.logout()
+
+    def query_plan(self, url, params, table):
+        '''
+        Returns the query plan of the page query issued when following the
+        next cursor of the given list
+        '''
+        response = self.client.get(url, dict(params, limit=1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, params)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(next_link(response), format='json')
+        sql = [q['sql'] for q in queries.captured_queries if f'FROM "{table}"' in q['sql'] and 'LIMIT' in q['sql']][0]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_index_range_scans(self, url, filters, orderings, table):
+        '''
+        Checks the plan of every combination of `filters` with every ordering:
+        index searches only, with neither a full SCAN nor a sort
+        '''
+        for n in range(len(filters) + 1):
+            for combination in itertools.combinations(filters, n):
+                params = {key: value for f in combination for key, value in f.items()}
+                for ordering in orderings:
+                    plan = self.query_plan(url, dict(params, ordering=ordering), table)
+                    scans = [step for step in plan if step.startswith(('SCAN', 'SEARCH'))]
+                    self.assertTrue(scans, plan)
+                    for step in scans:
+                        self.assertTrue(step.startswith('SEARCH') and ' USING ' in step, (params, ordering, plan))
+                    self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], (params, ordering, plan))
+
+    def test_book_list_query_plans(self):
+        """
+        Ensure every combination of Book filters runs as an index range scan in every supported ordering.
+        """
+        book = Book.objects.create(title="Alpine", description="Description", pub_date="2024-01-01", editorial=self.editorial2)
+        self.author.books.add(book)
+        self.client.login(username='testuser', password='testing')
+        filters = [{"pub_date_after": "2019-01-01", "pub_date_before": "2030-01-01"},
+                   {"editorial": self.editorial2.id}, {"author": self.author.id}, {"title_prefix": "A"}]
+        orderings = ["id", "-id", "pub_date", "-pub_date", "title", "-title", "author_count", "-author_count"]
+        self.assert_index_range_scans(reverse('book-list'), filters, orderings, 'books_api_book')
+        self.client.logout()
+
+    def test_author_list_query_plans(self):
+        """
+        Ensure every combination of Author filters runs as an index range scan in every supported ordering.
+        """
+        self.client.login(username='testuser', password='testing')
+        filters = [{"lastname_prefix": "A"}, {"birthdate_after": "1900-01-01", "birthdate_before": "2000-01-01"}]
+        orderings = ["id", "-id", "lastname", "-lastname", "birthdate", "-birthdate", "book_count", "-book_count"]
+        self.assert_index_range_scans(reverse('author-list'), filters, orderings, 'books_api_author')
+        self.client.logout()
+
+
+class StatsTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def assert_stats_up_to_date(self):
+        self.assertEqual(stats.differences(), [])
+
+    def test_stats_follow_writes(self):
+        """
+        Ensure the statistics stay exact through creations, updates, links and cascading deletes.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial1 = Editorial.objects.create(name="Editorial Testing 1")
+        editorial2 = Editorial.objects.create(name="Editorial Testing 2")
+        response = self.client.post(reverse('book-list'), {"title": "Book Testing 1", "description": "Description", "pub_date": "2020-01-01", "editorial": editorial1.id}, format='json')
+        book1 = response.data["id"]
+        response = self.client.post(reverse('book-list'), [
+            {"title": f"Book Testing {i}", "description": "Description", "pub_date": f"202{i}-01-01", "editorial": editorial2.id}
+            for i in range(2, 5)], format='json')
+        book2, book3, book4 = [b["id"] for b in response.data]
+        author1 = Author.objects.create(firstname="Firstname 1", lastname="lastname", birthdate="1981-12-02")
+        author2 = Author.objects.create(firstname="Firstname 2", lastname="lastname", birthdate="1981-12-02")
+        self.assert_stats_up_to_date()
+
+        self.client.put(reverse('book-detail', kwargs={'book_id': book1}), {"pub_date": "2024-06-01"}, format='json')
+        self.client.patch(reverse('author-book-list', kwargs={'author_id': author1.id}), [book1, book2, book3], format='json')
+        self.client.put(reverse('author-book-detail', kwargs={'author_id': author2.id, 'book_id': book1}), format='json')
+        self.assert_stats_up_to_date()
+
+        self.client.delete(reverse('author-book-list', kwargs={'author_id': author1.id}), [book2, book4], format='json')
+        self.client.put(reverse('book-author-list', kwargs={'book_id': book3}), [author2.id], format='json')
+        self.client.delete(reverse('author-book-detail', kwargs={'author_id': author2.id, 'book_id': book1}), format='json')
+        self.assert_stats_up_to_date()
+
+        response = self.client.get(reverse('stats'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["books_per_editorial"][0], {"editorial": editorial2.id, "name": "Editorial Testing 2", "books": 3})
+        self.assertEqual(response.data["books_per_year"][-1], {"year": 2024, "books": 2})
+        self.assertEqual(response.data["authors_per_book"], [{"authors": 0, "books": 2}, {"authors": 1, "books": 2}])
+        self.assertEqual([a["author"] for a in response.data["top_authors"]], [author1.id, author2.id])
+
+        self.client.delete(reverse('author-detail', kwargs={'author_id': author2.id}), format='json')
+        self.client.delete(reverse('book-detail', kwargs={'book_id': book1}), format='json')
+        self.client.delete(reverse('editorial-detail', kwargs={'editorial_id': editorial2.id}), format='json')
+        self.assert_stats_up_to_date()
+        response = self.client.get(reverse('stats'), format='json')
+        self.assertEqual(response.data["books_per_editorial"], [])
+        self.client.logout()
+
+    def test_rebuild_stats(self):
+        """
+        Ensure the management command detects and repairs out of date statistics.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=editorial)
+        CatalogStat.objects.filter(name='books_per_year').update(value=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stats', '--verify', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn("stored 5, expected 1", out.getvalue())
+        call_command('rebuild_stats', '--verify', stdout=StringIO())
+
+    def test_populate_stats_migration(self):
+        """
+        Ensure the migration filling in the statistics computes them on its own.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        books = [
+            Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date=f"202{i}-06-09", editorial=editorial)
+            for i in range(3)
+        ]
+        Author.objects.create(firstname="Firstname", lastname="Lastname", birthdate="1980-01-01").books.add(*books[:2])
+        CatalogStat.objects.all().delete()
+
+        migration = importlib.import_module('books_api.migrations.0007_populate_catalog_stats')
+        migration.populate_catalog_stats(django_apps, None)
+        self.assertEqual(stats.differences(), [])
+
+
+class CountsTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def assert_counts_up_to_date(self):
+        self.assertEqual(counts.differences(), [])
+
+    def test_counts_follow_writes(self):
+        """
+        Ensure the book and author counters stay exact through creations, moves, links and cascading deletes.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial1 = Editorial.objects.create(name="Editorial Testing 1")
+        editorial2 = Editorial.objects.create(name="Editorial Testing 2")
+        response = self.client.post(reverse('book-list'), {"title": "Book Testing 1", "description": "Description", "pub_date": "2020-01-01", "editorial": editorial1.id}, format='json')
+        book1 = response.data["id"]
+        response = self.client.post(reverse('book-list'), [
+            {"title": f"Book Testing {i}", "description": "Description", "pub_date": f"202{i}-01-01", "editorial": editorial2.id}
+            for i in range(2, 5)], format='json')
+        book2, book3, book4 = [b["id"] for b in response.data]
+        author1 = Author.objects.create(firstname="Firstname 1", lastname="lastname", birthdate="1981-12-02")
+        author2 = Author.objects.create(firstname="Firstname 2", lastname="lastname", birthdate="1981-12-02")
+        self.assert_counts_up_to_date()
+        url = reverse('editorial-detail', kwargs={'editorial_id': editorial1.id})
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.data["book_count"], 1)
+        etag = response['ETag']
+
+        moved = Book.objects.get(pk=book2)
+        moved.editorial = editorial1
+        moved.save()
+        self.client.patch(reverse('author-book-list', kwargs={'author_id': author1.id}), [book1, book2, book3], format='json')
+        self.client.put(reverse('author-book-detail', kwargs={'author_id': author2.id, 'book_id': book1}), format='json')
+        self.assert_counts_up_to_date()
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["book_count"], 2)
+        response = self.client.get(reverse('book-detail', kwargs={'book_id': book1}), format='json')
+        self.assertEqual(response.data["author_count"], 2)
+
+        self.client.delete(reverse('author-book-list', kwargs={'author_id': author1.id}), [book2, book4], format='json')
+        self.client.put(reverse('book-author-list', kwargs={'book_id': book3}), [author2.id], format='json')
+        self.client.delete(reverse('author-book-detail', kwargs={'author_id': author2.id, 'book_id': book1}), format='json')
+        self.assert_counts_up_to_date()
+        response = self.client.get(reverse('author-detail', kwargs={'author_id': author1.id}), format='json')
+        self.assertEqual(response.data["book_count"], 1)
+
+        self.client.delete(reverse('author-detail', kwargs={'author_id': author2.id}), format='json')
+        self.client.delete(reverse('book-detail', kwargs={'book_id': book1}), format='json')
+        self.client.delete(reverse('editorial-detail', kwargs={'editorial_id': editorial2.id}), format='json')
+        self.assert_counts_up_to_date()
+        self.assertEqual(Author.objects.get().book_count, 0)
+        self.client.logout()
+
+    def test_save_keeps_counters(self):
+        """
+        Ensure saving an instance loaded before its counter changed does not write the old count back.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        stale = Editorial.objects.get()
+        Book.objects.create(title="Book Testing 1", description="Description", pub_date="2020-01-01", editorial=editorial)
+        stale.name = "Editorial Testing 2"
+        stale.save()
+        editorial.refresh_from_db()
+        self.assertEqual((editorial.name, editorial.book_count), ("Editorial Testing 2", 1))
+
+    def test_order_by_count(self):
+        """
+        Ensure the lists can be ordered by their counters, across pages.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        books = [Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2020-01-01", editorial=editorial) for i in range(3)]
+        authors = [Author.objects.create(firstname=f"Firstname {i}", lastname="Lastname", birthdate="1981-12-02") for i in range(3)]
+        authors[1].books.add(*books)
+        authors[2].books.add(books[0])
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('author-list'), {"ordering": "-book_count", "limit": 2}, format='json')
+        self.assertEqual([(a["id"], a["book_count"]) for a in response.data], [(authors[1].id, 3), (authors[2].id, 1)])
+        response = self.client.get(response['Link'].split(';')[0].strip('<>'), format='json')
+        self.assertEqual([a["id"] for a in response.data], [authors[0].id])
+        response = self.client.get(reverse('book-list'), {"ordering": "-author_count", "fields": "author_count"}, format='json')
+        self.assertEqual([b["author_count"] for b in response.data], [2, 1, 1])
+        self.client.logout()
+
+    def test_rebuild_counts(self):
+        """
+        Ensure the management command detects and repairs out of date counters.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=editorial)
+        Editorial.objects.update(book_count=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counts', '--verify', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_counts', stdout=out)
+        self.assertIn(f"editorial.book_count[{editorial.id}]: stored 5, expected 1", out.getvalue())
+        call_command('rebuild_counts', '--verify', stdout=StringIO())
+
+        response_cache.get_cache().set('books_api:test', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_counts', '--clear-cache', stdout=StringIO())
+        self.assertIsNone(response_cache.get_cache().get('books_api:test'))
+
+    def test_populate_counts_migration(self):
+        """
+        Ensure the migration filling in the counters recounts them on its own.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        book = Book.objects.create(title="Book Testing 1", description="Description 1", pub_date="2023-06-09", editorial=editorial)
+        Author.objects.create(firstname="Firstname", lastname="Lastname", birthdate="1980-01-01").books.add(book)
+        Editorial.objects.update(book_count=0)
+        Author.objects.update(book_count=0)
+        Book.objects.update(author_count=7)
+
+        migration = importlib.import_module('books_api.migrations.0011_populate_counts')
+        migration.populate_counts(django_apps, None)
+        self.assertEqual(counts.differences(), [])
+
+
+class SQLiteProfileTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_production_pragmas(self):
+        """
+        Ensure the production profile and the pragma overrides are applied to connections.
+        """
+        db = sqlite3.connect(':memory:')
+        sqlite.apply_pragmas(db.cursor(), sqlite.get_pragmas('production'))
+        self.assertEqual(db.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+        self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(db.execute('PRAGMA temp_store').fetchone()[0], 2)
+        with override_settings(BOOKS_API_SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            sqlite.apply_pragmas(db.cursor(), sqlite.get_pragmas('production'))
+        self.assertEqual(db.execute('PRAGMA busy_timeout').fetchone()[0], 1234)
+        db.close()
+
+    def test_failed_write_rolls_back(self):
+        """
+        Ensure a write request answered with an error leaves nothing behind, and a successful one commits.
+        """
+        def view(request):
+            Editorial.objects.create(name="Editorial Testing 1")
+            return HttpResponse(status=int(request.GET['status']))
+
+        middleware = AtomicWritesMiddleware(view)
+        response = middleware(self.factory.post('/?status=400'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Editorial.objects.count(), 0)
+        middleware(self.factory.post('/?status=201'))
+        self.assertEqual(Editorial.objects.count(), 1)
+
+
+class AsyncUrlConf:
+    urlpatterns = [path('books/', include(build_urlpatterns(use_async=True)))]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrlConf)
+class AsyncViewTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_async_views_match_sync_views(self):
+        """
+        Ensure the async list and detail views answer exactly like the sync ones.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        book = Book.objects.create(title="Book Testing 1", description="Descripción ünicode", pub_date="2023-06-09", editorial=editorial)
+        Author.objects.create(firstname="Firstname 1", lastname="Lastname 1", birthdate="1980-06-09").books.add(book)
+        Book.objects.create(title="Book Testing 2", description="Description 2", pub_date="2022-06-09", editorial=editorial)
+
+        urls = [
+            reverse('book-list') + '?expand=editorial,authors&limit=1',
+            reverse('book-list') + '?ordering=pub_date&editorial=%d' % editorial.id,
+            reverse('author-list'),
+            reverse('editorial-list'),
+            reverse('book-detail', kwargs={'book_id': book.id}) + '?expand=authors',
+            reverse('editorial-detail', kwargs={'editorial_id': editorial.id}),
+            reverse('book-list') + '?fields=title&ordering=pub_date&limit=1&expand=editorial',
+            reverse('book-detail', kwargs={'book_id': book.id}) + '?exclude=description,editorial',
+        ]
+        for url in urls:
+            async_response = self.client.get(url)
+            with override_settings(ROOT_URLCONF='books.urls'):
+                sync_response = self.client.get(url)
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(async_response.content, sync_response.content)
+            self.assertEqual(async_response['ETag'], sync_response['ETag'])
+            self.assertEqual(async_response.get('Link'), sync_response.get('Link'))
+
+        response = self.client.get(reverse('book-list') + '?ordering=price')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('book-detail', kwargs={'book_id': 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.client.logout()
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_stream(self):
+        """
+        Ensure the async list views stream NDJSON a chunk at a time.
+        """
+        await self.async_client.alogin(username='testuser', password='testing')
+        editorial = await Editorial.objects.acreate(name="Editorial Testing 1")
+        books = [await Book.objects.acreate(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=editorial) for i in range(3)]
+        with self.settings(BOOKS_API_STREAM_CHUNK_SIZE=2):
+            response = await self.async_client.get(reverse('book-list'), headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)["id"] for line in content.splitlines()], [book.id for book in books])
+        await self.async_client.alogout()
+
+    def test_async_writes(self):
+        """
+        Ensure the async views create, update and delete items, keeping the derived data in step.
+        """
+        self.client.login(username='testuser', password='testing')
+        response = self.client.post(reverse('editorial-list'), {"name": "Editorial Testing 1"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        editorial = response.json()["id"]
+        data = {"title": "Book Testing 1", "description": "Description 1", "pub_date": "2023-06-09", "editorial": editorial}
+        response = self.client.post(reverse('book-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        book = response.json()["id"]
+        response = self.client.post(reverse('book-list'), dict(data, editorial=999), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('book-list'), [data, data], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        url = reverse('book-detail', kwargs={'book_id': book})
+        etag = self.client.get(url)['ETag']
+        response = self.client.put(url, {"pub_date": "2020-01-01"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["pub_date"], "2020-01-01")
+        response = self.client.put(url, {"title": "Stale"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Book.objects.get(pk=book).title, "Book Testing 1")
+
+        response = self.client.delete(reverse('editorial-detail', kwargs={'editorial_id': editorial}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Book.objects.count(), 0)
+        self.assertEqual(stats.differences(), [])
+        self.client.logout()
+
+
+class FastPathTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_fast_renderer_matches_json_renderer(self):
+        """
+        Ensure FastJSONRenderer produces the same bytes as DRF's JSONRenderer.
+        """
+        text = ''.join(chr(i) for i in range(128)) + 'ñ 書 😀 \u2028\u2029 \ufeff'
+        data = [
+            {"id": 1, "title": text, "editorial": {"id": 2, "name": "Ed\"itorial"}, "authors": []},
+            {"id": 2 ** 62, "title": "", "flag": True, "other": False, "missing": None, "nested": [[1], {"a": [-5]}]},
+        ]
+        # orjson is in requirements.txt; without it, the stock encoder.
+        self.assertIsNotNone(renderers.orjson)
+        for encoder in (renderers.orjson, None):
+            with self.subTest(encoder=encoder), mock.patch.object(renderers, 'orjson', encoder):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+                self.assertEqual(FastJSONRenderer().render({"detail": "Not found."}), JSONRenderer().render({"detail": "Not found."}))
+                self.assertEqual(FastJSONRenderer().render({1: "non string key"}), JSONRenderer().render({1: "non string key"}))
+                self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'), JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_fast_renderer_uses_orjson(self):
+        """
+        Ensure FastJSONRenderer encodes with orjson when it is installed, and with JSONRenderer when it is not.
+        """
+        data = [{"id": 1, "title": "Book Testing 1"}]
+        with mock.patch.object(renderers, 'orjson', mock.Mock(wraps=renderers.orjson, JSONEncodeError=renderers.orjson.JSONEncodeError)) as encoder:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        encoder.dumps.assert_called_once()
+        with mock.patch.object(renderers, 'orjson', None), mock.patch.object(JSONRenderer, 'render', return_value=b'[]') as fallback:
+            self.assertEqual(FastJSONRenderer().render(data), b'[]')
+        fallback.assert_called_once()
+
+    def test_values_match_serializers(self):
+        """
+        Ensure the values_list() representation is the same as the serializers' one.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1\u2028")
+        books = [Book.objects.create(title=f"Book Testing {i} ñ", description="Description", pub_date=f"20{10 + i}-06-09", editorial=editorial) for i in range(3)]
+        author1 = Author.objects.create(firstname="Firstname 1", lastname="Lastname 1", birthdate="1980-06-09")
+        author2 = Author.objects.create(firstname="Firstname 2", lastname="Lastname 2", birthdate="1990-06-09")
+        author2.books.add(books[0], books[1])
+        author1.books.add(books[0])
+
+        for expand in [set(), {'editorial'}, {'authors'}, {'editorial', 'authors'}]:
+            queryset = BookExpandMixin().expand_queryset(Book.objects.order_by('id'), expand)
+            expected = BookSerializer(queryset, many=True, context={'expand': expand}).data
+            rows = list(Book.objects.order_by('id').values_list(*BookSerializer.value_columns(expand)))
+            data = BookSerializer.from_values(rows, expand)
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(expected))
+        for serializer_class, model in [(AuthorSerializer, Author), (EditorialSerializer, Editorial)]:
+            expected = serializer_class(model.objects.order_by('id'), many=True).data
+            rows = list(model.objects.order_by('id').values_list(*serializer_class.value_columns()))
+            self.assertEqual(FastJSONRenderer().render(serializer_class.from_values(rows)), JSONRenderer().render(expected))
+
+    @override_settings(BOOKS_API_CACHE_ENABLED=False)
+    def test_list_queries_do_not_depend_on_rows(self):
+        """
+        Ensure an expanded book list costs the same number of queries whatever the number of books.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        author = Author.objects.create(firstname="Firstname 1", lastname="Lastname 1", birthdate="1980-06-09")
+        url = reverse('book-list') + '?expand=editorial,authors'
+        counts = []
+        for n in (1, 10):
+            for i in range(n):
+                author.books.add(Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2023-06-09", editorial=editorial))
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.client.logout()
+
+
+class SparseFieldsetTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+
+    def test_fields_and_exclude(self):
+        """
+        Ensure ?fields= and ?exclude= trim list and detail items, always keeping the id.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        book = Book.objects.create(title="Book Testing 1", description="Description", pub_date="2023-06-09", editorial=editorial)
+        Author.objects.create(firstname="Firstname 1", lastname="Lastname 1", birthdate="1980-06-09").books.add(book)
+
+        response = self.client.get(reverse('book-list') + '?fields=title,editorial&expand=editorial,authors')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{
+            "id": book.id, "title": "Book Testing 1",
+            "editorial": {"id": editorial.id, "name": "Editorial Testing 1", "book_count": 1},
+            "authors": [{"id": book.author_set.get().id, "firstname": "Firstname 1", "lastname": "Lastname 1", "birthdate": "1980-06-09", "book_count": 1}],
+        }])
+        response = self.client.get(reverse('book-list') + '?fields=title&ordering=-pub_date&expand=editorial')
+        self.assertEqual(response.json(), [{"id": book.id, "title": "Book Testing 1"}])
+        response = self.client.get(reverse('book-detail', kwargs={'book_id': book.id}) + '?exclude=description,id&expand=editorial')
+        self.assertEqual(response.json(), {
+            "id": book.id, "title": "Book Testing 1", "pub_date": "2023-06-09", "author_count": 1,
+            "editorial": {"id": editorial.id, "name": "Editorial Testing 1", "book_count": 1},
+        })
+        response = self.client.get(reverse('author-list') + '?fields=lastname&stream=1')
+        self.assertEqual(b''.join(response.streaming_content), b'{"id":%d,"lastname":"Lastname 1"}\n' % book.author_set.get().id)
+        response = self.client.get(reverse('editorial-detail', kwargs={'editorial_id': editorial.id}) + '?fields=id')
+        self.assertEqual(response.json(), {"id": editorial.id})
+        response = self.client.get(reverse('book-author-list', kwargs={'book_id': book.id}) + '?exclude=birthdate,firstname')
+        self.assertEqual(response.json(), [{"id": book.author_set.get().id, "lastname": "Lastname 1", "book_count": 1}])
+        self.client.logout()
+
+    def test_unknown_fields(self):
+        """
+        Ensure selecting or excluding an unknown field is a 400.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        response = self.client.get(reverse('book-list') + '?fields=title,price&exclude=isbn')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"fields": ["Unknown field 'price'."], "exclude": ["Unknown field 'isbn'."]})
+        response = self.client.get(reverse('editorial-detail', kwargs={'editorial_id': editorial.id}) + '?fields=books')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+
+    @override_settings(BOOKS_API_CACHE_ENABLED=False)
+    def test_columns_are_not_read(self):
+        """
+        Ensure the columns left out are not selected, and the ETag depends on the fieldset.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        book = Book.objects.create(title="Book Testing 1", description="Description", pub_date="2023-06-09", editorial=editorial)
+        for url in [reverse('book-list') + '?fields=title&limit=1', reverse('book-detail', kwargs={'book_id': book.id}) + '?fields=title']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT "books_api_book"."id"')]
+            self.assertEqual(len(selects), 1)
+            self.assertIn('"title"', selects[0])
+            self.assertNotIn('"description"', selects[0])
+            full = self.client.get(url.split('?')[0])
+            self.assertNotEqual(response['ETag'], full['ETag'])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.logout()
+
+
+class TokenTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        tokens.principals.clear()
+
+    def issue(self):
+        self.client.login(username='testuser', password='testing')
+        response = self.client.post(reverse('token'))
+        self.client.logout()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()['token']
+
+    @override_settings(BOOKS_API_CACHE_ENABLED=False)
+    def test_token_authentication(self):
+        """
+        Ensure a bearer token authenticates without touching the session or user tables once cached.
+        """
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        url = reverse('editorial-detail', kwargs={'editorial_id': editorial.id})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.issue())
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['name'], "Editorial Testing 1")
+        self.assertFalse([query for query in queries if 'auth_user' in query['sql'] or 'django_session' in query['sql']])
+        with override_settings(ROOT_URLCONF=AsyncUrlConf):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        for token in ['garbage', self.issue() + 'x']:
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(response.json(), {"detail": "Invalid token."})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.issue())
+        with override_settings(BOOKS_API_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get(url).json(), {"detail": "Token expired."})
+
+    def test_revocation(self):
+        """
+        Ensure revoking takes effect at once in the revoking worker and within the cache TTL elsewhere.
+        """
+        old_token = self.issue()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + old_token)
+        self.assertEqual(self.client.get(reverse('editorial-list')).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('token'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('editorial-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json(), {"detail": "Token revoked."})
+
+        new_token = self.issue()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + new_token)
+        self.assertEqual(self.client.get(reverse('editorial-list')).status_code, status.HTTP_200_OK)
+        # Another worker revokes: this one keeps its cached entry until the TTL.
+        TokenGeneration.objects.filter(user=self.user).update(generation=F('generation') + 1)
+        self.assertEqual(self.client.get(reverse('editorial-list')).status_code, status.HTTP_200_OK)
+        later = time.monotonic() + settings.BOOKS_API_TOKEN_CACHE_TTL + 1
+        with mock.patch('books_api.tokens.time.monotonic', return_value=later):
+            self.assertEqual(self.client.get(reverse('editorial-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_active = False
+        self.user.save()
+        tokens.principals.clear()
+        response = self.client.get(reverse('editorial-list'))
+        self.assertEqual(response.json(), {"detail": "User inactive or deleted."})
+
+
+class MetricsTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.directory = temporary_directory(self)
+        metrics.registry.clear()
+
+    def sample(self, text, line_start):
+        values = [line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(line_start)]
+        self.assertEqual(len(values), 1, line_start)
+        return float(values[0])
+
+    @override_settings(BOOKS_API_CACHE_ENABLED=False)
+    def test_request_metrics(self):
+        """
+        Ensure requests are recorded per URL name, with their queries, and timed in Server-Timing.
+        """
+        self.client.login(username='testuser', password='testing')
+        editorial = Editorial.objects.create(name="Editorial Testing 1")
+        url = reverse('editorial-detail', kwargs={'editorial_id': editorial.id})
+        with override_settings(BOOKS_API_METRICS_DIR=self.directory):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="%d queries", render;dur=[0-9.]+, total;dur=[0-9.]+$' % len(queries))
+            self.client.get(reverse('editorial-detail', kwargs={'editorial_id': 999}))
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE books_api_request_duration_seconds histogram', text)
+        self.assertEqual(self.sample(text, 'books_api_requests_total{method="GET",status="200",view="editorial-detail"}'), 1)
+        self.assertEqual(self.sample(text, 'books_api_requests_total{method="GET",status="404",view="editorial-detail"}'), 1)
+        self.assertEqual(self.sample(text, 'books_api_request_duration_seconds_count{method="GET",view="editorial-detail"}'), 2)
+        self.assertEqual(self.sample(text, 'books_api_request_duration_seconds_bucket{le="+Inf",method="GET",view="editorial-detail"}'), 2)
+        self.assertGreaterEqual(self.sample(text, 'books_api_db_queries_total{view="editorial-detail"}'), 2 * len(queries) - 1)
+        self.assertEqual(self.sample(text, 'books_api_response_size_bytes_count{view="editorial-detail"}'), 2)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_aggregates_workers(self):
+        """
+        Ensure /metrics adds up the samples flushed by the other workers.
+        """
+        other = metrics.Registry(pid=999999)
+        other.inc('books_api_requests_total', {'view': 'book-list', 'method': 'GET', 'status': '200'}, 5)
+        other.observe('books_api_request_duration_seconds', {'view': 'book-list', 'method': 'GET'}, 0.02, metrics.DURATION_BUCKETS)
+        other.flush(self.directory, force=True)
+        metrics.registry.inc('books_api_requests_total', {'view': 'book-list', 'method': 'GET', 'status': '200'}, 2)
+        text = metrics.exposition(metrics.collect(self.directory))
+        self.assertEqual(self.sample(text, 'books_api_requests_total{method="GET",status="200",view="book-list"}'), 7)
+        self.assertEqual(self.sample(text, 'books_api_request_duration_seconds_bucket{le="0.01",method="GET",view="book-list"}'), 0)
+        self.assertEqual(self.sample(text, 'books_api_request_duration_seconds_bucket{le="0.025",method="GET",view="book-list"}'), 1)
+        self.assertEqual(self.sample(text, 'books_api_request_duration_seconds_sum{method="GET",view="book-list"}'), 0.02)
+
+    def test_recycled_workers(self):
+        """
+        Ensure exited workers are folded into one file, and that a worker reusing the pid of an exited one does not overwrite its samples.
+        """
+        labels = {'view': 'book-list', 'method': 'GET', 'status': '200'}
+        line = 'books_api_requests_total{method="GET",status="200",view="book-list"}'
+
+        def total():
+            return self.sample(metrics.exposition(metrics.collect(self.directory)), line)
+
+        exited = metrics.Registry(pid=4242)
+        exited.inc('books_api_requests_total', labels, 5)
+        exited.flush(self.directory, force=True)
+        recycled = metrics.Registry(pid=4242)
+        recycled.inc('books_api_requests_total', labels, 2)
+        recycled.flush(self.directory, force=True)
+        self.assertEqual(total(), 7)
+
+        # Folded, but not deleted yet: still counted once.
+        with mock.patch('os.remove'):
+            metrics.fold(4242, self.directory)
+        self.assertEqual(total(), 7)
+        metrics.fold(4242, self.directory)
+        self.assertEqual(total(), 7)
+        self.assertEqual(os.listdir(self.directory), [metrics.EXITED])
+
+        for value in (1, 3):
+            worker = metrics.Registry(pid=4242)
+            worker.inc('books_api_requests_total', labels, value)
+            worker.flush(self.directory, force=True)
+            metrics.fold(4242, self.directory)
+        self.assertEqual(total(), 11)
+        self.assertEqual(os.listdir(self.directory), [metrics.EXITED])
+        metrics.fold(4243, self.directory)
+        self.assertEqual(total(), 11)
+
+
+class BenchmarkCommandTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.directory = temporary_directory(self)
+
+    def test_seed_catalog(self):
+        """
+        Ensure seed_catalog creates the requested catalog, the same for the same options, with statistics and search index.
+        """
+        out = StringIO()
+        call_command('seed_catalog', editorials=3, books=40, authors=10, batch_size=16, stdout=out)
+        self.assertEqual((Editorial.objects.count(), Book.objects.count(), Author.objects.count()), (3, 40, 10))
+        self.assertGreater(Author.books.through.objects.count(), 20)
+        self.assertEqual(stats.differences(), [])
+        first = list(Book.objects.order_by('id').values_list('title', 'pub_date'))
+        word = first[0][0].split()[0]
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('book-search') + '?q=' + word)
+        self.assertTrue(response.json())
+        self.client.logout()
+
+        call_command('seed_catalog', editorials=3, books=40, authors=10, batch_size=16, clear=True, stdout=out)
+        self.assertEqual(Book.objects.count(), 40)
+        self.assertEqual(list(Book.objects.order_by('id').values_list('title', 'pub_date')), first)
+        self.assertEqual(stats.differences(), [])
+
+    def test_benchmark_api(self):
+        """
+        Ensure benchmark_api measures every route in-process, writes JSON results and compares two runs.
+        """
+        call_command('seed_catalog', editorials=2, books=10, authors=5, stdout=StringIO())
+        snapshots.build(self.directory)
+        output = f'{self.directory}/run.json'
+        with override_settings(BOOKS_API_SNAPSHOT_DIR=self.directory):
+            call_command('benchmark_api', username='testuser', requests=2, warmup=0, writes=True, output=output, stdout=StringIO(), stderr=StringIO())
+        with open(output) as f:
+            run = json.load(f)
+        self.assertEqual(run['meta']['catalog'], {'editorials': 2, 'books': 10, 'authors': 5})
+        routes = {pattern.name for pattern in build_urlpatterns()}
+        self.assertEqual(routes, {label.split('?')[0] for label in run['results']})
+        for label, result in run['results'].items():
+            self.assertEqual(result['count'], 2)
+            self.assertTrue(all(200 <= int(code) < 300 for code in result['statuses']), label)
+
+        slower = json.loads(json.dumps(run))
+        slower['results']['stats']['p95_ms'] = run['results']['stats']['p95_ms'] * 2
+        with open(f'{self.directory}/slower.json', 'w') as f:
+            json.dump(slower, f)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', load=f'{self.directory}/slower.json', compare=output, fail_on_regression=True, stdout=out)
+        self.assertIn('regression', out.getvalue())
+
+
+class CatalogImportExportTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.directory = temporary_directory(self)
+        call_command('seed_catalog', editorials=3, books=40, authors=10, stdout=StringIO())
+
+    def catalog(self):
+        return (
+            list(Editorial.objects.order_by('id').values_list('id', 'name')),
+            list(Author.objects.order_by('id').values_list('id', 'firstname', 'lastname', 'birthdate')),
+            list(Book.objects.order_by('id').values_list('id', 'title', 'description', 'pub_date', 'editorial_id')),
+            list(Author.books.through.objects.order_by('author_id', 'book_id').values_list('author_id', 'book_id')),
+        )
+
+    def clear(self):
+        call_command('seed_catalog', editorials=0, books=0, authors=0, clear=True, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 0)
+
+    def test_round_trip(self):
+        """
+        Ensure a catalog exported as CSV or JSONL is imported back with the same ids, statistics and search index.
+        """
+        before = self.catalog()
+        for file_format in ('csv', 'jsonl'):
+            directory = f'{self.directory}/{file_format}'
+            call_command('export_catalog', directory, format=file_format, chunk_size=7, stdout=StringIO())
+            self.clear()
+            out = StringIO()
+            call_command('import_catalog', directory, batch_size=4, chunk_size=9, stdout=out)
+            self.assertIn('rows/s', out.getvalue())
+            self.assertEqual(self.catalog(), before)
+            self.assertEqual(stats.differences(), [])
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM books_api_book_fts')
+                self.assertEqual(cursor.fetchone()[0], 40)
+            # Importing again changes nothing.
+            call_command('import_catalog', directory, stdout=StringIO())
+            self.assertEqual(self.catalog(), before)
+
+    def test_resume(self):
+        """
+        Ensure an import stopped by an invalid row keeps its committed chunks and carries on from them with --resume.
+        """
+        before = self.catalog()
+        call_command('export_catalog', self.directory, stdout=StringIO())
+        path = f'{self.directory}/books.csv'
+        with open(path) as f:
+            lines = f.readlines()
+        broken = lines[:26] + [lines[26].rsplit(',', 1)[0] + ',999999\n'] + lines[27:]
+        with open(path, 'w') as f:
+            f.writelines(broken)
+        self.clear()
+
+        with self.assertRaisesMessage(CommandError, 'line 27: editorial_id 999999 does not exist'):
+            call_command('import_catalog', self.directory, chunk_size=10, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 20)
+        with open(f'{self.directory}/.import_checkpoint.json') as f:
+            self.assertEqual(json.load(f)['done'], {'editorials': 3, 'authors': 10, 'books': 20})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM books_api_book_fts')
+            self.assertEqual(cursor.fetchone()[0], 20)
+
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        out = StringIO()
+        call_command('import_catalog', self.directory, chunk_size=10, resume=True, stdout=out)
+        self.assertIn('editorials: 0 rows in', out.getvalue())
+        self.assertIn('books: 20 rows in', out.getvalue())
+        self.assertEqual(self.catalog(), before)
+        self.assertEqual(stats.differences(), [])
+        self.assertFalse(os.path.exists(f'{self.directory}/.import_checkpoint.json'))
+
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', self.directory, resume=True, stdout=StringIO())
+
+
+class SnapshotTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.directory = temporary_directory(self)
+        directory = override_settings(BOOKS_API_SNAPSHOT_DIR=self.directory, BOOKS_API_SNAPSHOT_ACCEL_PREFIX='')
+        directory.enable()
+        self.addCleanup(directory.disable)
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book = Book.objects.create(title="Book Testing 1", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+        self.author = Author.objects.create(firstname="Firstname", lastname="Lastname", birthdate="1980-01-01")
+        self.author.books.add(self.book)
+
+    def download(self, **headers):
+        self.client.login(username='testuser', password='testing')
+        response = self.client.get(reverse('snapshot'), **headers)
+        self.client.logout()
+        return response
+
+    def test_download(self):
+        """
+        Ensure the snapshot holds the whole catalog and is sent in the best encoding the client accepts.
+        """
+        self.assertEqual(self.download().status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        manifest = snapshots.build()
+        self.assertEqual(manifest['counts'], {'editorials': 1, 'authors': 1, 'books': 1})
+        self.assertEqual(self.client.get(reverse('snapshot')).status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.download()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        plain = b''.join(response.streaming_content)
+        catalog = json.loads(plain)
+        self.assertEqual(catalog['version'], 1)
+        self.assertEqual(catalog['editorials'], [{'id': self.editorial.id, 'name': "Editorial Testing 1", 'book_count': 1}])
+        self.assertEqual(catalog['authors'][0]['lastname'], "Lastname")
+        self.assertEqual(catalog['books'], [{
+            'id': self.book.id, 'title': "Book Testing 1", 'description': "Description", 'pub_date': "2020-01-01",
+            'editorial': self.editorial.id, 'author_count': 1, 'authors': [self.author.id],
+        }])
+
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip, deflate, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with override_settings(BOOKS_API_SNAPSHOT_ACCEL_PREFIX='/internal/snapshots/'):
+            response = self.download(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/snapshots/catalog-1.json.gz')
+        self.assertEqual(response.content, b'')
+
+    @skipUnless(snapshots.brotli, 'brotli is not installed')
+    def test_brotli(self):
+        """
+        Ensure clients accepting brotli get the brotli copy.
+        """
+        snapshots.build()
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(snapshots.brotli.decompress(b''.join(response.streaming_content)))['version'], 1)
+
+    def test_rebuild_after_writes(self):
+        """
+        Ensure committed writes mark the snapshot outdated, and that it is rebuilt once writes stop or have waited long enough.
+        """
+        snapshots.build()
+        self.assertIsNone(snapshots.pending())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='testuser', password='testing')
+            response = self.client.put(reverse('book-detail', kwargs={'book_id': self.book.id}), {'title': "Book Testing 2"})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first, latest = snapshots.pending()
+        self.assertIsNone(snapshots.build_if_due(now=latest + 1))
+
+        manifest = snapshots.build_if_due(now=latest + settings.BOOKS_API_SNAPSHOT_DEBOUNCE)
+        self.assertEqual(manifest['version'], 2)
+        self.assertIsNone(snapshots.pending())
+        with open(os.path.join(self.directory, manifest['files']['identity'])) as f:
+            self.assertEqual(json.load(f)['books'][0]['title'], "Book Testing 2")
+
+        # Constant writes do not postpone it forever.
+        snapshots.mark_dirty()
+        first, latest = snapshots.pending()
+        self.assertIsNone(snapshots.build_if_due(now=latest + 1))
+        self.assertEqual(snapshots.build_if_due(now=first + settings.BOOKS_API_SNAPSHOT_MAX_DELAY)['version'], 3)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.startswith('catalog-') and name.endswith('.json')),
+                         ['catalog-2.json', 'catalog-3.json'])
+
+
+class BatchTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.authors = [
+            Author.objects.create(firstname=f"Firstname {i}", lastname="Lastname", birthdate="1980-01-01") for i in range(3)
+        ]
+        self.client.login(username='testuser', password='testing')
+
+    def test_batch(self):
+        """
+        Ensure a batch creates a book, links its authors through back-references and updates its editorial in one request.
+        """
+        operations = [
+            {'method': 'POST', 'path': '/books/api/book', 'ref': 'book', 'body': {
+                'title': "Book Testing 1", 'description': "Description", 'pub_date': "2020-01-01", 'editorial': self.editorial.id,
+            }},
+            {'method': 'PATCH', 'path': '/books/api/book/{book.id}/authors', 'body': [author.id for author in self.authors]},
+            {'method': 'PUT', 'path': f'/books/api/editorial/{self.editorial.id}', 'body': {'name': "Editorial Testing 2"}},
+            {'method': 'GET', 'path': '/books/api/book/{book.id}?expand=authors&fields=id,title', 'ref': 'read'},
+            {'method': 'PUT', 'path': '/books/api/book/{book.id}', 'body': {'title': {'$ref': 'read.authors.0.firstname'}}},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('batch'), {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 200, 200, 200, 200])
+        book = Book.objects.get()
+        self.assertEqual(results[0]['body']['id'], book.id)
+        self.assertEqual(book.title, "Firstname 0")
+        self.assertEqual(sorted(book.author_set.values_list('id', flat=True)), [author.id for author in self.authors])
+        self.assertEqual(len(results[3]['body']['authors']), 3)
+        self.assertEqual(Editorial.objects.get().name, "Editorial Testing 2")
+        # One session lookup for the whole batch.
+        self.assertEqual(len([query for query in queries if 'django_session' in query['sql']]), 1)
+
+        with override_settings(ROOT_URLCONF=AsyncUrlConf):
+            response = self.client.post(reverse('batch'), [
+                {'method': 'PUT', 'path': f'/books/api/book/{book.id}', 'body': {'title': "Book Testing 2"}},
+                {'method': 'GET', 'path': f'/books/api/book/{book.id}'},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][1]['body']['title'], "Book Testing 2")
+
+    def test_rollback(self):
+        """
+        Ensure a failing operation rolls back the whole batch and gives its status to the response.
+        """
+        operations = [
+            {'method': 'POST', 'path': '/books/api/editorial', 'body': {'name': "Editorial Testing 2"}},
+            {'method': 'DELETE', 'path': f'/books/api/author/{self.authors[0].id}'},
+            {'method': 'PUT', 'path': '/books/api/book/999999', 'body': {'title': "Nope"}},
+            {'method': 'POST', 'path': '/books/api/editorial', 'body': {'name': "Never run"}},
+        ]
+        response = self.client.post(reverse('batch'), operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json()['failed'], 2)
+        self.assertEqual([result['status'] for result in response.json()['results']], [201, 200, 404])
+        self.assertEqual(Editorial.objects.count(), 1)
+        self.assertEqual(Author.objects.count(), 3)
+
+        response = self.client.post(reverse('batch'), [
+            {'method': 'POST', 'path': '/books/api/editorial', 'body': {'name': "Editorial Testing 2"}},
+            {'method': 'GET', 'path': '/books/api/editorial/{missing.id}'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['results'][1]['body'], {'res': "Unknown reference 'missing'."})
+        self.assertEqual(Editorial.objects.count(), 1)
+
+        for operations in ([], [{'method': 'GET', 'path': '/admin/'}], [{'method': 'POST', 'path': '/books/api/batch', 'body': []}],
+                           [{'method': 'TRACE', 'path': '/books/api/book'}]):
+            response = self.client.post(reverse('batch'), operations, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, operations)
+        self.client.logout()
+        response = self.client.post(reverse('batch'), [{'method': 'GET', 'path': '/books/api/book'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rollback_leaves_cache(self):
+        """
+        Ensure what a batch read before rolling back is not served from the cache afterwards.
+        """
+        url = f'/books/api/editorial/{self.editorial.id}'
+        response = self.client.post(reverse('batch'), [
+            {'method': 'PUT', 'path': url, 'body': {'name': "PHANTOM"}},
+            {'method': 'GET', 'path': url},
+            {'method': 'PUT', 'path': '/books/api/book/999999', 'body': {'title': "Nope"}},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json()['results'][1]['body']['name'], "PHANTOM")
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).json()['name'], "Editorial Testing 1")
+
+
+class ChangesTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.books = [
+            Book.objects.create(title=f"Book Testing {i}", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+            for i in range(2)
+        ]
+        self.author = Author.objects.create(firstname="Firstname", lastname="Lastname", birthdate="1980-01-01")
+        self.author.books.add(*self.books)
+        self.client.login(username='testuser', password='testing')
+
+    def get_changes(self, since=0, **params):
+        response = self.client.get(reverse('changes'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_changes(self):
+        """
+        Ensure the feed returns the latest change of each object, with its current data, after the given seq.
+        """
+        data = self.get_changes().json()
+        self.assertEqual([(change['type'], change['action']) for change in data['changes']], [
+            ('editorial', 'upsert'), ('author', 'upsert'), ('book', 'upsert'), ('book', 'upsert'),
+            ('author_book', 'link'), ('author_book', 'link'),
+        ])
+        self.assertFalse(data['more'])
+        self.assertEqual(data['changes'][2]['data']['title'], "Book Testing 0")
+        seq = data['seq']
+
+        for title in ("Book Testing 2", "Book Testing 3"):
+            response = self.client.put(reverse('book-detail', kwargs={'book_id': self.books[0].id}), {'title': title}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put(reverse('book-author-list', kwargs={'book_id': self.books[1].id}), [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = self.get_changes(seq).json()
+        self.assertEqual(data['changes'], [
+            {'seq': data['changes'][0]['seq'], 'type': 'book', 'action': 'upsert', 'id': self.books[0].id,
+             'data': self.client.get(reverse('book-detail', kwargs={'book_id': self.books[0].id})).json()},
+            {'seq': data['changes'][1]['seq'], 'type': 'author', 'action': 'upsert', 'id': self.author.id,
+             'data': self.client.get(reverse('author-detail', kwargs={'author_id': self.author.id})).json()},
+            {'seq': data['changes'][2]['seq'], 'type': 'book', 'action': 'upsert', 'id': self.books[1].id,
+             'data': self.client.get(reverse('book-detail', kwargs={'book_id': self.books[1].id})).json()},
+            {'seq': data['seq'], 'type': 'author_book', 'action': 'unlink', 'author': self.author.id, 'book': self.books[1].id},
+        ])
+        self.assertEqual(self.get_changes(data['seq']).json(), {'changes': [], 'seq': data['seq'], 'more': False})
+
+        self.assertEqual(self.client.get(reverse('changes'), {'since': -1}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('changes')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cascade(self):
+        """
+        Ensure deleting an editorial logs the deletion of its books and the unlinking of their authors.
+        """
+        seq = changes.head()
+        response = self.client.delete(reverse('editorial-detail', kwargs={'editorial_id': self.editorial.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entries = self.get_changes(seq).json()['changes']
+        self.assertCountEqual([(change['type'], change['action'], change.get('id')) for change in entries], [
+            ('editorial', 'delete', self.editorial.id), ('book', 'delete', self.books[0].id), ('book', 'delete', self.books[1].id),
+            ('author_book', 'unlink', None), ('author_book', 'unlink', None), ('author', 'upsert', self.author.id),
+        ])
+        self.assertNotIn('data', entries[0])
+
+    def test_counters(self):
+        """
+        Ensure the editorials, authors and books whose counters change are logged as upserted, with their new counts.
+        """
+        seq = changes.head()
+        book = Book.objects.create(title="Book Testing 2", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+        self.author.books.add(book)
+        entries = self.get_changes(seq).json()['changes']
+        self.assertEqual([(change['type'], change['action'], change.get('id')) for change in entries], [
+            ('editorial', 'upsert', self.editorial.id), ('author', 'upsert', self.author.id), ('book', 'upsert', book.id),
+            ('author_book', 'link', None),
+        ])
+        self.assertEqual(entries[0]['data']['book_count'], 3)
+        self.assertEqual(entries[1]['data']['book_count'], 3)
+        self.assertEqual(entries[2]['data']['author_count'], 1)
+
+    def test_rolled_back_batch(self):
+        """
+        Ensure the changes of a rolled back batch are not logged.
+        """
+        seq = changes.head()
+        response = self.client.post(reverse('batch'), [
+            {'method': 'POST', 'path': '/books/api/editorial', 'body': {'name': "Editorial Testing 2"}},
+            {'method': 'DELETE', 'path': '/books/api/book/999999'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(changes.head(), seq)
+
+    def test_pagination(self):
+        """
+        Ensure the feed is paginated by seq, with the next page in the Link header.
+        """
+        response = self.get_changes(limit=4)
+        data = response.json()
+        self.assertEqual(len(data['changes']), 4)
+        self.assertTrue(data['more'])
+        self.assertIn(f"since={data['seq']}", next_link(response))
+        response = self.client.get(next_link(response))
+        data = response.json()
+        self.assertEqual(len(data['changes']), 2)
+        self.assertFalse(data['more'])
+        self.assertIsNone(next_link(response))
+
+    def test_prune(self):
+        """
+        Ensure prune_changes compacts the log and that clients behind its retention are told to resync.
+        """
+        seq = changes.head()
+        for name in ("Editorial Testing 2", "Editorial Testing 3"):
+            self.client.put(reverse('editorial-detail', kwargs={'editorial_id': self.editorial.id}), {'name': name}, format='json')
+        before = self.get_changes().json()
+        out = StringIO()
+        call_command('prune_changes', stdout=out)
+        self.assertIn('Deleted 7 superseded and 0 expired changes', out.getvalue())
+        self.assertEqual(self.get_changes().json(), before)
+
+        Change.objects.update(created_at=F('created_at') - datetime.timedelta(days=31))
+        self.author.books.remove(self.books[0])
+        call_command('prune_changes', stdout=StringIO())
+        response = self.client.get(reverse('changes'), {'since': seq})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        horizon = response.json()['horizon']
+        self.assertEqual(horizon, before['seq'])
+        data = self.get_changes(horizon).json()
+        self.assertEqual([(change['type'], change['action']) for change in data['changes']], [
+            ('author', 'upsert'), ('book', 'upsert'), ('author_book', 'unlink'),
+        ])
+
+        call_command('seed_catalog', editorials=1, authors=2, books=2, stdout=StringIO())
+        self.assertEqual(self.client.get(reverse('changes'), {'since': data['seq']}).status_code, status.HTTP_410_GONE)
+
+    def test_snapshot(self):
+        """
+        Ensure a snapshot records the seq of the last change it includes.
+        """
+        with override_settings(BOOKS_API_SNAPSHOT_DIR=temporary_directory(self)):
+            manifest = snapshots.build()
+            self.assertEqual(manifest['changes_seq'], changes.head())
+            with open(os.path.join(snapshots.get_directory(), manifest['files']['identity'])) as f:
+                self.assertEqual(json.load(f)['changes_seq'], changes.head())
+
+
+class GunicornConfigTests(EmptyCacheMixin, APITestCase):
+
+    def read_config(self, **env):
+        with mock.patch.dict(os.environ, env):
+            for name in ('BOOKS_API_ASYNC', 'BOOKS_API_WORKERS', 'BOOKS_API_THREADS'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+
+    def test_worker_model(self):
+        """
+        Ensure the worker class and count follow the available CPUs and the environment.
+        """
+        config = self.read_config()
+        cpus = config['cpus']
+        self.assertEqual((config['worker_class'], config['workers'], config['threads']), ('gthread', cpus + 1, 4))
+        self.assertTrue(config['preload_app'])
+        self.assertEqual((config['max_requests'], config['max_requests_jitter']), (2000, 200))
+        # Within nginx's proxy_read_timeout.
+        self.assertLess(config['timeout'], 60)
+
+        config = self.read_config(BOOKS_API_THREADS='1')
+        self.assertEqual((config['worker_class'], config['workers']), ('sync', 2 * cpus + 1))
+        config = self.read_config(BOOKS_API_ASYNC='1', BOOKS_API_WORKERS='5')
+        self.assertEqual((config['worker_class'], config['wsgi_app'], config['workers']), ('uvicorn_worker.UvicornWorker', 'books.asgi:application', 5))
+        with mock.patch('os.sched_getaffinity', return_value={0, 1, 2, 3}):
+            self.assertLessEqual(self.read_config()['cpus'], 4)
+
+    def test_benchmark_startup(self):
+        """
+        Ensure benchmark_startup starts Gunicorn with the configuration and reports the memory of every worker.
+        """
+        out = StringIO()
+        call_command('benchmark_startup', env=['BOOKS_API_WORKERS=2'], runs=1, duration=0.5, stdout=out)
+        self.assertIn('2 workers ready in', out.getvalue())
+        self.assertRegex(out.getvalue(), r'worker\s+\d+\.\d')
+        self.assertIn('Total PSS', out.getvalue())
+
+
+@override_settings(BOOKS_API_READ_DATABASES=['replica'], BOOKS_API_REPLICA_MAX_LAG=10)
+class ReadReplicaTests(EmptyCacheMixin, APITransactionTestCase):
+    # The replica is written by the backup API, which cannot run while the
+    # test case keeps a transaction open on it.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.directory = temporary_directory(self)
+        directory = override_settings(BOOKS_API_REPLICA_STATE_DIR=self.directory)
+        directory.enable()
+        self.addCleanup(directory.disable)
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book = Book.objects.create(title="Book Testing 1", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+        # Synced before the user and its session exist: they are always
+        # read from the primary.
+        replicas.sync('replica')
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.client.login(username='testuser', password='testing')
+
+    def get_title(self, client=None):
+        response = (client or self.client).get(reverse('book-detail', kwargs={'book_id': self.book.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['title']
+
+    @override_settings(BOOKS_API_CACHE_ENABLED=False)
+    def test_reads(self):
+        """
+        Ensure GET requests read the catalog from the replica, and never from one older than BOOKS_API_REPLICA_MAX_LAG.
+        """
+        Book.objects.filter(pk=self.book.pk).update(title="Book Testing 2")
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.get_title(), "Book Testing 1")
+        self.assertTrue(queries)
+        self.assertEqual(self.client.get(reverse('book-search'), {'q': 'Testing'}).json()[0]['title'], "Book Testing 1")
+        with override_settings(ROOT_URLCONF=AsyncUrlConf):
+            self.assertEqual(self.get_title(), "Book Testing 1")
+        replicas.sync('replica')
+        self.assertEqual(self.get_title(), "Book Testing 2")
+
+        Book.objects.filter(pk=self.book.pk).update(title="Book Testing 3")
+        synced = replicas.synced_at('replica')
+        with mock.patch('time.time', return_value=synced + 10.5):
+            with CaptureQueriesContext(connections['replica']) as queries:
+                self.assertEqual(self.get_title(), "Book Testing 3")
+        self.assertFalse(queries)
+        self.assertIsNone(replicas.choose_database(now=synced + 10.5))
+        self.assertEqual(replicas.choose_database(now=synced + 9.5), 'replica')
+
+    def test_cached_reads(self):
+        """
+        Ensure replica reads are cached only when the replica holds every write they depend on.
+        """
+        User.objects.create_user('otheruser', email='otheruser@test.com', password='testing')
+        other = APIClient()
+        other.login(username='otheruser', password='testing')
+        self.assertEqual(self.get_title(), "Book Testing 1")
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.get_title(), "Book Testing 1")
+        self.assertFalse(queries)
+
+        response = other.put(reverse('book-detail', kwargs={'book_id': self.book.id}), {'title': "Book Testing 2"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The replica predates the write: read, but not stored.
+        for _ in range(2):
+            with CaptureQueriesContext(connections['replica']) as queries:
+                self.assertEqual(self.get_title(), "Book Testing 1")
+            self.assertTrue(queries)
+
+        replicas.sync('replica')
+        self.assertEqual(self.get_title(), "Book Testing 2")
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.get_title(), "Book Testing 2")
+        self.assertFalse(queries)
+
+    def test_read_your_writes(self):
+        """
+        Ensure a client reads its own writes from the primary until the replica has them.
+        """
+        User.objects.create_user('otheruser', email='otheruser@test.com', password='testing')
+        other = APIClient()
+        other.login(username='otheruser', password='testing')
+        response = self.client.put(reverse('book-detail', kwargs={'book_id': self.book.id}), {'title': "Book Testing 2"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(replicas.COOKIE, response.cookies)
+        written = float(self.client.cookies[replicas.COOKIE].value)
+        self.assertIsNone(replicas.choose_database(written))
+        self.assertEqual(self.get_title(), "Book Testing 2")
+        self.assertEqual(self.get_title(other), "Book Testing 1")
+
+        replicas.sync('replica')
+        self.assertEqual(replicas.choose_database(written), 'replica')
+        self.assertEqual(self.get_title(), "Book Testing 2")
+        self.assertEqual(self.get_title(other), "Book Testing 2")
+
+        # Failed writes change nothing, and set no cookie.
+        response = other.put(reverse('book-detail', kwargs={'book_id': self.book.id}), {'pub_date': "nope"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn(replicas.COOKIE, response.cookies)
+
+    def test_changes(self):
+        """
+        Ensure a client syncing from the changes feed of the replica misses nothing, however stale it is.
+        """
+        seq = self.client.get(reverse('changes')).json()['seq']
+        Book.objects.create(title="Book Testing 2", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+        self.assertEqual(self.client.get(reverse('changes'), {'since': seq}).json()['changes'], [])
+        replicas.sync('replica')
+        self.assertEqual(
+            [(change['type'], change['id']) for change in self.client.get(reverse('changes'), {'since': seq}).json()['changes']],
+            [('editorial', self.editorial.id), ('book', Book.objects.get(title="Book Testing 2").id)]
+        )
+
+    def test_sync_replica(self):
+        """
+        Ensure sync_replica only syncs SQLite replicas.
+        """
+        out = StringIO()
+        call_command('sync_replica', stdout=out)
+        self.assertIn('replica synced', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('sync_replica', database=['default'])
+
+
+class GroupCommitTests(EmptyCacheMixin, APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.book = Book.objects.create(title="Book Testing 1", description="Description", pub_date="2020-01-01", editorial=self.editorial)
+        self.authorization = f'Bearer {tokens.issue_token(self.user)}'
+
+    def environ(self, method, path, body):
+        request = self.factory.generic(method, path, json.dumps(body), content_type='application/json', HTTP_AUTHORIZATION=self.authorization)
+        return {key: value for key, value in request.META.items() if isinstance(value, str)}, request.body
+
+    def test_group(self):
+        """
+        Ensure the requests of a group commit together, each with its own response, and that a failing one is rolled back alone.
+        """
+        writer = group_commit.Writer()
+        group = [
+            writer.submit(*self.environ('POST', '/books/api/author', {'firstname': "Firstname", 'lastname': "Lastname", 'birthdate': "1980-01-01"})),
+            writer.submit(*self.environ('PUT', f'/books/api/book/{self.book.id}', {'title': "Book Testing 2"})),
+            writer.submit(*self.environ('PUT', f'/books/api/book/{self.book.id}', {'pub_date': "nope"})),
+            writer.submit(*self.environ('DELETE', '/books/api/editorial/999999', None)),
+            writer.submit(*self.environ('PUT', f'/books/api/editorial/{self.editorial.id}', {'name': "Editorial Testing 2"})),
+        ]
+        # With replicas, the worker sets their cookie once the group committed.
+        with CaptureQueriesContext(connection) as queries, override_settings(BOOKS_API_READ_DATABASES=['replica']):
+            writer.run_group([writer.queue.get_nowait() for _ in group])
+        self.assertTrue(all(pending.done.is_set() for pending in group))
+        self.assertFalse([value for pending in group for name, value in pending.headers if name.lower() == 'set-cookie'])
+        self.assertEqual([pending.status for pending in group], [201, 200, 400, 404, 200])
+        self.assertIn('pub_date', json.loads(group[2].content))
+        self.assertEqual(json.loads(group[0].content)['id'], Author.objects.get().id)
+        self.assertEqual(Book.objects.get().title, "Book Testing 2")
+        self.assertEqual(Editorial.objects.get().name, "Editorial Testing 2")
+        # One transaction: each request runs in a savepoint of its own.
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SAVEPOINT')]), len(group) + 1)
+
+
+class GroupCommitServerTests(EmptyCacheMixin, APITransactionTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.user.save()
+        self.editorial = Editorial.objects.create(name="Editorial Testing 1")
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens.issue_token(self.user)}')
+        self.path = os.path.join(temporary_directory(self), 'writer.sock')
+        enabled = override_settings(BOOKS_API_GROUP_COMMIT=True, BOOKS_API_GROUP_COMMIT_SOCKET=self.path)
+        enabled.enable()
+        self.addCleanup(enabled.disable)
+
+    def test_forward(self):
+        """
+        Ensure write requests are run by the writer process when it runs, and by the worker otherwise.
+        """
+        response = self.client.post(reverse('author-list'), {'firstname': "Firstname", 'lastname': "Lastname", 'birthdate': "1980-01-01"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        writer = group_commit.Writer()
+        server = group_commit.WriterServer(self.path, writer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=writer.run, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        with mock.patch.object(writer, 'run_group', wraps=writer.run_group) as run_group:
+            with override_settings(BOOKS_API_READ_DATABASES=['replica']):
+                response = self.client.put(reverse('editorial-detail', kwargs={'editorial_id': self.editorial.id}), {'name': "Editorial Testing 2"}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['name'], "Editorial Testing 2")
+            self.assertIn(replicas.COOKIE, response.cookies)
+            response = self.client.put(reverse('editorial-detail', kwargs={'editorial_id': self.editorial.id}), {'name': ""}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(run_group.call_count, 2)
+            self.assertEqual(self.client.get(reverse('editorial-detail', kwargs={'editorial_id': self.editorial.id})).json()['name'], "Editorial Testing 2")
+            self.assertEqual(run_group.call_count, 2)
+
+    def test_group_invalidates_once(self):
+        """
+        Ensure the cache tags invalidated by the requests of a group are bumped once, when it commits.
+        """
+        factory = APIRequestFactory()
+        authorization = f'Bearer {tokens.issue_token(self.user)}'
+        writer = group_commit.Writer()
+        for name in ("Editorial Testing 2", "Editorial Testing 3", "Editorial Testing 4"):
+            request = factory.put(f'/books/api/editorial/{self.editorial.id}', {'name': name}, format='json', HTTP_AUTHORIZATION=authorization)
+            writer.submit({key: value for key, value in request.META.items() if isinstance(value, str)}, request.body)
+        cache = response_cache.get_cache()
+        [before] = response_cache.get_generations(cache, ['editorial-list'])
+        with mock.patch.object(response_cache, 'bump', wraps=response_cache.bump) as bump:
+            writer.run_group([writer.queue.get_nowait() for _ in range(3)])
+        [after] = response_cache.get_generations(cache, ['editorial-list'])
+        self.assertGreater(after, before)
+        # Nobody could have cached what the group wrote before it committed.
+        self.assertEqual(sum('editorial-list' in call.args[0] for call in bump.call_args_list), 1)
+        self.assertEqual(Editorial.objects.get().name, "Editorial Testing 4")
@@ -0,0 +1,125 @@
+"""
+Signed bearer tokens.
+
+A token is the user id and the user's token generation (see
+TokenGeneration) signed with SECRET_KEY and timestamped, so checking one
+needs no table: the signature and the age (BOOKS_API_TOKEN_MAX_AGE) are
+verified in memory. What can change after issuing, whether the user is
+still active and its current generation, is read once and then kept by
+each worker for BOOKS_API_TOKEN_CACHE_TTL seconds, so the common case
+costs no query at all.
+
+Revoking bumps the generation. The worker handling the revocation forgets
+the user straight away; the others stop accepting the old tokens when
+their cached entry expires, so within BOOKS_API_TOKEN_CACHE_TTL seconds.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from rest_framework import authentication, exceptions
+
+from .models import TokenGeneration
+
+SALT = 'books_api.tokens'
+KEYWORD = 'Bearer'
+
+
+class PrincipalCache:
+    '''
+    {user id: (expiry, user or None, generation)} of one worker
+    '''
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = {}
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1:]
+
+    def set(self, user_id, user, generation):
+        ttl = getattr(settings, 'BOOKS_API_TOKEN_CACHE_TTL', 30)
+        if len(self.entries) >= self.max_size:
+            self.entries.clear()
+        self.entries[user_id] = (time.monotonic() + ttl, user, generation)
+
+    def forget(self, user_id):
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def get_max_age():
+    return getattr(settings, 'BOOKS_API_TOKEN_MAX_AGE', 24 * 3600)
+
+
+def current_generation(user):
+    return TokenGeneration.objects.filter(user=user).values_list('generation', flat=True).first() or 0
+
+
+def issue_token(user):
+    return signing.dumps({'u': user.pk, 'g': current_generation(user)}, salt=SALT, compress=True)
+
+
+def revoke_tokens(user):
+    '''
+    Invalidates every token issued to `user` so far
+    '''
+    TokenGeneration.objects.get_or_create(user=user)
+    TokenGeneration.objects.filter(user=user).update(generation=F('generation') + 1)
+    transaction.on_commit(lambda: principals.forget(user.pk))
+
+
+def load_principal(user_id):
+    '''
+    Returns (active user or None, current generation), cached per worker
+    '''
+    principal = principals.get(user_id)
+    if principal is None:
+        user = User.objects.filter(pk=user_id, is_active=True).annotate(
+            current_token_generation=Coalesce('token_generation__generation', 0)).first()
+        principal = (user, user.current_token_generation if user else None)
+        principals.set(user_id, *principal)
+    return principal
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    '''
+    Authenticates `Authorization: Bearer <token>` requests with the tokens
+    issued by TokenApiView
+    '''
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            payload = signing.loads(auth[1].decode('ascii'), salt=SALT, max_age=get_max_age())
+            user_id, generation = int(payload['u']), payload['g']
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Token expired.')
+        except (signing.BadSignature, UnicodeDecodeError, KeyError, TypeError, ValueError):
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        user, current = load_principal(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        if generation != current:
+            raise exceptions.AuthenticationFailed('Token revoked.')
+        return user, payload
+
+    def authenticate_header(self, request):
+        return f'{KEYWORD} realm="api"'
@@ -1,18 +1,45 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 #from .views import EditorialListApiView, EditorialDetailApiView, AuthorListApiView, AuthorDetailApiView, BookListApiView, BookDetailApiView, EditorialBookListApiView
 from .views import *
+from . import async_views
 
+# Views replaced by their async version when BOOKS_API_ASYNC is on.
+ASYNC_VIEWS = {
+    EditorialListApiView: async_views.AsyncEditorialListApiView,
+    EditorialDetailApiView: async_views.AsyncEditorialDetailApiView,
+    AuthorListApiView: async_views.AsyncAuthorListApiView,
+    AuthorDetailApiView: async_views.AsyncAuthorDetailApiView,
+    BookListApiView: async_views.AsyncBookListApiView,
+    BookDetailApiView: async_views.AsyncBookDetailApiView,
+}
 
-urlpatterns = [
-    path('api/editorial', EditorialListApiView.as_view(), name="editorial-list"),
-    path('api/editorial/<int:editorial_id>', EditorialDetailApiView.as_view(), name="editorial-detail"),
-    path('api/editorial/<int:editorial_id>/books', EditorialBookListApiView.as_view(), name="editorial-book-list"),
-    path('api/author', AuthorListApiView.as_view(), name="author-list"),
-    path('api/author/<int:author_id>', AuthorDetailApiView.as_view(), name="author-detail"),
-    path('api/author/<int:author_id>/books', AuthorBookListApiView.as_view(), name="author-book-list"),
-    path('api/author/<int:author_id>/book/<int:book_id>', AuthorBookDetailApiView.as_view(), name="author-book-detail"),
-    path('api/book', BookListApiView.as_view(), name="book-list"),
-    path('api/book/<int:book_id>', BookDetailApiView.as_view(), name="book-detail"),
-    path('api/book/<int:book_id>/authors', BookAuthorListApiView.as_view(), name="book-author-list"),
-]
+
+def build_urlpatterns(use_async=False):
+    def view(view_class):
+        if use_async:
+            view_class = ASYNC_VIEWS.get(view_class, view_class)
+        return view_class.as_view()
+
+    return [
+        path('api/editorial', view(EditorialListApiView), name="editorial-list"),
+        path('api/editorial/<int:editorial_id>', view(EditorialDetailApiView), name="editorial-detail"),
+        path('api/editorial/<int:editorial_id>/books', view(EditorialBookListApiView), name="editorial-book-list"),
+        path('api/author', view(AuthorListApiView), name="author-list"),
+        path('api/author/<int:author_id>', view(AuthorDetailApiView), name="author-detail"),
+        path('api/author/<int:author_id>/books', view(AuthorBookListApiView), name="author-book-list"),
+        path('api/author/<int:author_id>/book/<int:book_id>', view(AuthorBookDetailApiView), name="author-book-detail"),
+        path('api/book', view(BookListApiView), name="book-list"),
+        path('api/book/search', view(BookSearchApiView), name="book-search"),
+        path('api/book/<int:book_id>', view(BookDetailApiView), name="book-detail"),
+        path('api/book/<int:book_id>/authors', view(BookAuthorListApiView), name="book-author-list"),
+        path('api/stats', view(StatsApiView), name="stats"),
+        path('api/token', view(TokenApiView), name="token"),
+        path('api/snapshot', view(SnapshotApiView), name="snapshot"),
+        path('api/batch', view(BatchApiView), name="batch"),
+        path('api/changes', view(ChangesApiView), name="changes"),
+    ]
+
+
+urlpatterns = build_urlpatterns(getattr(settings, 'BOOKS_API_ASYNC', False))
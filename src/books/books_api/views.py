@@ -1,25 +1,62 @@
+from django.conf import settings
+from django.db import connections, router
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from django.shortcuts import render,  get_object_or_404
+from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from .models import Book, Author, Editorial
-from .serializers import BookSerializer, AuthorSerializer, EditorialSerializer
-
-class EditorialListApiView(APIView):
+from .models import Book, Author, Change, Editorial
+from .serializers import BookSerializer, AuthorSerializer, EditorialSerializer, BookSearchSerializer
+from .pagination import KeysetPagination
+from .streaming import StreamingListMixin
+from .expansion import BookExpandMixin
+from .bulk import BulkCreateMixin
+from .linking import RelatedSetMixin
+from .conditional import ConditionalMixin
+from .response_cache import cached_response
+from .search import search_books
+from .filters import ListFilterMixin
+from .projection import ValuesListMixin
+from .fieldsets import SparseFieldsetMixin
+from .batch import BatchMixin
+from .sqlite import read_transaction
+from . import changes, metrics, snapshots, stats, tokens
+import os
+
+class EditorialListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, BulkCreateMixin, StreamingListMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['editorial-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['name', 'book_count']
 
+    @cached_response
     def get(self, request, *args, **kwars):
         '''
-        List all the Editorial items in the system
+        List the Editorial items in the system, one page at a time
         '''
+        fields = self.get_fieldset(request, EditorialSerializer)
         editorials = Editorial.objects.all()
-        serializer = EditorialSerializer(editorials, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag, _ = self.get_queryset_validators(request, editorials, fields=fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.stream_response(editorials, EditorialSerializer, context={'fields': fields}), etag)
+        paginator = self.pagination_class()
+        rows = paginator.paginate_values(editorials, EditorialSerializer.value_columns(fields=fields), request, view=self)
+        return self.set_validators(paginator.get_paginated_response(EditorialSerializer.from_values(rows, fields=fields)), etag)
 
     def post(self, request, *args, **kwargs):
         '''
-        Creates an Editorial with given data
+        Creates an Editorial with given data, or one Editorial per item if
+        given a list
         '''
+        if self.is_bulk(request):
+            return self.bulk_create(request, EditorialSerializer, ['name'])
         data = {
             'name': request.data.get('name'), 
         }
@@ -29,29 +66,70 @@ class EditorialListApiView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class EditorialBookListApiView(APIView):
+class EditorialBookListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, BookExpandMixin, StreamingListMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['editorial:{editorial_id}:books']
 
+    @cached_response
     def get(self, request, editorial_id, *args, **kwars):
         '''
         List all Books published by editorial_id
         '''
         editorial = Editorial.objects.get(pk=editorial_id)
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
         books = editorial.book_set.all()
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
-class AuthorBookListApiView(APIView):
+        etag, _ = self.get_queryset_validators(request, books, expand, fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.stream_response(books, BookSerializer, context={'expand': expand, 'fields': fields}), etag)
+        data = self.list_values(books, BookSerializer, expand, fields)
+        return self.set_validators(Response(data, status=status.HTTP_200_OK), etag)
+
+class AuthorBookListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, RelatedSetMixin, BookExpandMixin, StreamingListMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['author:{author_id}:books']
 
+    @cached_response
     def get(self, request, author_id, *args, **kwars):
         '''
         List all Books published by author_id
         '''
         author = Author.objects.get(pk=author_id)
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
         books = author.books.all()
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag, _ = self.get_queryset_validators(request, books, expand, fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.stream_response(books, BookSerializer, context={'expand': expand, 'fields': fields}), etag)
+        data = self.list_values(books, BookSerializer, expand, fields)
+        return self.set_validators(Response(data, status=status.HTTP_200_OK), etag)
+
+    def put(self, request, author_id, *args, **kwars):
+        '''
+        Makes author_id the author of exactly the given list of book ids
+        '''
+        author = get_object_or_404(Author, pk=author_id)
+        return self.change_related(request, author.books, Book, 'set', 'Author-Books')
+
+    def patch(self, request, author_id, *args, **kwars):
+        '''
+        Makes author_id an author for every book in the given list of ids
+        '''
+        author = get_object_or_404(Author, pk=author_id)
+        return self.change_related(request, author.books, Book, 'add', 'Author-Books')
+
+    def delete(self, request, author_id, *args, **kwars):
+        '''
+        Deletes author_id from the list of authors of every given book id
+        '''
+        author = get_object_or_404(Author, pk=author_id)
+        return self.change_related(request, author.books, Book, 'remove', 'Author-Books')
 
 
 class AuthorBookDetailApiView(APIView):
@@ -81,34 +159,82 @@ class AuthorBookDetailApiView(APIView):
             status=status.HTTP_200_OK
         )
 
-class BookAuthorListApiView(APIView):
+class BookAuthorListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, RelatedSetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['book:{book_id}:authors']
 
+    @cached_response
     def get(self, request, book_id, *args, **kwars):
         '''
         List all Authors that published book_id
         '''
+        fields = self.get_fieldset(request, AuthorSerializer)
         book = Book.objects.get(pk=book_id)
         authors = book.author_set.all()
-        serializer = AuthorSerializer(authors, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag, _ = self.get_queryset_validators(request, authors, fields=fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        data = self.list_values(authors, AuthorSerializer, fields=fields)
+        return self.set_validators(Response(data, status=status.HTTP_200_OK), etag)
 
-    
-class AuthorListApiView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+    def put(self, request, book_id, *args, **kwars):
+        '''
+        Makes exactly the given list of author ids the authors of book_id
+        '''
+        book = get_object_or_404(Book, pk=book_id)
+        return self.change_related(request, book.author_set, Author, 'set', 'Book-Authors')
 
-    def get(self, request, *args, **kwars):
+    def patch(self, request, book_id, *args, **kwars):
         '''
-        List all the Author items in the system
+        Adds every author in the given list of ids to the authors of book_id
         '''
-        authors = Author.objects.all()
-        serializer = AuthorSerializer(authors, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        book = get_object_or_404(Book, pk=book_id)
+        return self.change_related(request, book.author_set, Author, 'add', 'Book-Authors')
+
+    def delete(self, request, book_id, *args, **kwars):
+        '''
+        Deletes every author in the given list of ids from the authors of book_id
+        '''
+        book = get_object_or_404(Book, pk=book_id)
+        return self.change_related(request, book.author_set, Author, 'remove', 'Book-Authors')
+
+class AuthorListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, ListFilterMixin, BulkCreateMixin, StreamingListMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['author-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['lastname', 'birthdate', 'book_count']
+    filter_fields = {
+        'lastname_prefix': ('lastname', 'prefix', serializers.CharField()),
+        'birthdate_after': ('birthdate', 'gte', serializers.DateField()),
+        'birthdate_before': ('birthdate', 'lte', serializers.DateField()),
+    }
+
+    @cached_response
+    def get(self, request, *args, **kwars):
+        '''
+        List the Author items in the system, one page at a time
+        '''
+        fields = self.get_fieldset(request, AuthorSerializer)
+        authors = self.filter_queryset(request, Author.objects.all())
+        etag, _ = self.get_queryset_validators(request, authors, fields=fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.stream_response(authors, AuthorSerializer, context={'fields': fields}), etag)
+        paginator = self.pagination_class()
+        page = self.filter_queryset(request, Author.objects.all(), paginator.get_ordering(request, self))
+        rows = paginator.paginate_values(page, AuthorSerializer.value_columns(fields=fields), request, view=self)
+        return self.set_validators(paginator.get_paginated_response(AuthorSerializer.from_values(rows, fields=fields)), etag)
 
     def post(self, request, *args, **kwargs):
         '''
-        Creates an Author with given data
+        Creates an Author with given data, or one Author per item if
+        given a list
         '''
+        if self.is_bulk(request):
+            return self.bulk_create(request, AuthorSerializer, ['firstname', 'lastname', 'birthdate'])
         data = {
             'firstname': request.data.get('firstname'), 
             'lastname': request.data.get('lastname'), 
@@ -120,21 +246,45 @@ class AuthorListApiView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class BookListApiView(APIView):
+class BookListApiView(ValuesListMixin, SparseFieldsetMixin, ConditionalMixin, ListFilterMixin, BulkCreateMixin, BookExpandMixin, StreamingListMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
-
+    cache_tags = ['book-list']
+    pagination_class = KeysetPagination
+    ordering_fields = ['title', 'pub_date', 'author_count']
+    filter_fields = {
+        'pub_date_after': ('pub_date', 'gte', serializers.DateField()),
+        'pub_date_before': ('pub_date', 'lte', serializers.DateField()),
+        'editorial': ('editorial', 'exact', serializers.IntegerField()),
+        'author': ('author', 'exact', serializers.IntegerField()),
+        'title_prefix': ('title', 'prefix', serializers.CharField()),
+    }
+
+    @cached_response
     def get(self, request, *args, **kwars):
         '''
-        List all the Book items in the system
-        '''
-        books = Book.objects.all()
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        List the Book items in the system, one page at a time
+        '''
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
+        books = self.filter_queryset(request, Book.objects.all())
+        etag, _ = self.get_queryset_validators(request, books, expand, fields)
+        not_modified = self.check_preconditions(request, etag)
+        if not_modified is not None:
+            return not_modified
+        if self.wants_stream(request):
+            return self.set_validators(self.stream_response(books, BookSerializer, context={'expand': expand, 'fields': fields}), etag)
+        paginator = self.pagination_class()
+        page = self.filter_queryset(request, Book.objects.all(), paginator.get_ordering(request, self))
+        rows = paginator.paginate_values(page, BookSerializer.value_columns(expand, fields), request, view=self)
+        return self.set_validators(paginator.get_paginated_response(BookSerializer.from_values(rows, expand, fields)), etag)
 
     def post(self, request, *args, **kwargs):
         '''
-        Creates a Book with given data
+        Creates a Book with given data, or one Book per item if
+        given a list
         '''
+        if self.is_bulk(request):
+            return self.bulk_create(request, BookSerializer, ['title', 'description', 'pub_date', 'editorial'])
         data = {
             'title': request.data.get('title'), 
             'description': request.data.get('description'), 
@@ -147,29 +297,59 @@ class BookListApiView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class EditorialDetailApiView(APIView):
+class BookSearchApiView(SparseFieldsetMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['book-list', 'authors']
+
+    @cached_response
+    def get(self, request, *args, **kwargs):
+        '''
+        Searches Books by title, description and author names, best match first
+        '''
+        text = request.query_params.get('q', '')
+        if not text.strip():
+            return Response({"q": ["This field is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        fields = self.get_fieldset(request, BookSearchSerializer)
+        limit = KeysetPagination().get_page_size(request)
+        books = search_books(text, limit)
+        serializer = BookSearchSerializer(books, many=True, context={'fields': fields})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class EditorialDetailApiView(ConditionalMixin, SparseFieldsetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['editorial:{editorial_id}']
 
+    @cached_response
     def get(self, request, editorial_id, *args, **kwargs):
         '''
         Retrieves the Editorial with given editorial_id
         '''
-        editorial = get_object_or_404(Editorial, pk=editorial_id)
-        serializer = EditorialSerializer(editorial)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = self.get_fieldset(request, EditorialSerializer)
+        editorial = get_object_or_404(self.only_queryset(Editorial.objects.all(), EditorialSerializer, fields), pk=editorial_id)
+        etag, last_modified = self.get_instance_validators(editorial, fields=fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = EditorialSerializer(editorial, context={'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
     
     def put(self, request, editorial_id, *args, **kwargs):
         '''
-        Updates the Editorial item with given editorial_id if exists
+        Updates the Editorial item with given editorial_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
         '''
         editorial = get_object_or_404(Editorial, pk=editorial_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(editorial))
+        if precondition_failed is not None:
+            return precondition_failed
         data = {
             'name': request.data.get('name'), 
         }
         serializer = EditorialSerializer(instance = editorial, data=data, partial = True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+            return self.set_validators(response, *self.get_instance_validators(editorial))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, editorial_id, *args, **kwargs):
@@ -183,23 +363,34 @@ class EditorialDetailApiView(APIView):
             status=status.HTTP_200_OK
         )
 
-class AuthorDetailApiView(APIView):
+class AuthorDetailApiView(ConditionalMixin, SparseFieldsetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['author:{author_id}']
 
+    @cached_response
     def get(self, request, author_id, *args, **kwargs):
         '''
         Retrieves the Author with given author_id
         '''
-        author = get_object_or_404(Author, pk=author_id)
-        serializer = AuthorSerializer(author)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = self.get_fieldset(request, AuthorSerializer)
+        author = get_object_or_404(self.only_queryset(Author.objects.all(), AuthorSerializer, fields), pk=author_id)
+        etag, last_modified = self.get_instance_validators(author, fields=fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = AuthorSerializer(author, context={'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
     
 
     def put(self, request, author_id, *args, **kwargs):
         '''
-        Updates the Author item with given author_id if exists
+        Updates the Author item with given author_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
         '''
         author = get_object_or_404(Author, pk=author_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(author))
+        if precondition_failed is not None:
+            return precondition_failed
         
         firstname  = request.data.get('firstname') if request.data.get('firstname') else author.firstname
         lastname   = request.data.get('lastname')  if request.data.get('lastname')  else author.lastname
@@ -214,7 +405,8 @@ class AuthorDetailApiView(APIView):
         serializer = AuthorSerializer(instance = author, data=data, partial = True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+            return self.set_validators(response, *self.get_instance_validators(author))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, author_id, *args, **kwargs):
@@ -227,22 +419,35 @@ class AuthorDetailApiView(APIView):
             status=status.HTTP_200_OK
         )
 
-class BookDetailApiView(APIView):
+class BookDetailApiView(ConditionalMixin, SparseFieldsetMixin, BookExpandMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['book:{book_id}']
 
+    @cached_response
     def get(self, request, book_id, *args, **kwargs):
         '''
         Retrieves the Book with given book_id
         '''
-        book = get_object_or_404(Book, pk=book_id)
-        serializer = BookSerializer(book)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        expand = self.get_expand(request)
+        fields = self.get_fieldset(request, BookSerializer)
+        books = self.only_queryset(self.expand_queryset(Book.objects.all(), expand), BookSerializer, fields, expand)
+        book = get_object_or_404(books, pk=book_id)
+        etag, last_modified = self.get_instance_validators(book, expand, fields)
+        not_modified = self.check_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        serializer = BookSerializer(book, context={'expand': expand, 'fields': fields})
+        return self.set_validators(Response(serializer.data, status=status.HTTP_200_OK), etag, last_modified)
     
     def put(self, request, book_id, *args, **kwargs):
         '''
-        Updates the Book item with given book_id if exists
+        Updates the Book item with given book_id if exists. Honours
+        If-Match / If-Unmodified-Since to avoid lost updates
         '''
         book = get_object_or_404(Book, pk=book_id)
+        precondition_failed = self.check_preconditions(request, *self.get_instance_validators(book))
+        if precondition_failed is not None:
+            return precondition_failed
         
         title       = request.data.get('title')       if request.data.get('title')        else book.title
         description = request.data.get('description') if request.data.get('description')  else book.description
@@ -257,7 +462,8 @@ class BookDetailApiView(APIView):
         serializer = BookSerializer(instance = book, data=data, partial = True)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+            return self.set_validators(response, *self.get_instance_validators(book))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, book_id, *args, **kwargs):
@@ -270,3 +476,125 @@ class BookDetailApiView(APIView):
             {"res": "Book deleted!"},
             status=status.HTTP_200_OK
         )
+
+class StatsApiView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    cache_tags = ['book-list', 'authors', 'editorials']
+
+    @cached_response
+    def get(self, request, *args, **kwargs):
+        '''
+        Returns books per editorial, books per publication year, how many
+        books have 0, 1, 2... authors and the `top` most prolific authors
+        '''
+        top = serializers.IntegerField(min_value=1, max_value=100).run_validation(request.query_params.get('top', 10))
+        return Response(stats.summary(top), status=status.HTTP_200_OK)
+
+class TokenApiView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        '''
+        Issues a bearer token for the authenticated user, to be sent as
+        `Authorization: Bearer <token>` instead of a password or a session
+        '''
+        return Response(
+            {"token": tokens.issue_token(request.user), "expires_in": tokens.get_max_age()},
+            status=status.HTTP_201_CREATED
+        )
+
+    def delete(self, request, *args, **kwargs):
+        '''
+        Revokes every token issued to the authenticated user
+        '''
+        tokens.revoke_tokens(request.user)
+        return Response(
+            {"res": "Tokens revoked!"},
+            status=status.HTTP_200_OK
+        )
+
+class MetricsApiView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        '''
+        Returns the request metrics of every worker in the Prometheus text
+        format
+        '''
+        return HttpResponse(
+            metrics.exposition(metrics.collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+class SnapshotApiView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        '''
+        Returns the latest snapshot of the whole catalog, precompressed in the
+        best encoding the client accepts. Behind nginx, the file is sent by
+        nginx (X-Accel-Redirect) once the request is authenticated here
+        '''
+        manifest = snapshots.read_manifest()
+        if manifest is None:
+            return Response(
+                {"res": "No snapshot yet, try again later."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '30'}
+            )
+        encoding, name = snapshots.choose_file(manifest, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = '"snapshot-{}-{}"'.format(manifest['version'], encoding or 'identity')
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        prefix = getattr(settings, 'BOOKS_API_SNAPSHOT_ACCEL_PREFIX', '')
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif prefix:
+            response = HttpResponse(content_type='application/json')
+            response['X-Accel-Redirect'] = prefix + name
+        else:
+            response = FileResponse(open(os.path.join(snapshots.get_directory(), name), 'rb'), content_type='application/json')
+        if encoding and response.status_code == status.HTTP_200_OK:
+            response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['Cache-Control'] = 'private, no-cache'
+        response['X-Snapshot-Version'] = str(manifest['version'])
+        return response
+
+class BatchApiView(BatchMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        '''
+        Runs the given list of API requests in one transaction and returns
+        the status and body of each one; nothing is saved if any fails
+        '''
+        return self.run_batch(request)
+
+class ChangesApiView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        '''
+        Returns what changed in the catalog after the `since` seq, the latest
+        change of each object only, oldest first. Clients carry on from the
+        returned `seq`; 410 if the log no longer goes back that far
+        '''
+        since = serializers.IntegerField(min_value=0).run_validation(request.query_params.get('since', 0))
+        limit = KeysetPagination().get_page_size(request)
+        with read_transaction(connections[router.db_for_read(Change)]):
+            horizon = changes.horizon()
+            if since < horizon:
+                return Response(
+                    {"res": "Changes up to this seq were pruned, resync from the catalog.", "horizon": horizon},
+                    status=status.HTTP_410_GONE
+                )
+            rows = changes.get_page(since, limit)
+            entries = changes.represent(rows[:limit])
+        more = len(rows) > limit
+        seq = entries[-1]['seq'] if entries else since
+        headers = {}
+        if more:
+            next_link = replace_query_param(request.build_absolute_uri(), 'since', seq)
+            headers['Link'] = f'<{next_link}>; rel="next"'
+        return Response({"changes": entries, "seq": seq, "more": more}, status=status.HTTP_200_OK, headers=headers)
@@ -0,0 +1,128 @@
+"""
+Gunicorn settings for books_api, read by start-server.sh (gunicorn -c).
+
+The app is imported once, in the master, before the workers are forked
+(preload_app): they share its memory copy-on-write instead of each
+importing Django again, and a recycled worker is up in milliseconds.
+
+Worker model, from the CPUs available to the container and the environment:
+
+- BOOKS_API_ASYNC=1: the ASGI app on Uvicorn workers, one per CPU.
+- Otherwise the WSGI app on gthread workers, one per CPU plus one, of
+  BOOKS_API_THREADS (4) threads each. Unlike sync workers, they keep the
+  connections from nginx alive. BOOKS_API_THREADS=1 falls back to sync
+  workers, 2 per CPU plus one.
+- BOOKS_API_WORKERS overrides the number of workers.
+
+Workers are restarted after BOOKS_API_MAX_REQUESTS requests (plus up to
+BOOKS_API_MAX_REQUESTS_JITTER, so they do not all restart at once), which
+bounds how much memory any of them can grow to.
+
+Timeouts are matched to the upstream of nginx.conf: a stuck request is
+killed here (`timeout`) before nginx gives up on it (proxy_read_timeout),
+and the idle keep-alive connections nginx holds are kept here for longer
+than any request can take (`keepalive`).
+"""
+
+import gc
+import math
+import os
+import time
+
+
+def available_cpus():
+    '''
+    The CPUs this process may run on, limited by the cgroup CPU quota
+    containers are usually given
+    '''
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def env_int(name, default):
+    value = os.environ.get(name, '')
+    return int(value) if value.strip() else default
+
+
+def env_flag(name, default):
+    value = os.environ.get(name, '')
+    return value in ('1', 'true') if value.strip() else default
+
+
+cpus = available_cpus()
+asynchronous = env_flag('BOOKS_API_ASYNC', False)
+
+bind = os.environ.get('BOOKS_API_BIND', '127.0.0.1:8010')
+preload_app = env_flag('BOOKS_API_PRELOAD', True)
+
+if asynchronous:
+    wsgi_app = 'books.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    workers = env_int('BOOKS_API_WORKERS', cpus)
+else:
+    wsgi_app = 'books.wsgi:application'
+    threads = env_int('BOOKS_API_THREADS', 4)
+    if threads > 1:
+        worker_class = 'gthread'
+        workers = env_int('BOOKS_API_WORKERS', cpus + 1)
+    else:
+        worker_class = 'sync'
+        workers = env_int('BOOKS_API_WORKERS', 2 * cpus + 1)
+
+max_requests = env_int('BOOKS_API_MAX_REQUESTS', 2000)
+max_requests_jitter = env_int('BOOKS_API_MAX_REQUESTS_JITTER', max_requests // 10)
+
+# nginx.conf: proxy_read_timeout 60s; the idle connections it keeps are
+# closed here.
+timeout = env_int('BOOKS_API_TIMEOUT', 30)
+graceful_timeout = 30
+keepalive = 75
+
+# The heartbeat files the workers keep touching to show they are alive; in
+# memory rather than on the container's overlay filesystem.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+started = time.monotonic()
+
+
+def pre_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    # Imported here: Django is only loaded in the master with preload_app.
+    from django.db import connections
+
+    # A connection opened while loading the app must not be shared.
+    connections.close_all()
+    # Leaves the objects of the loaded app out of the garbage collector's
+    # passes, whose reference updates would copy their pages in every worker.
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # Imported here, as in pre_fork; it only needs the settings, which
+    # are loaded on first use even without preload_app.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'books.settings')
+    from books_api import metrics
+
+    # Or every recycled worker would leave a file behind for /metrics to
+    # read.
+    try:
+        metrics.fold(worker.pid)
+    except OSError:
+        server.log.exception('Could not fold the metrics of worker %s', worker.pid)
+
+
+def post_worker_init(worker):
+    # Read by benchmark_startup.
+    worker.log.info('Worker %s ready %.3fs after start', worker.pid, time.monotonic() - started)
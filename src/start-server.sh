@@ -3,4 +3,26 @@
 if [ -n "$DJANGO_SUPERUSER_USERNAME" ] && [ -n "$DJANGO_SUPERUSER_PASSWORD" ] ; then
     (cd books; python manage.py createsuperuser --no-input)
 fi
-(cd books; gunicorn books.wsgi --user www-data --bind 127.0.0.1:8010 --workers 9) & nginx -g "daemon off;"
+# /metrics adds up the files every worker writes there (see
+# books_api/metrics.py); start from zero.
+rm -rf "${BOOKS_API_METRICS_DIR:-/tmp/books_api_metrics}"
+# Builds the catalog snapshot if there is none, then again after writes
+# (see books_api/snapshots.py).
+(cd books; runuser -u www-data -- python manage.py build_snapshot --watch) &
+# Compacts the changes log and applies its retention once a day (see
+# books_api/changes.py).
+(cd books; while true; do runuser -u www-data -- python manage.py prune_changes; sleep 86400; done) &
+# BOOKS_API_READ_REPLICA=1: GET requests read from a copy of the database,
+# refreshed every few seconds (see books_api/replicas.py).
+if [ "$BOOKS_API_READ_REPLICA" = "1" ] || [ "$BOOKS_API_READ_REPLICA" = "true" ] ; then
+    (cd books; runuser -u www-data -- python manage.py sync_replica --watch) &
+fi
+# BOOKS_API_GROUP_COMMIT=1: one process runs the write requests, in one
+# transaction per group of them (see books_api/group_commit.py).
+if [ "$BOOKS_API_GROUP_COMMIT" = "1" ] || [ "$BOOKS_API_GROUP_COMMIT" = "true" ] ; then
+    install -d -m 700 -o www-data -g www-data "$(dirname "${BOOKS_API_GROUP_COMMIT_SOCKET:-/run/books_api/writer.sock}")"
+    (cd books; runuser -u www-data -- python manage.py run_writer) &
+fi
+# Workers, threads, recycling and timeouts: see books/gunicorn.conf.py
+# (BOOKS_API_ASYNC=1 serves the ASGI app on Uvicorn workers).
+(cd books; gunicorn --config gunicorn.conf.py --user www-data --group www-data) & nginx -g "daemon off;"